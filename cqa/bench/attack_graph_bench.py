@@ -0,0 +1,110 @@
+"""
+-------------------------------------------------------------------------------
+attack_graph_bench.py
+
+Mesure du coût du graphe d'attaque dans la réécriture et dans IsCertain,
+pour des requêtes de 20 atomes et plus.
+
+Deux modes sont comparés :
+  - rebuild : le graphe et le plan d'élimination sont reconstruits à chaque
+              demande (pas de cache),
+  - cached  : caches par forme de requête (à froid : caches vidés avant
+              chaque mesure).
+
+Usage (depuis le dossier cqa) :
+    python -m bench.attack_graph_bench [nb_atomes …]
+
+-------------------------------------------------------------------------------
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+
+from sources.attack_graph import AttackGraph
+from sources.elimination import EliminationPlan
+from sources.IsCertain import is_certain_core
+from sources.rewriter import rewrite_closed
+
+from .workload import _var_name
+
+# Caches par forme de requête comparés par le mode "rebuild"
+CACHES = (AttackGraph.cache, EliminationPlan.cache)
+
+
+def chain_query(n):
+    """
+    Chaîne R0(x0; x1), R1(x1; x2), … avec un atome négatif tous les 5.
+    """
+    names = [_var_name(i) for i in range(n + 1)]
+    query = []
+    for i in range(n):
+        neg = i % 5 == 4
+        query.append((neg, f"R{i}", 1, (names[i], names[i + 1])))
+    return query
+
+
+def chain_database(n, width=3):
+    """
+    Base avec `width` clés par relation, chaque bloc contenant deux faits.
+    """
+    database = []
+    for i in range(n):
+        for k in range(width):
+            database.append((f"R{i}", 1, (f"C{k}", f"C{k}")))
+            database.append((f"R{i}", 1, (f"C{k}", f"C{(k + 1) % width}")))
+    return database
+
+
+def clear_caches():
+    for cache in CACHES:
+        cache.clear()
+
+
+@contextmanager
+def mode(name):
+    sizes = [cache.maxsize for cache in CACHES]
+    clear_caches()
+    if name == "rebuild":
+        for cache in CACHES:
+            cache.maxsize = 0
+    try:
+        yield
+    finally:
+        for cache, maxsize in zip(CACHES, sizes):
+            cache.maxsize = maxsize
+        clear_caches()
+
+
+def timed(fn, repeat=3, cold=False):
+    best = float("inf")
+    for _ in range(repeat):
+        if cold:
+            clear_caches()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(sizes):
+    sys.setrecursionlimit(10000)
+    print(f"{'atomes':>7} {'étape':>10} {'rebuild':>10} "
+          f"{'cached/froid':>13} {'cached':>10} {'gain':>7}")
+    for n in sizes:
+        query, database = chain_query(n), chain_database(n)
+        for label, fn in (("rewrite", lambda: rewrite_closed(query)),
+                          ("iscertain", lambda: is_certain_core(query, database))):
+            times = {}
+            for name in ("rebuild", "cached"):
+                with mode(name):
+                    times[name] = timed(fn)
+            with mode("cached"):
+                times["cold"] = timed(fn, cold=True)
+            print(f"{n:>7} {label:>10} {times['rebuild']:>10.4f} "
+                  f"{times['cold']:>13.4f} {times['cached']:>10.4f} "
+                  f"{times['rebuild'] / times['cached']:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [20, 30, 40])
@@ -0,0 +1,79 @@
+"""
+-------------------------------------------------------------------------------
+sql_bench.py
+
+Compare les moteurs de certitude quand la base grandit :
+  - iscertain : recherche is_certain_core,
+  - fo        : plan FO compilé (evaluator.py),
+  - sqlite    : plan FO compilé traduit en SQL, exécuté par sqlite3
+                (le chargement de la base est mesuré à part).
+
+Usage (depuis le dossier cqa) :
+    python -m bench.sql_bench [nb_personnes …]
+
+-------------------------------------------------------------------------------
+"""
+
+import random
+import sys
+import time
+
+from sources.IsCertain import is_certain_core
+from sources.evaluator import compile_query
+from sources.sql_backend import SQLiteEngine
+
+# Au-delà, is_certain_core devient trop lent pour être mesuré à chaque fois
+ISCERTAIN_MAX_FACTS = 10_000
+
+QUERY = [
+    (False, "Lives", 1, ("p", "t")),
+    (False, "Mayor", 1, ("t", "m")),
+    (True, "Likes", 2, ("p", "m")),
+]
+
+
+def database(n, conflicts=0.1, seed=0):
+    """
+    n personnes, n/10 villes ; une part `conflicts` des blocs a deux faits.
+    """
+    rnd = random.Random(seed)
+    towns = max(2, n // 10)
+    db = []
+    for i in range(n):
+        for _ in range(2 if rnd.random() < conflicts else 1):
+            db.append(("Lives", 1, (f"P{i}", f"T{rnd.randrange(towns)}")))
+        if rnd.random() < 0.5:
+            db.append(("Likes", 2, (f"P{i}", f"M{rnd.randrange(towns)}")))
+    for t in range(towns):
+        for _ in range(2 if rnd.random() < conflicts else 1):
+            db.append(("Mayor", 1, (f"T{t}", f"M{rnd.randrange(towns)}")))
+    return db
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    print(f"{'conflits':>8} {'faits':>8} {'iscertain':>10} {'fo':>10} {'sqlite':>10} "
+          f"{'chargement':>11}  résultat")
+    plan = compile_query(QUERY)
+    for conflicts, n in ((c, n) for c in (0.0, 0.1) for n in sizes):
+        db = database(n, conflicts)
+        r2, t2 = timed(lambda: plan.evaluate(db))
+        engine, t_load = timed(lambda: SQLiteEngine(db))
+        r3, t3 = timed(lambda: engine.certain(QUERY))
+        engine.close()
+        assert r2 == r3, (r2, r3)
+        t1 = "-"
+        if len(db) <= ISCERTAIN_MAX_FACTS:
+            r1, t1 = timed(lambda: is_certain_core(QUERY, db))
+            assert r1 == r2, (r1, r2)
+            t1 = f"{t1:.4f}"
+        print(f"{conflicts:>8} {len(db):>8} {t1:>10} {t2:>10.4f} {t3:>10.4f} {t_load:>11.4f}  {r2}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1_000, 4_000, 16_000, 64_000])
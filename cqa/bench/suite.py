@@ -0,0 +1,239 @@
+"""
+-------------------------------------------------------------------------------
+suite.py
+
+Suite de benchmarks du pipeline CQA sur des charges synthétiques
+(workload.py). Pour chaque charge, chaque étape est mesurée :
+  - parse         : parse() du texte .cqa (base + requête),
+  - attack_graph  : build_attack_graph + detect_cycle (cache vidé),
+  - rewrite       : rewrite_closed (requêtes acycliques seulement),
+  - fo            : compilation et évaluation du plan FO (acycliques),
+  - iscertain     : is_certain_core.
+Le temps retenu est le meilleur de `repeat` exécutions ; le pic mémoire est
+mesuré par tracemalloc sur une exécution à part (tracemalloc ralentit).
+
+Les résultats sont écrits en JSON et peuvent être comparés à une référence
+(baseline) : un temps ou un pic mémoire qui dépasse la référence de plus de
+`tolerance` (en proportion), ou une certitude différente, est signalé et le
+code de sortie vaut 1. La référence dépend de la machine : l'enregistrer
+(--save-baseline) sur la machine qui fera les comparaisons.
+
+Usage (depuis le dossier cqa) :
+    python -m bench.suite [--profile quick|full] [--output résultats.json]
+                          [--baseline bench/baseline.json] [--save-baseline]
+
+-------------------------------------------------------------------------------
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from sources.parseur import parse
+from sources.attack_graph import AttackGraph, build_attack_graph, detect_cycle
+from sources.IsCertain import is_certain_core
+from sources.evaluator import compile_query
+from sources.rewriter import rewrite_closed
+from sources.elimination import EliminationPlan
+
+from .workload import generate_query, generate_database, to_text
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Écart relatif toléré avant de signaler une régression, et écarts absolus
+# en dessous desquels on ne signale rien (bruit de mesure)
+DEFAULT_TOLERANCE = 0.5
+MIN_SECONDS = 0.002
+MIN_BYTES = 64 * 1024
+
+# Charges : paramètres de generate_query et de generate_database
+PROFILES = {
+    "quick": [
+        ("guarded-acyclic-8", dict(atoms=8, key_length=(1, 2), negated=0.25),
+         dict(facts=200, block_size=3, conflicts=0.2, domain=50)),
+        ("weak-acyclic-8", dict(atoms=8, key_length=(1, 2), negated=0.25, guard="weak"),
+         dict(facts=200, block_size=3, conflicts=0.2, domain=50)),
+        ("keyless-acyclic-6", dict(atoms=6, key_length=(0, 1), negated=0.2),
+         dict(facts=100, block_size=3, conflicts=0.3, domain=20)),
+        ("guarded-cyclic-6", dict(atoms=6, key_length=(1, 2), negated=0.2, cyclic=True),
+         dict(facts=50, block_size=2, conflicts=0.2, domain=10)),
+    ],
+    "full": [
+        ("guarded-acyclic-8", dict(atoms=8, key_length=(1, 2), negated=0.25),
+         dict(facts=2_000, block_size=3, conflicts=0.2, domain=500)),
+        ("guarded-acyclic-24", dict(atoms=24, key_length=(1, 3), negated=0.25),
+         dict(facts=500, block_size=3, conflicts=0.2, domain=100)),
+        ("weak-acyclic-16", dict(atoms=16, key_length=(1, 2), negated=0.3, guard="weak"),
+         dict(facts=1_000, block_size=4, conflicts=0.3, domain=200)),
+        ("keyless-acyclic-10", dict(atoms=10, key_length=(0, 1), negated=0.2),
+         dict(facts=500, block_size=3, conflicts=0.3, domain=50)),
+        ("guarded-cyclic-8", dict(atoms=8, key_length=(1, 2), negated=0.25, cyclic=True),
+         dict(facts=200, block_size=2, conflicts=0.2, domain=20)),
+        ("weak-cyclic-8", dict(atoms=8, key_length=(1, 2), negated=0.25, guard="weak",
+                               cyclic=True),
+         dict(facts=200, block_size=2, conflicts=0.2, domain=20)),
+    ],
+}
+
+
+# =============================================================================
+# ------------------------------------------------------------------- Mesures
+def clear_caches():
+    # Graphes d'attaque et plans d'élimination : mesures à froid
+    AttackGraph.cache.clear()
+    EliminationPlan.cache.clear()
+
+
+def measure(fn, repeat=3, setup=None):
+    """
+    :return: (résultat, meilleur temps en secondes, pic mémoire en octets)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, best, peak
+
+
+def run_workload(query_params, database_params, repeat=3, seed=0):
+    """
+    Mesure toutes les étapes sur une charge.
+    :return: dict {facts, atoms, cyclic, certain, stages: {étape: {seconds, peak_bytes}}}
+    """
+    query = generate_query(seed=seed, **query_params)
+    database = generate_database(query, seed=seed, **database_params)
+    text = to_text(query, database)
+    cyclic = query_params.get("cyclic", False)
+    stages = {}
+
+    def record(name, fn, setup=None):
+        result, seconds, peak = measure(fn, repeat, setup)
+        stages[name] = {"seconds": seconds, "peak_bytes": peak}
+        return result
+
+    record("parse", lambda: parse(text))
+    record("attack_graph", lambda: detect_cycle(build_attack_graph(query)),
+           setup=clear_caches)
+    certain = None
+    if not cyclic:
+        record("rewrite", lambda: rewrite_closed(query), setup=clear_caches)
+        certain = record("fo", lambda: compile_query(query).evaluate(database))
+    result = record("iscertain", lambda: is_certain_core(query, database),
+                    setup=clear_caches)
+    if certain is not None and certain != result:
+        raise AssertionError(f"Plan FO et IsCertain en désaccord : {certain} / {result}")
+    return {"atoms": len(query), "facts": len(database), "cyclic": cyclic,
+            "certain": result, "stages": stages}
+
+
+def run(profile="quick", repeat=3, seed=0, out=sys.stdout):
+    """
+    Exécute toutes les charges d'un profil.
+    :return: résultats (sérialisables en JSON)
+    """
+    results = {
+        "meta": {
+            "profile": profile,
+            "repeat": repeat,
+            "seed": seed,
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+        },
+        "workloads": {},
+    }
+    for name, query_params, database_params in PROFILES[profile]:
+        res = run_workload(query_params, database_params, repeat, seed)
+        res["params"] = {"query": query_params, "database": database_params}
+        results["workloads"][name] = res
+        if out is not None:
+            timings = "  ".join(f"{stage} {m['seconds']:.4f}s/{m['peak_bytes'] // 1024}k"
+                                for stage, m in res["stages"].items())
+            print(f"{name:<22} {res['facts']:>7} faits  {timings}", file=out)
+    return results
+
+
+# =============================================================================
+# ----------------------------------------------------------------- Comparaison
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare des résultats à une référence.
+    :return: liste de régressions (charge, étape, mesure, référence, valeur) ;
+        la mesure "certain" signale un résultat différent.
+    """
+    regressions = []
+    for name, old in baseline["workloads"].items():
+        new = results["workloads"].get(name)
+        if new is None:
+            continue
+        if new["certain"] != old["certain"]:
+            regressions.append((name, None, "certain", old["certain"], new["certain"]))
+        for stage, old_m in old["stages"].items():
+            new_m = new["stages"].get(stage)
+            if new_m is None:
+                continue
+            for metric, floor in (("seconds", MIN_SECONDS), ("peak_bytes", MIN_BYTES)):
+                before, after = old_m[metric], new_m[metric]
+                if after > before * (1 + tolerance) and after - before > floor:
+                    regressions.append((name, stage, metric, before, after))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks du pipeline CQA")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="fichier JSON des résultats")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="référence à comparer (ou à écrire avec --save-baseline)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="enregistre les résultats comme nouvelle référence")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    sys.setrecursionlimit(10000)
+    results = run(args.profile, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Référence enregistrée : {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"Pas de référence ({args.baseline}), rien à comparer")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["meta"]["profile"] != args.profile:
+        print(f"Référence du profil {baseline['meta']['profile']}, pas {args.profile}")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for name, stage, metric, before, after in regressions:
+        print(f"RÉGRESSION {name} {stage or ''} {metric} : {before} → {after}")
+    if not regressions:
+        print("Aucune régression par rapport à la référence")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+-------------------------------------------------------------------------------
+workload.py
+
+Générateur de charges synthétiques pour les benchmarks : requêtes et bases
+paramétrées, reproductibles (graine).
+
+Requêtes (generate_query) :
+  - atoms     : nombre d'atomes,
+  - key_length: longueur de clé (entier ou intervalle (min, max)),
+  - negated   : part des atomes négatifs,
+  - guard     : "guarded" (NGFO) ou "weak" (weakly-guarded, pas NGFO),
+  - cyclic    : graphe d'attaque cyclique ou non.
+Les atomes positifs forment une chaîne R0(x0; x1), R1(x1; x2), …, enrichie
+de variables propres à chaque atome (et d'une arête retour si cyclique) ;
+les atomes négatifs sont gardés par les positifs. Chaque requête générée est vérifiée (is_guarded, detect_cycle) et
+régénérée avec une autre graine si elle n'a pas les propriétés demandées.
+
+Bases (generate_database) :
+  - facts     : nombre de faits par relation,
+  - block_size: taille maximale d'un bloc en conflit,
+  - conflicts : part des blocs en conflit (plus d'un fait pour la clé),
+  - domain    : nombre de constantes.
+
+to_text(query, database) produit le texte .cqa correspondant (pour mesurer
+le parseur).
+
+-------------------------------------------------------------------------------
+"""
+
+import random
+from itertools import count
+
+from sources.ngfo import is_guarded
+from sources.attack_graph import build_attack_graph, detect_cycle
+
+# Nombre de graines essayées avant d'abandonner une combinaison de paramètres
+MAX_ATTEMPTS = 200
+
+
+def _var_name(i, prefix="x"):
+    # IsCertain ne reconnaît comme variables que les identifiants alphabétiques
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    name = ""
+    while True:
+        name += letters[i % 26]
+        i //= 26
+        if not i:
+            return prefix + name
+
+
+def _pick(rnd, value):
+    # Entier fixe ou intervalle (min, max)
+    return rnd.randint(*value) if isinstance(value, tuple) else value
+
+
+# =============================================================================
+# -------------------------------------------------------------------- Requêtes
+def generate_query(atoms=6, key_length=1, negated=0.2, guard="guarded",
+                   cyclic=False, seed=0):
+    """
+    Requête synthétique (liste (neg, pred, pk_len, args)) ayant les propriétés
+    demandées.
+    :raises ValueError: paramètres invalides, ou aucune requête trouvée en
+        MAX_ATTEMPTS essais.
+    """
+    if guard not in ("guarded", "weak"):
+        raise ValueError(f"guard inconnu : {guard}")
+    nb_neg = round(atoms * negated)
+    if guard == "weak":
+        nb_neg = max(nb_neg, 1)
+    nb_pos = atoms - nb_neg
+    # Un cycle demande au moins deux atomes dans la chaîne, le triangle des
+    # weakly-guarded deux atomes de plus
+    nb_chain = nb_pos - 2 if guard == "weak" else nb_pos
+    if nb_chain < (2 if cyclic else 1):
+        raise ValueError("Pas assez d'atomes positifs pour ces paramètres")
+
+    expected = "NGFO" if guard == "guarded" else "WG"
+    for attempt in range(MAX_ATTEMPTS):
+        rnd = random.Random(f"{seed}/{attempt}")
+        query = _draw_query(rnd, nb_pos, nb_neg, key_length, guard, cyclic)
+        if query is None:
+            continue
+        if is_guarded(query)[1] != expected:
+            continue
+        if detect_cycle(build_attack_graph(query)) != cyclic:
+            continue
+        return query
+    raise ValueError(f"Aucune requête trouvée pour ces paramètres ({MAX_ATTEMPTS} essais)")
+
+
+def _draw_query(rnd, nb_pos, nb_neg, key_length, guard, cyclic):
+    # Les variables partagées entre atomes éloignés créent vite des cycles
+    # d'attaque : hors de la chaîne, les variables ajoutées sont propres à
+    # leur atome (y…).
+    private = (_var_name(i, "y") for i in count())
+    nb_chain = nb_pos - 2 if guard == "weak" else nb_pos
+    names = [_var_name(i) for i in range(nb_chain + 1)]
+    positives = []
+    for i in range(nb_chain):
+        pk = _pick(rnd, key_length)
+        if pk:
+            key, rest = [names[i]] + [next(private) for _ in range(pk - 1)], [names[i + 1]]
+        else:
+            key, rest = [], [names[i], names[i + 1]]
+        if rnd.random() < 0.4:
+            rest.append(next(private))
+        positives.append((False, f"R{i}", len(key), tuple(key + rest)))
+    if cyclic:
+        # Arête retour : le dernier atome attaque le premier
+        neg, pred, pk, args = positives[-1]
+        positives[-1] = (neg, pred, pk, args + (names[0],))
+
+    negatives = []
+    if guard == "weak":
+        # Triangle x0, x1, w : chaque paire est gardée (R0, G0, G1) mais aucun
+        # atome ne contient les trois
+        w = next(private)
+        positives.append((False, "G0", 2, (names[1], w)))
+        positives.append((False, "G1", 1, (names[0], w)))
+        negatives.append((True, "N0", min(_pick(rnd, key_length), 3), (names[0], names[1], w)))
+
+    order = {v: i for i, v in enumerate(names)}
+    while len(negatives) < nb_neg:
+        guard_atom = rnd.choice(positives)
+        variables = list(dict.fromkeys(guard_atom[3]))
+        variables = rnd.sample(variables, rnd.randint(1, min(3, len(variables))))
+        if not cyclic:
+            # Clé en tête de chaîne : un atome négatif n'attaque alors pas
+            # les atomes positifs qui le précèdent
+            variables.sort(key=lambda v: order.get(v, len(order)))
+        pk = min(_pick(rnd, key_length), len(variables))
+        negatives.append((True, f"N{len(negatives)}", pk, tuple(variables)))
+
+    query = positives + negatives
+    rnd.shuffle(query)
+    return query
+
+
+# =============================================================================
+# ----------------------------------------------------------------------- Bases
+def generate_database(query, facts=100, block_size=2, conflicts=0.2, domain=50,
+                      seed=0):
+    """
+    Base synthétique pour les relations de `query` : `facts` faits par
+    relation environ, répartis en blocs (faits de même clé). Une part
+    `conflicts` des blocs a entre 2 et `block_size` faits, les autres un seul.
+    Les valeurs sont tirées parmi `domain` constantes.
+    :return: liste (pred, pk_len, args), comme la @database parsée.
+    """
+    rnd = random.Random(seed)
+    constants = [f"D{i}" for i in range(domain)]
+    database = []
+    for _, pred, pk, args in query:
+        seen = set()
+        produced = 0
+        while produced < facts:
+            key = tuple(rnd.choice(constants) for _ in range(pk))
+            if key in seen and len(seen) < domain ** pk:
+                continue
+            seen.add(key)
+            size = rnd.randint(2, block_size) if block_size > 1 and rnd.random() < conflicts else 1
+            rows = {key + tuple(rnd.choice(constants) for _ in range(len(args) - pk))
+                    for _ in range(size)}
+            for row in rows:
+                database.append((pred, pk, row))
+            produced += len(rows)
+    return database
+
+
+def to_text(query, database):
+    """
+    Texte .cqa (sections @database et @query) de la requête et de la base.
+    """
+    def atom(pred, pk, args):
+        return f"{pred}({', '.join(args[:pk])}; {', '.join(args[pk:])})"
+
+    lines = ["@database"]
+    lines.extend(atom(*fact) for fact in database)
+    lines.append("")
+    lines.append("@query")
+    lines.extend(("not " if neg else "") + atom(pred, pk, args)
+                 for neg, pred, pk, args in query)
+    return "\n".join(lines) + "\n"
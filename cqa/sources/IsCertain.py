@@ -7,7 +7,15 @@ Il prend en entrée une requête et une base de données.
 
 --------------------------------------------------------------------------------
 """
-from .attack_graph import build_attack_graph
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .attack_graph import AttackGraph, _is_variable as _is_graph_variable
+from .factstore import FactStore
+from .cache import LRUCache, canonical_query
+from .tracing import as_tracer, STEPS, DEBUG
+from .elimination import EliminationPlan, KEY, ALL_KEY, STUCK
+from .planner import plan_join
 
 # -----------------------------------------------------------------------------
 #  Helpers génériques
@@ -38,6 +46,13 @@ def is_all_key(query):
     return all(is_all_key_atom(a) for a in query)
 
 
+def positive_relations(query):
+    """
+    Relations (pred, pk_len) des atomes positifs de `query`.
+    """
+    return {(pred, pk_len) for neg, pred, pk_len, _ in query if not neg}
+
+
 def build_db_dict(database):
     """
     Convertit la liste parsée  [(pred, pk_len, args), …]  en  {pred: [fact, …]}.
@@ -48,6 +63,26 @@ def build_db_dict(database):
     return db
 
 
+def matching_facts(db, pred, args, env=None):
+    """
+    Faits de `pred` compatibles avec les positions liées de `args` : les
+    constantes et les variables déjà liées dans `env`. La recherche passe par
+    un index du FactStore au lieu de parcourir toute la relation.
+    Les variables libres répétées restent à vérifier avec unify_tuple.
+    """
+    env = env or {}
+    positions, values = [], []
+    for i, t in enumerate(args):
+        if is_variable(t):
+            if t in env:
+                positions.append(i)
+                values.append(env[t])
+        else:
+            positions.append(i)
+            values.append(t)
+    return db.lookup(pred, positions, values)
+
+
 def unify_tuple(template, fact, bindings):
     """
     Essaie d’unifier `template` (tuple de termes) avec un `fact` concret sous
@@ -70,40 +105,32 @@ def unify_tuple(template, fact, bindings):
 # (lignes 1–2 de l’algo)
 
 def db_satisfies(query, db):
-    pos = [a for a in query if not a[0]]
-    neg = [a for a in query if a[0]]
-
-    def backtrack(i, env):
-        if i == len(pos):
-            # Tous les positifs sont satisfaits ; vérifions les négatifs
-            for _, pred, _, args in neg:
-                for fact in db.get(pred, []):
-                    if unify_tuple(args, fact, env) is not None:
-                        return False
-            return True
-
-        _negflag, pred, _, args = pos[i]   # ←   changement ici
-        for fact in db.get(pred, []):
-            env2 = unify_tuple(args, fact, env)
-            if env2 is not None and backtrack(i + 1, env2):
-                return True
-        return False
+    """
+    True ssi la conjonction `query` a une correspondance dans `db`. L'ordre
+    des atomes est choisi par le planificateur d'après les statistiques de
+    la base (voir planner.py et explain_satisfies).
+    """
+    db = FactStore.wrap(db)
+    return plan_join(query, db).satisfiable(db)
+
 
-    return backtrack(0, {})
+def explain_satisfies(query, db):
+    """
+    Plan de jointure utilisé par db_satisfies pour `query` sur `db`.
+    """
+    return plan_join(query, FactStore.wrap(db))
 
 
 # -----------------------------------------------------------------------------
 #  Sélection d’un atome non-all-key et unattacked
 
-def select_unattacked_non_all_key_atom(query, trace=None):
-    g = build_attack_graph(query, trace=None) # on ne veut pas de trace ici
-    indeg = {a: 0 for a in query}
-    for src, outs in g.items():
-        for tgt in outs:
-            indeg[tgt] += 1
+def select_unattacked_non_all_key_atom(query, trace=None, graph=None):
+    # Graphe d'attaque en cache (par forme de requête), pas de trace ici
+    if graph is None:
+        graph = AttackGraph.of(query)
 
-    for atom in query:
-        if not is_all_key_atom(atom) and indeg[atom] == 0:
+    for i, atom in enumerate(query):
+        if not is_all_key_atom(atom) and graph.indegree[i] == 0:
             return atom
 
     # secours : prend simplement le premier non-all-key
@@ -117,16 +144,50 @@ def select_unattacked_non_all_key_atom(query, trace=None):
 # -----------------------------------------------------------------------------
 #  Sous-routines pour les valuations
 
+def key_guard(query, atom):
+    """
+    Atome dont les faits fournissent les valeurs de la clé de `atom`
+    (branche A) : `atom` lui-même s'il est positif. Les blocs d'un atome
+    négatif ne couvrent pas les valeurs pour lesquelles il est vrai : on lit
+    alors le premier atome positif de `query` qui contient toutes les
+    variables de sa clé (l'atome lui-même s'il n'y en a pas).
+    """
+    neg, _, pk_len, args = atom
+    if not neg:
+        return atom
+    key = {t for t in args[:pk_len] if is_variable(t)}
+    return next((a for a in query if not a[0] and key <= set(a[3])), atom)
+
+
+def guard_valuations(guard, key_vars, db):
+    """
+    Valuations distinctes des variables `key_vars` sur les faits de `guard`
+    (atome positif) compatibles avec ses constantes et ses répétitions.
+    """
+    _, pred, _, args = guard
+    const_pos = [i for i, t in enumerate(args) if not is_variable(t)]
+    vals = {}
+    for fact in db.lookup(pred, const_pos, [args[i] for i in const_pos]):
+        theta = unify_tuple(args, fact, {})
+        if theta is not None:
+            theta = {v: theta[v] for v in key_vars}
+            vals.setdefault(tuple(theta.values()), theta)
+    return list(vals.values())
+
+
 def key_valuations(atom, db):
     _, pred, pk_len, args = atom
     key_positions = range(pk_len)
     vals = []
 
-    for fact in db.get(pred, []):
+    # Une valuation par bloc de clé : seuls les blocs compatibles avec les
+    # constantes de la clé sont lus (blocs de clé du FactStore)
+    const_pos = [i for i in key_positions if not is_variable(args[i])]
+    for key in db.blocks(pred, pk_len).keys(const_pos, [args[i] for i in const_pos]):
         theta = {}
         ok = True
         for idx in key_positions:
-            t, c = args[idx], fact[idx]
+            t, c = args[idx], key[idx]
             if is_variable(t):
                 if t in theta and theta[t] != c:
                     ok = False
@@ -148,142 +209,502 @@ def apply_valuation(query, theta):
     return new_q
 
 
+def _follow(cursor, constants):
+    """
+    Position suivante dans le plan d'élimination, sauf si une des constantes
+    substituées ressemble elle-même à une variable (la forme de la requête
+    n'est alors plus celle prévue par le plan : il sera recalculé).
+    """
+    if any(_is_graph_variable(c) for c in constants):
+        return None
+    return cursor
+
+
 # -----------------------------------------------------------------------------
 #  Générateur de relations fraîches E1, E2, …
 
-_rel_counter = 0
-def fresh_relation():
-    global _rel_counter
-    _rel_counter += 1
-    return f"E{_rel_counter}"
+def fresh_relation(query):
+    # Premier Ei absent de la requête : le nom ne dépend que du chemin de la
+    # recherche (même trace d'un appel à l'autre, y compris dans un worker)
+    preds = {pred for _, pred, _, _ in query}
+    n = 1
+    while f"E{n}" in preds:
+        n += 1
+    return f"E{n}"
+
+
+# -----------------------------------------------------------------------------
+#  Mémoïsation des sous-résultats
+
+# Nombre maximal de sous-résultats gardés par appel à is_certain_core
+DEFAULT_MEMO_SIZE = 100_000
+
+# En dessous de ce nombre de faits, le mode parallèle reste séquentiel : le
+# démarrage des processus et l'envoi de la base coûteraient plus cher.
+PARALLEL_MIN_FACTS = 5_000
+
+# Fréquence (en appels) du test d'annulation dans les processus de travail
+_CANCEL_CHECK_EVERY = 256
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Branches:
+    """
+    Issue d'un appel à _is_certain qui dépend de sous-appels : les branches
+    `tasks` (voir _Search.explore) à évaluer dans l'ordre jusqu'à la première
+    qui vaut `stop_on`. Le résultat est alors `stop_on`, sinon `not stop_on`.
+    `found` et `exhausted` sont les libellés de trace des deux conclusions.
+    """
+    __slots__ = ("tasks", "stop_on", "found", "exhausted")
+
+    def __init__(self, tasks, stop_on, found, exhausted):
+        self.tasks = tasks
+        self.stop_on = stop_on
+        self.found = found
+        self.exhausted = exhausted
+
+
+# Marqueur : l'appel ouvert attend le résultat de ses branches
+_PENDING = object()
+
+
+class _Search:
+    """
+    État partagé par tous les appels d'un même is_certain_core : la trace,
+    la table de mémoïsation et les compteurs (appels, valuations essayées,
+    faits parcourus, profondeur maximale, relations fraîches).
+    La clé du mémo est la requête résiduelle sous forme canonique (variables
+    renommées) et l'identifiant de la couche de base utilisée (les overlays
+    E1, E2, … ont chacun le leur).
+    `cancel` (Event) interrompt la recherche quand il est levé : utilisé par
+    les processus du mode parallèle.
+
+    Les appels imbriqués sont gérés sur une pile explicite (solve) : pas de
+    limite de profondeur, et un niveau ne coûte qu'une entrée de pile au
+    lieu de plusieurs cadres Python. _RecursiveSearch garde la version
+    récursive, comme référence.
+    """
+
+    def __init__(self, trace, memo_size, cancel=None):
+        self.trace = as_tracer(trace)
+        self.memo = LRUCache(memo_size)
+        self.cancel = cancel
+        self._calls = 0
+        self.calls = 0
+        self.valuations = 0
+        self.facts_scanned = 0
+        self.fresh_relations = 0
+        self.depth = 0
+        self.max_depth = 0
+
+    def solve(self, query, db, cursor=None):
+        # Pile de (clé du mémo, branches, base) des appels ouverts ; `value`
+        # est le résultat du dernier appel terminé, ou _PENDING juste après
+        # l'ouverture d'un appel.
+        trace = self.trace
+        stack = []
+        value = self._open(query, db, cursor, stack)
+        while stack:
+            key, branches, db = stack[-1]
+            if value is _PENDING or value != branches.stop_on:
+                task = next(branches.tasks, None)
+                if task is not None:
+                    label, query, extra, cursor = task
+                    if trace.steps:
+                        trace(STEPS, *label)
+                    value = self._open(query, db.overlay(*extra) if extra else db,
+                                       cursor, stack)
+                    continue
+                found = False
+            else:
+                found = True
+            stack.pop()
+            value = self._conclude(branches, found)
+            self.memo.put(key, value)
+        return value
+
+    def _open(self, query, db, cursor, stack):
+        # Ouvre un appel : résultat immédiat (mémo, cas de base), ou _PENDING
+        # si ses branches ont été empilées.
+        key = self._check(query, db)
+        cached = self.memo.get(key)
+        if cached is not None:
+            if self.trace.debug:
+                self.trace(DEBUG, "== Résultat mémorisé pour : {} → {}", query, cached)
+            return cached
+        self._enter(len(stack) + 1)
+        outcome = _is_certain(query, db, self, cursor)
+        if outcome.__class__ is bool:
+            self.memo.put(key, outcome)
+            return outcome
+        found = self._delegate(outcome, db)
+        if found is None:
+            outcome.tasks = iter(outcome.tasks)
+            stack.append((key, outcome, db))
+            return _PENDING
+        result = self._conclude(outcome, found)
+        self.memo.put(key, result)
+        return result
+
+    def _check(self, query, db):
+        # Test d'annulation et clé du mémo
+        if self.cancel is not None:
+            self._calls += 1
+            if self._calls % _CANCEL_CHECK_EVERY == 0 and self.cancel.is_set():
+                raise _Cancelled
+        return (canonical_query(query, is_variable), db.token)
+
+    def _enter(self, depth):
+        self.calls += 1
+        self.depth = depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _delegate(self, branches, db):
+        # Point d'extension : évalue les branches hors de la pile et renvoie
+        # True si l'une vaut stop_on, ou None pour les empiler (cas général).
+        return None
+
+    def _conclude(self, branches, found):
+        if self.trace.steps:
+            self.trace(STEPS, *(branches.found if found else branches.exhausted))
+        return branches.stop_on if found else not branches.stop_on
+
+    def explore(self, tasks, db, stop_on):
+        """
+        Évalue les branches `tasks` dans l'ordre et s'arrête à la première
+        dont le résultat vaut `stop_on` (True pour une disjonction, False
+        pour une conjonction). Chaque tâche est (libellé, requête, relation
+        ajoutée (pred, faits) ou None, position dans le plan d'élimination
+        ou None) ; le libellé est un tuple (modèle, arguments…), formaté
+        seulement si la trace le garde.
+        :return: True si une branche a donné `stop_on`.
+        """
+        trace = self.trace
+        for label, query, extra, cursor in tasks:
+            if trace.steps:
+                trace(STEPS, *label)
+            if self.solve(query, db.overlay(*extra) if extra else db, cursor) == stop_on:
+                return True
+        return False
+
+    def counters(self):
+        """
+        Compteurs de la recherche (voir metrics.SEARCH_COUNTERS).
+        """
+        return {
+            "calls": self.calls,
+            "valuations": self.valuations,
+            "facts_scanned": self.facts_scanned,
+            "max_depth": self.max_depth,
+            "fresh_relations": self.fresh_relations,
+            "memo_hits": self.memo.hits,
+            "memo_misses": self.memo.misses,
+        }
+
+
+class _RecursiveSearch(_Search):
+    """
+    Version récursive de référence (solve → _is_certain → explore → solve),
+    gardée pour les tests différentiels. Limitée par la profondeur de
+    récursion de Python.
+    """
+
+    def solve(self, query, db, cursor=None):
+        key = self._check(query, db)
+        cached = self.memo.get(key)
+        if cached is not None:
+            if self.trace.debug:
+                self.trace(DEBUG, "== Résultat mémorisé pour : {} → {}", query, cached)
+            return cached
+        depth = self.depth
+        self._enter(depth + 1)
+        try:
+            result = _is_certain(query, db, self, cursor)
+            if result.__class__ is not bool:
+                result = self._conclude(result, self.explore(result.tasks, db, result.stop_on))
+        finally:
+            self.depth = depth
+        self.memo.put(key, result)
+        return result
+
+
+# -----------------------------------------------------------------------------
+#  Exploration parallèle des branches
+
+# État d'un processus de travail (fixé par _init_worker)
+_worker = {}
+
+
+def _init_worker(db, cancel, memo_size):
+    _worker["db"] = db
+    _worker["search"] = _Search(None, memo_size, cancel)
+
+
+def _run_branch(query, extra, cursor):
+    """
+    Évalue une branche dans un processus de travail.
+    :return: (résultat ou None si annulée, compteurs de cette branche)
+    """
+    search = _worker["search"]
+    db = _worker["db"]
+    search.max_depth = 0
+    before = search.counters()
+    try:
+        result = search.solve(query, db.overlay(*extra) if extra else db, cursor)
+    except _Cancelled:
+        result = None
+    counters = {name: value - before[name] for name, value in search.counters().items()}
+    counters["max_depth"] = search.max_depth
+    return result, counters
+
+
+class _ParallelSearch(_Search):
+    """
+    Recherche dont les branches (valuations de la branche A, ajouts de ¬E et
+    thetas de la branche B) sont réparties sur un pool de processus, au
+    premier niveau qui en a au moins deux. Chaque processus reçoit la base
+    une fois et garde son propre mémo.
+    Dès qu'une branche donne le résultat décisif, l'événement d'annulation
+    est levé : les branches en attente sont abandonnées et celles en cours
+    s'arrêtent au prochain test.
+    """
+
+    def __init__(self, trace, memo_size, workers):
+        super().__init__(trace, memo_size)
+        self.workers = workers
+        self.worker_counters = {}
+
+    def _delegate(self, branches, db):
+        tasks = branches.tasks = list(branches.tasks)
+        if len(tasks) < 2:
+            return None
+        return self._explore_parallel(tasks, db, branches.stop_on)
+
+    def _explore_parallel(self, tasks, db, stop_on):
+        trace = self.trace
+        if trace.steps:
+            trace(STEPS, "   - Exploration parallèle : {} branches, {} processus",
+                  len(tasks), self.workers)
+        context = multiprocessing.get_context()
+        cancel = context.Event()
+        found = False
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(db, cancel, self.memo.maxsize)) as pool:
+            futures = {pool.submit(_run_branch, query, extra, cursor): label
+                       for label, query, extra, cursor in tasks}
+            for future in as_completed(futures):
+                result, counters = future.result()
+                self._merge(counters)
+                if trace.steps:
+                    label = futures[future]
+                    trace(STEPS, label[0] + " → {}", *label[1:], result)
+                if result == stop_on:
+                    found = True
+                    cancel.set()
+                    for other in futures:
+                        other.cancel()
+                    break
+        return found
+
+    def _merge(self, counters):
+        # Profondeur d'une branche : comptée à partir du niveau courant
+        merged = self.worker_counters
+        for name, value in counters.items():
+            if name == "max_depth":
+                merged[name] = max(merged.get(name, 0), self.depth + value)
+            else:
+                merged[name] = merged.get(name, 0) + value
+
+    def counters(self):
+        counters = super().counters()
+        for name, value in self.worker_counters.items():
+            if name == "max_depth":
+                counters[name] = max(counters[name], value)
+            else:
+                counters[name] += value
+        return counters
 
 
 # -----------------------------------------------------------------------------
 #  Algo Principal  :  is_certain_core
 
-def is_certain_core(query, database_or_dict, trace=None):
+def is_certain_core(query, database_or_dict, trace=None,
+                    memo_size=DEFAULT_MEMO_SIZE, stats=None, workers=None,
+                    parallel_min_facts=PARALLEL_MIN_FACTS, recursive=False, plan=None):
     """
     Implémentation de l'algorithme "IsCertain" pour une requête donnée.
 
     query      : [(neg, pred, pk_len, args), …]
-    database   : soit la liste parsée par @database, soit déjà un dict {pred: […]}
-    trace      : liste dans laquelle on stocke les étapes de l’algorithme
+    database   : la liste parsée par @database, un dict {pred: […]} ou un FactStore
+    trace      : Tracer (voir tracing.py) recevant les étapes de l’algorithme,
+                 ou une liste (compatibilité) ; None = pas de trace
+    memo_size  : nombre maximal de sous-résultats mémorisés (None = sans borne,
+                 0 = pas de mémo)
+    stats      : dict optionnel, complété avec les compteurs de la recherche
+                 (calls, valuations, facts_scanned, max_depth, fresh_relations,
+                 memo_hits, memo_misses ; processus du mode parallèle compris ;
+                 facts_scanned compte un bloc de clé lu comme un fait)
+    workers    : nombre de processus pour explorer en parallèle les branches
+                 du premier niveau (None ou 1 = séquentiel)
+    parallel_min_facts : en dessous de ce nombre de faits, la recherche reste
+                 séquentielle même si workers > 1
+    recursive  : utilise la version récursive de référence (tests
+                 différentiels) au lieu de la pile explicite
+    plan       : plan d'élimination de la requête (voir elimination.py), par
+                 exemple relu par EliminationPlan.from_dict ; par défaut
+                 celui du cache
     Renvoie True ssi la requête est vraie dans toutes les repairs de la BD.
     """
-    if trace is None:
-        trace = []
-
-    trace.append(f"== Appel is_certain_core sur requête : {query}")
-
-    db = (database_or_dict if isinstance(database_or_dict, dict)
-          else build_db_dict(database_or_dict))
-
-    # (0-bis) Base déjà conforme
-    all_keys_ok = all(len({fact[:pk_len] for fact in db.get(pred, [])}) == len(db.get(pred, []))
-                     for pred, pk_len in {(a[1], a[2]) for a in query})
+    if plan is None:
+        plan = EliminationPlan.of(query)
+    elif not plan.matches(query):
+        raise ValueError("Le plan d'élimination ne correspond pas à la requête")
+    db = FactStore.wrap(database_or_dict)
+    if recursive:
+        search = _RecursiveSearch(trace, memo_size)
+    elif workers is not None and workers > 1 and len(db) >= parallel_min_facts:
+        search = _ParallelSearch(trace, memo_size, workers)
+    else:
+        search = _Search(trace, memo_size)
+    result = search.solve(query, db, (plan, 0))
+    if stats is not None:
+        stats.update(search.counters())
+    return result
+
+
+def _is_certain(query, db, search, cursor=None):
+    # `cursor` : (plan d'élimination, numéro de l'étape) prévu pour `query`,
+    # ou None pour le recalculer depuis la requête
+    trace = search.trace
+    if trace.debug:
+        trace(DEBUG, "== Appel is_certain_core sur requête : {}", query)
+
+    # (0-bis) Base déjà conforme : lu sur les blocs de clé, calculés une
+    # fois par base
+    all_keys_ok = True
+    for pred, pk_len in {(a[1], a[2]) for a in query}:
+        if db.blocks(pred, pk_len).conflicts:
+            all_keys_ok = False
+            break
     if all_keys_ok:
-        trace.append(" - Base déjà conforme aux clés primaires → évaluation directe")
         result = db_satisfies(query, db)
-        trace.append(f" → Résultat FO direct : {result}")
+        if trace.steps:
+            trace(STEPS, " - Base déjà conforme aux clés primaires → évaluation directe")
+            trace(STEPS, " → Résultat FO direct : {}", result)
         return result
 
     # 0) Requête vide
     if not query:
-        trace.append(" - Requête vide → True")
+        if trace.steps:
+            trace(STEPS, " - Requête vide → True")
         return True
 
-    # 1) Tous les atomes sont all-key
-    if is_all_key(query):
-        trace.append(" - Tous les atomes sont all-key → évaluation FO directe")
-        result = db_satisfies(query, db)
-        trace.append(f" → Résultat FO : {result}")
+    if cursor is None:
+        cursor = (EliminationPlan.of(query), 0)
+    plan, k = cursor
+    step = plan.steps[k]
+    following = (plan, k + 1)
+
+    # 1) Tous les atomes sont all-key : un atome positif n'est certain que
+    # sur un fait fixe (seul dans son bloc), un atome négatif que si aucun
+    # fait de la base ne le contredit
+    if step.kind == ALL_KEY:
+        result = db_satisfies(query, db.fixed(positive_relations(query)))
+        if trace.steps:
+            trace(STEPS, " - Tous les atomes sont all-key → évaluation FO sur les faits fixes")
+            trace(STEPS, " → Résultat FO : {}", result)
         return result
 
-    # 2) Sélection de F
-    F = select_unattacked_non_all_key_atom(query, trace=trace)
-    if F is None:
-        trace.append(" - Aucun atome non-all-key unattacked trouvé → False (sécurité)")
+    # 2) Sélection de F (étape du plan)
+    if step.kind == STUCK:
+        if trace.steps:
+            trace(STEPS, " - Aucun atome non-all-key unattacked trouvé → False (sécurité)")
         return False
 
+    F = query[step.index]
     neg_F, pred_F, pk_F, args_F = F
-    trace.append(f" - Atome choisi F : {F}")
+    if trace.steps:
+        trace(STEPS, " - Atome choisi F : {}", F)
 
     # -------------------------------------------------------------------------
-    # Branche A : clé non vide
-    if pk_F > 0:
-        trace.append(" - Clé primaire de F non vide")
-        for theta in key_valuations(F, db):
-            q_theta = apply_valuation(query, theta)
-            if q_theta == query:
-                continue
-            trace.append(f"   - Application de valuation {theta} → {q_theta}")
-            if is_certain_core(q_theta, db, trace):
-                trace.append("   → Une valuation a mené à True")
-                return True
-        trace.append("   → Aucune valuation n’a mené à True")
-        return False
+    # Branche A : clé avec variables
+    if step.kind == KEY:
+        if trace.steps:
+            trace(STEPS, " - Clé primaire de F avec variables")
+        guard = key_guard(query, F)
+        if guard is F:
+            thetas = key_valuations(F, db)
+        else:
+            if trace.steps:
+                trace(STEPS, " - F est négatif : valeurs de clé lues sur {}", guard)
+            key_vars = dict.fromkeys(t for t in args_F[:pk_F] if is_variable(t))
+            thetas = guard_valuations(guard, key_vars, db)
+        search.facts_scanned += len(thetas)
+
+        def valuations():
+            for theta in thetas:
+                q_theta = apply_valuation(query, theta)
+                search.valuations += 1
+                yield (("   - Application de valuation {} → {}", theta, q_theta),
+                       q_theta, None, _follow(following, theta.values()))
+
+        return _Branches(valuations(), True, ("   → Une valuation a mené à True",),
+                         ("   → Aucune valuation n’a mené à True",))
 
     # -------------------------------------------------------------------------
-    # Branche B : clé vide
-    trace.append(" - Clé primaire de F vide")
-    const_pos = [i for i, t in enumerate(args_F) if not is_variable(t)]
-    var_pos   = [i for i, t in enumerate(args_F) if is_variable(t)]
-
-    relevant_facts = []
-    for fact in db.get(pred_F, []):
-        if all(fact[i] == args_F[i] for i in const_pos):
-            relevant_facts.append(fact)
-
-    trace.append(f" - Faits compatibles avec les constantes : {relevant_facts}")
-
-    if not relevant_facts:
-        trace.append(" → Aucun fait compatible → False")
-        return False
-
-    q_prime = [a for a in query if a is not F]
+    # Branche B : clé close (vide ou sans variable), un seul bloc à décider.
+    # Toute repair en garde un fait, chacun doit donc être examiné.
+    if trace.steps:
+        trace(STEPS, " - Clé primaire de F close")
+    block = list(dict.fromkeys(db.lookup(pred_F, range(pk_F), args_F[:pk_F])))
+    search.facts_scanned += len(block)
+    matches = [unify_tuple(args_F, fact, {}) for fact in block]
+    q_prime = query[:step.index] + query[step.index + 1:]
+
+    if trace.debug:
+        trace(DEBUG, " - Bloc de F : {}", block)
 
     # ------------------------------------------------------------------ F négatif
     if neg_F:
-        trace.append(" - F est négatif")
-        if not is_certain_core(q_prime, db, trace):
-            trace.append("   → q' échoue → False")
+        if trace.steps:
+            trace(STEPS, " - F est négatif")
+        y_vars = tuple(dict.fromkeys(t for t in args_F if is_variable(t)))
+        b_bars = list(dict.fromkeys(tuple(theta[v] for v in y_vars)
+                                    for theta in matches if theta is not None))
+        if b_bars and not y_vars:
+            if trace.steps:
+                trace(STEPS, " → Le fait de F est dans le bloc → False")
             return False
 
-        for fact in relevant_facts:
-            b_bar = tuple(fact[i] for i in var_pos)
-            fresh = fresh_relation()
-            pk_len_E = len(b_bar)
-            neg_E = (True, fresh, pk_len_E, b_bar)
-            new_db = dict(db)
-            new_db.setdefault(fresh, []).append(b_bar)
-            trace.append(f"   - Ajout de ¬{fresh}{b_bar} et appel récursif")
-            if not is_certain_core(q_prime + [neg_E], new_db, trace):
-                trace.append("   → Un ajout mène à False")
-                return False
-        trace.append("   → Tous les ajouts ont mené à True")
-        return True
+        def additions():
+            yield ("   - Appel récursif sur q'",), q_prime, None, following
+            for b_bar in b_bars:
+                fresh = fresh_relation(q_prime)
+                search.fresh_relations += 1
+                neg_E = (True, fresh, len(y_vars), y_vars)
+                yield (("   - Ajout de ¬{}{} = {} et appel récursif", fresh, y_vars, b_bar),
+                       q_prime + [neg_E], (fresh, [b_bar]), following)
+
+        # Conjonction : q' puis chaque ajout de ¬E doivent réussir
+        return _Branches(additions(), False, ("   → q' ou un ajout mène à False",),
+                         ("   → Tous les ajouts ont mené à True",))
 
     # ------------------------------------------------------------------ F positif
-    else:
-        trace.append(" - F est positif")
-        y_vars = [args_F[i] for i in var_pos]
-
-        for fact in relevant_facts:
-            ok_candidate = True
-            trace.append(f"   - Candidat : {fact}")
-            for fact2 in relevant_facts:
-                theta = {v: fact2[pos] for v, pos in zip(y_vars, var_pos)}
-                q_theta = apply_valuation(q_prime, theta)
-                if q_theta == q_prime:
-                    ok_candidate = False
-                    trace.append("     - Theta inchangé → rejet")
-                    break
-                if not is_certain_core(q_theta, db, trace):
-                    ok_candidate = False
-                    trace.append(f"     - Theta {theta} mène à False → rejet")
-                    break
-            if ok_candidate:
-                trace.append("   → Candidat accepté")
-                return True
-        trace.append("   → Aucun candidat accepté → False")
-        return False
\ No newline at end of file
+    if trace.steps:
+        trace(STEPS, " - F est positif")
+    if not block or None in matches:
+        if trace.steps:
+            trace(STEPS, " → Bloc vide ou fait incompatible avec F → False")
+        return False
+
+    thetas = list({tuple(theta.items()): theta for theta in matches}.values())
+    search.valuations += len(thetas)
+    tasks = ((("     - Theta {}", theta), apply_valuation(q_prime, theta), None,
+              _follow(following, theta.values()))
+             for theta in thetas)
+    return _Branches(tasks, False, ("   → Un theta mène à False",),
+                     ("   → Tous les thetas mènent à True",))
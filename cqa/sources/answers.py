@@ -0,0 +1,178 @@
+"""
+-------------------------------------------------------------------------------
+answers.py
+
+Réponses certaines d'une requête non booléenne : les valeurs des variables
+libres choisies pour lesquelles la requête est vraie dans toutes les
+repairs de la base.
+
+Une réponse certaine est en particulier vraie dans une repair, donc ses
+atomes positifs ont des faits dans la base. Les candidats ne sont donc pas
+pris dans tout le domaine actif : ils viennent d'une jointure, par index,
+des atomes positifs de la requête (les atomes qui lient des variables
+libres d'abord ; une fois celles-ci liées, il suffit que le reste de la
+jointure ait une solution).
+
+Chaque candidat est ensuite vérifié sur la requête où les variables libres
+sont des constantes. La forme de cette requête est la même pour tous les
+candidats : analyse (garde, graphe d'attaque) et plan sont calculés une
+fois, et l'état de la vérification est partagé entre candidats :
+  - requête gardée et acyclique : plan FO compilé avec les variables libres
+    liées, évalué avec un seul mémo et les mêmes tests de clés,
+  - sinon : une seule recherche IsCertain (mémo des sous-requêtes).
+Les réponses sont produites au fur et à mesure de leur confirmation.
+
+-------------------------------------------------------------------------------
+"""
+
+from .IsCertain import (is_variable, unify_tuple, apply_valuation, _follow, _Search,
+                        DEFAULT_MEMO_SIZE)
+from .elimination import EliminationPlan
+from .evaluator import Plan
+from .factstore import FactStore
+from .certainty import analyze_query
+from .tracing import as_tracer, SUMMARY, STEPS
+
+
+# =============================================================================
+# ------------------------------------------------------------------ Candidats
+def _join_order(atoms, free):
+    """
+    Ordre de jointure des atomes positifs : à chaque pas, un atome qui lie
+    encore une variable libre s'il en reste, et parmi eux celui qui a le
+    plus de positions déjà liées (index le plus sélectif).
+    :return: ([(pred, args, positions liées), …], nombre de pas nécessaires
+        pour lier toutes les variables libres)
+    """
+    remaining = list(atoms)
+    bound = set()
+    steps = []
+    split = None
+    while remaining:
+        if split is None and free <= bound:
+            split = len(steps)
+
+        def score(atom):
+            args = atom[3]
+            return (any(a in free and a not in bound for a in args),
+                    sum(1 for a in args if not is_variable(a) or a in bound))
+        atom = max(remaining, key=score)
+        remaining.remove(atom)
+        _, pred, _, args = atom
+        positions = tuple(i for i, t in enumerate(args) if not is_variable(t) or t in bound)
+        steps.append((pred, args, positions))
+        bound |= {t for t in args if is_variable(t)}
+    return steps, len(steps) if split is None else split
+
+
+def _matches(db, step, env):
+    pred, args, positions = step
+    values = tuple(env[args[p]] if is_variable(args[p]) else args[p] for p in positions)
+    for fact in db.lookup(pred, positions, values):
+        env2 = unify_tuple(args, fact, env)
+        if env2 is not None:
+            yield env2
+
+
+def _exists(db, steps, i, env):
+    if i == len(steps):
+        return True
+    return any(_exists(db, steps, i + 1, env2) for env2 in _matches(db, steps[i], env))
+
+
+def candidates(query, database, free):
+    """
+    Valeurs des variables `free` (liste) qui satisfont les atomes positifs
+    de `query` dans `database` (FactStore), sans doublon, dans l'ordre de la
+    jointure.
+    """
+    positive = [a for a in query if not a[0]]
+    steps, split = _join_order(positive, set(free))
+    seen = set()
+    # Pile de (pas, environnement) : parcours en profondeur de la jointure
+    stack = [(0, {})]
+    while stack:
+        i, env = stack.pop()
+        if i == split:
+            answer = tuple(env[v] for v in free)
+            if answer not in seen and _exists(database, steps, split, env):
+                seen.add(answer)
+                yield answer
+            continue
+        stack.extend((i + 1, env2) for env2 in reversed(list(_matches(database, steps[i], env))))
+
+
+# =============================================================================
+# ----------------------------------------------------------- Réponses certaines
+def certain_answers(query, database, free, trace=None, stats=None,
+                    memo_size=DEFAULT_MEMO_SIZE):
+    """
+    Réponses certaines de `query` pour les variables libres `free`.
+
+    :param query: [(neg, pred, pk_len, args), …]
+    :param database: liste parsée, dict {pred: […]} ou FactStore.
+    :param free: liste des variables libres ; chacune doit apparaître dans
+        un atome positif. Sans variable libre, la seule réponse possible est
+        () : la requête booléenne est certaine.
+    :param trace: Tracer (voir tracing.py) ou None.
+    :param stats: dict optionnel, complété au fil du calcul : moteur
+        ("engine"), candidats vérifiés ("candidates"), réponses
+        ("answers") et, pour IsCertain, compteurs de la recherche.
+    :return: itérateur des tuples de valeurs (dans l'ordre de `free`) qui
+        sont des réponses certaines, produits dès leur confirmation.
+        Requête non gardée : aucune réponse, comme certainty renvoie False.
+    :raises ValueError: variable libre inconnue, répétée ou absente des
+        atomes positifs ; requête non self-join free.
+    """
+    free = list(free)
+    positive_vars = {t for neg, _, _, args in query if not neg for t in args if is_variable(t)}
+    if len(set(free)) != len(free):
+        raise ValueError("Variable libre répétée")
+    for v in free:
+        if v not in positive_vars:
+            raise ValueError(f"Variable libre absente des atomes positifs : {v}")
+    trace = as_tracer(trace)
+    if stats is None:
+        stats = {}
+    db = FactStore.wrap(database)
+
+    # Requête vue par la vérification : variables libres remplacées par des
+    # constantes (noms qui ne sont pas des variables), même forme que pour
+    # chaque candidat
+    view = apply_valuation(query, {v: f"_{v}" for v in free})
+    analysis, _ = analyze_query(view)
+    guarded = analysis["guarded"]
+    if not guarded[0] and guarded[1] == "not sjf":
+        raise ValueError("Requête non self-join free")
+    stats.update(candidates=0, answers=0, engine=None)
+    if not guarded[0]:
+        trace(SUMMARY, "Requête non gardée : aucune réponse certaine")
+        return iter(())
+
+    if not analysis["cycle"]:
+        stats["engine"] = "fo"
+        check = Plan(query, free).evaluator(db)
+    else:
+        stats["engine"] = "iscertain"
+        search = _Search(trace, memo_size)
+        plan = EliminationPlan.of(view)
+
+        def check(env):
+            try:
+                return search.solve(apply_valuation(query, env), db,
+                                    _follow((plan, 0), env.values()))
+            finally:
+                stats.update(search.counters())
+    trace(SUMMARY, "Réponses certaines pour ({}), moteur {}", ", ".join(free), stats["engine"])
+    return _confirmed(query, db, free, check, trace, stats)
+
+
+def _confirmed(query, db, free, check, trace, stats):
+    for values in candidates(query, db, free):
+        stats["candidates"] += 1
+        certain = check(dict(zip(free, values)))
+        if trace.steps:
+            trace(STEPS, "  candidat {} → {}", values, certain)
+        if certain:
+            stats["answers"] += 1
+            yield values
@@ -20,6 +20,13 @@ suggéré à un endroit dans l'article.
 -------------------------------------------------------------------------------
 """
 
+import hashlib
+import json
+from itertools import combinations
+
+from .cache import LRUCache
+from .tracing import as_tracer, STEPS, DEBUG
+
 
 #  Version pré juillet 2025, fonctionnelle mais ne correspond pas
 # def build_attack_graph(query):
@@ -144,154 +151,197 @@ def build_attack_graph(query, trace=None):
       - Sommets: tous les atomes (positifs ET négatifs).
       - Arêtes F -> G si (∃ w variable de key(G)) atteignable depuis une variable de F
         via le graphe de cooccurrence des VARIABLES construit sur q+ uniquement,
-        sans jamais traverser F^{⊕,q} (fermeture de key(F) par FD de q+ \ {F} si F∈q+,
+        sans jamais traverser F^{⊕,q} (fermeture de key(F) par FD de q+ \\ {F} si F∈q+,
         sinon par FD de q+ si F∈q-).
+
+    Le calcul lui-même est fait par AttackGraph, mis en cache par forme de
+    requête ; cette fonction le traduit en {atome: [atomes attaqués]}.
     """
-    if trace is None:
-        trace = []
+    trace = as_tracer(trace)
+
+    atoms = list(query)
+    if trace.steps:
+        nb_pos = sum(1 for a in atoms if not a[0])
+        trace(STEPS, " - Atomes: {} (positifs: {}, négatifs: {})",
+              len(atoms), nb_pos, len(atoms) - nb_pos)
+        for a in atoms:
+            trace(STEPS, "   - {}", _format_atom(a))
+
+    ag = AttackGraph.of(atoms)
+    graph = ag.to_dict(atoms)
 
-    # ---------- Helpers (local, pas d'autre dépendance) ----------
-    def is_variable(x: str) -> bool:
-        # Heuristique simple: variables en minuscules (p, t, x1, ...)
-        return isinstance(x, str) and len(x) > 0 and x[0].islower()
+    # ---------- Trace lisible ----------
+    if trace.steps:
+        trace(STEPS, " - Graphe de cooccurrence: {} variables", len(ag.adjacency))
+        trace(STEPS, " - Arêtes construites: {}", sum(len(v) for v in graph.values()))
+        for src, tgts in graph.items():
+            if not tgts:
+                continue
+            s = _format_atom(src)
+            for t in tgts:
+                trace(STEPS, "   - {} ---> {}", s, _format_atom(t))
+
+    return graph
 
-    def vars_of(args):
-        return {a for a in args if is_variable(a)}
 
-    def key_vars(atom):
-        neg, pred, pk_len, args = atom
-        return vars_of(args[:pk_len])
+def _is_variable(x) -> bool:
+    # Heuristique simple: variables en minuscules (p, t, x1, ...)
+    return isinstance(x, str) and len(x) > 0 and x[0].islower()
 
-    def all_vars(atom):
-        return vars_of(atom[3])
 
-    def format_atom(atom):
-        neg, pred, pk_len, args = atom
-        s = f"{pred}({', '.join(args)})"
-        return f"not {s}" if neg else s
+def _format_atom(atom):
+    neg, pred, pk_len, args = atom
+    s = f"{pred}({', '.join(args)})"
+    return f"not {s}" if neg else s
 
-    # ---------- Préparation ----------
-    atoms = list(query)
-    pos_atoms = [a for a in atoms if not a[0]]  # q+
-    neg_atoms = [a for a in atoms if a[0]]      # q-
-
-    trace.append(f" - Atomes: {len(atoms)} (positifs: {len(pos_atoms)}, négatifs: {len(neg_atoms)})")
-    for a in atoms:
-        trace.append(f"   - {format_atom(a)}")
-
-    # ---------- 1) Graphe de cooccurrence des variables (uniquement q+) ----------
-    # Sommets = toutes les variables de la requête (q+ ∪ q-),
-    # Arêtes = paires de variables qui co-apparaissent dans UN même atome positif.
-    all_vars_in_q = set().union(*(all_vars(a) for a in atoms)) if atoms else set()
-    var_adj = {v: set() for v in all_vars_in_q}  # graphe non orienté
-
-    from itertools import combinations
-    for a in pos_atoms:
-        vset = list(all_vars(a))
-        for x, y in combinations(vset, 2):
-            var_adj[x].add(y)
-            var_adj[y].add(x)
-
-    trace.append(f" - Graphe de cooccurrence: {len(var_adj)} variables")
-    # (optionnel) dump rapide
-    # for v, ns in var_adj.items():
-    #     trace.append(f"   {v}: {sorted(ns)}")
-
-    # ---------- 2) FDs induites par q+ : key(H) -> vars(H) pour chaque H ∈ q+ ----------
-    # Fermeture de S par application répétée des FDs (règle: si key(H)⊆S alors S:=S∪vars(H))
-    def closure_key(S_start, fd_scope, exclude=None):
-        S = set(S_start)
+
+# =============================================================================
+# ------------------------------------------------------------ Graphe en cache
+def query_shape(query):
+    """
+    Forme d'une requête, seule information dont dépend le graphe d'attaque :
+    pour chaque atome (neg, pk_len, motif), où le motif remplace chaque
+    variable par son rang de première apparition et chaque constante par None.
+    Renvoie (forme, {variable: rang}).
+    """
+    names = {}
+    shape = []
+    for neg, _pred, pk_len, args in query:
+        pattern = tuple(names.setdefault(a, len(names)) if _is_variable(a) else None
+                        for a in args)
+        shape.append((neg, pk_len, pattern))
+    return tuple(shape), names
+
+
+class AttackGraph:
+    """
+    Graphe d'attaque d'une forme de requête (voir query_shape).
+
+    Les sommets sont les indices des atomes ; `edges[i]` est la liste triée des
+    atomes attaqués par l'atome i et `indegree[i]` le nombre d'attaquants.
+    Les graphes sont partagés par toutes les requêtes de même forme (cache
+    LRU), quelles que soient les constantes et les noms de variables.
+    """
+
+    cache = LRUCache(maxsize=4096)
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.key_vars = [frozenset(v for v in pattern[:pk_len] if v is not None)
+                         for _neg, pk_len, pattern in shape]
+        self.vars = [frozenset(v for v in pattern if v is not None)
+                     for _neg, _pk, pattern in shape]
+        self.positive = [i for i, (neg, _pk, _p) in enumerate(shape) if not neg]
+        self.adjacency = self._cooccurrence()
+        self.edges = [self._attacked_by(i) for i in range(len(shape))]
+        self.indegree = [0] * len(shape)
+        for targets in self.edges:
+            for j in targets:
+                self.indegree[j] += 1
+
+    # -------------------------------------------------------------------------
+    #  Construction
+    @classmethod
+    def of(cls, query):
+        """
+        Graphe d'attaque de `query`, depuis le cache si la forme est connue.
+        """
+        shape, _ = query_shape(query)
+        return cls._cached(shape)
+
+    @classmethod
+    def _cached(cls, shape):
+        graph = cls.cache.get(shape)
+        if graph is None:
+            graph = cls(shape)
+            cls.cache.put(shape, graph)
+        return graph
+
+    def _cooccurrence(self):
+        # Graphe de cooccurrence des variables (uniquement q+)
+        adj = {v: set() for vs in self.vars for v in vs}
+        for i in self.positive:
+            _add_pairs(adj, self.vars[i])
+        return adj
+
+    def _closure(self, start, exclude):
+        # Fermeture de start par les FDs key(H) -> vars(H), H ∈ q+ \ {exclude}
+        S = set(start)
         changed = True
         while changed:
             changed = False
-            for H in fd_scope:
-                if exclude is not None and H is exclude:
-                    continue
-                if key_vars(H) <= S:
-                    new = all_vars(H) - S
+            for h in self.positive:
+                if h != exclude and self.key_vars[h] <= S:
+                    new = self.vars[h] - S
                     if new:
                         S |= new
                         changed = True
         return S
 
-    # ---------- 3) Construction des arêtes ----------
-    graph = {a: [] for a in atoms}  # inclure TOUS les atomes comme nœuds
-
-    for F in atoms:
-        F_vars = all_vars(F)
+    def _attacked_by(self, f):
+        neg = self.shape[f][0]
         # F^{⊕,q} dépend de la polarité de F
-        if F in pos_atoms:
-            S = closure_key(key_vars(F), pos_atoms, exclude=F)  # q+ \ {F}
-        else:
-            S = closure_key(key_vars(F), pos_atoms, exclude=None)  # q+
-
-        # Depuis chaque u ∈ vars(F)\S, BFS dans le graphe des variables
-        # sans jamais traverser une variable de S.
-        reachable = set()
-        frontier_sources = F_vars - S
-
-        from collections import deque
-        for u in frontier_sources:
-            # u peut ne pas être dans var_adj (p.ex. variable n'apparaissant pas en positif)
-            if u not in var_adj:
-                # Toujours atteignable lui-même si autorisé
-                reachable.add(u)
-                continue
-            dq = deque([u])
-            seen = {u}
-            while dq:
-                x = dq.popleft()
-                reachable.add(x)
-                for y in var_adj.get(x, ()):
-                    if y not in seen and y not in S:
-                        seen.add(y)
-                        dq.append(y)
-
-        # Pour chaque G != F, si une variable de clé de G est atteinte, on ajoute F -> G
-        for G in atoms:
-            if G is F:
-                continue
-            keyG = key_vars(G)
-            # On ignore les constantes en clé (définition: seules les variables de clé sont "attaquables")
-            if keyG & reachable:
-                graph[F].append(G)
-
-    # ---------- Trace lisible ----------
-    nb_edges = sum(len(v) for v in graph.values())
-    trace.append(f" - Arêtes construites: {nb_edges}")
-    for src, tgts in graph.items():
-        if not tgts:
-            continue
-        s = format_atom(src)
-        for t in tgts:
-            trace.append(f"   - {s} ---> {format_atom(t)}")
-
-    return graph
+        S = self._closure(self.key_vars[f], None if neg else f)
+
+        # BFS depuis vars(F) \ S sans jamais traverser une variable de S
+        frontier = [u for u in self.vars[f] if u not in S]
+        reachable = set(frontier)
+        while frontier:
+            x = frontier.pop()
+            for y in self.adjacency.get(x, ()):
+                if y not in reachable and y not in S:
+                    reachable.add(y)
+                    frontier.append(y)
+
+        return [g for g in range(len(self.shape))
+                if g != f and self.key_vars[g] & reachable]
+
+    # -------------------------------------------------------------------------
+    #  Lecture
+    def to_dict(self, query):
+        """
+        Graphe au format historique {atome: [atomes attaqués]}.
+        """
+        atoms = list(query)
+        graph = {a: [] for a in atoms}
+        for i, targets in enumerate(self.edges):
+            for j in targets:
+                graph[atoms[i]].append(atoms[j])
+        return graph
+
+
+def _add_pairs(adj, variables):
+    for x, y in combinations(variables, 2):
+        adj[x].add(y)
+        adj[y].add(x)
 
 
 # =============================================================================
 # ----------------------------------------------------------------- Cycle check
 def detect_cycle(graph, trace=None):
-    def log(msg):
-        if trace is not None:
-            trace.append(msg)
+    trace = as_tracer(trace)
+    log = trace if trace.debug else None
 
     visited = set()
     rec_stack = set()
 
     def dfs(v):
-        log(f"Visite de {v}")
+        if log:
+            log(DEBUG, "Visite de {}", v)
         visited.add(v)
         rec_stack.add(v)
 
         for neighbour in graph.get(v, []):
-            log(f"  {v} → {neighbour}")
+            if log:
+                log(DEBUG, "  {} → {}", v, neighbour)
             if neighbour not in visited:
                 if dfs(neighbour):
-                    log(f"Cycle détecté via {neighbour}")
+                    if log:
+                        log(DEBUG, "Cycle détecté via {}", neighbour)
                     return True
             elif neighbour in rec_stack:
-                log(f"Cycle trouvé : {neighbour} est dans la pile récursive")
+                if log:
+                    log(DEBUG, "Cycle trouvé : {} est dans la pile récursive", neighbour)
                 return True
 
         rec_stack.remove(v)
@@ -299,11 +349,15 @@ def detect_cycle(graph, trace=None):
 
     for node in graph:
         if node not in visited:
-            log(f"Lancement DFS depuis {node}")
+            if log:
+                log(DEBUG, "Lancement DFS depuis {}", node)
             if dfs(node):
+                if trace.steps:
+                    trace(STEPS, " - Cycle détecté")
                 return True
 
-    log("Pas de cycle détecté")
+    if trace.steps:
+        trace(STEPS, "Pas de cycle détecté")
     return False
 
 # =============================================================================
@@ -322,33 +376,55 @@ def print_attack_graph(graph):
 
 # =============================================================================
 # -------------------------------------------------------------------- Graphviz
-def draw_attack_graph(graph, filename="attack_graph"):
+def graph_description(graph):
+    """
+    Description (noeuds, arcs) du graphe, avec les atomes sous leur forme
+    affichée "Pred(x, y)". C'est exactement ce que dessine draw_attack_graph.
+    """
+    def name(atom):
+        return f"{atom[1]}({', '.join(atom[3])})"
+
+    nodes = tuple(name(node) for node in graph)
+    edges = tuple((name(src), name(tgt)) for src, targets in graph.items() for tgt in targets)
+    return nodes, edges
+
+
+def graph_signature(description):
+    """
+    Signature (sha256 tronqué) d'une description de graphe : deux graphes de
+    même signature donnent la même image.
+    """
+    return hashlib.sha256(json.dumps(description).encode("utf-8")).hexdigest()[:24]
+
+
+def draw_attack_graph(graph, filename="attack_graph", format="png"):
     """
     Génère une image du graphe d'attaque avec Graphviz.
     A voir si réllement utile...
+    :param graph: dict {atome: [atomes attaqués]} ou description
+        (noeuds, arcs) renvoyée par graph_description.
+    :param format: format de l'image ("png", "svg", …).
     """
     # Safe import, c'est vérifié dans "certainty" si
     # graphviz est installé
     from graphviz import Digraph
-    
+
+    nodes, edges = graph if isinstance(graph, tuple) else graph_description(graph)
+
     dot = Digraph()
     dot.attr(rankdir='LR')  # Graphe horizontal, plus lisible
 
     # Ajouter les nœuds
-    for node in graph:
-        name = f"{node[1]}({', '.join(node[3])})"
+    for name in nodes:
         dot.node(name)
 
     # Ajouter les flèches
-    for src, targets in graph.items():
-        src_name = f"{src[1]}({', '.join(src[3])})"
-        for tgt in targets:
-            tgt_name = f"{tgt[1]}({', '.join(tgt[3])})"
-            dot.edge(src_name, tgt_name)
+    for src_name, tgt_name in edges:
+        dot.edge(src_name, tgt_name)
 
     # a utiliser pour générer un fichier
     # dot.render(filename, format='png', cleanup=True)
     
-    # Renvoie l'image au format PNG
-    img_bytes = dot.pipe(format='png')  # Renvoie un bytes object
-    return img_bytes
\ No newline at end of file
+    # Renvoie l'image au format demandé
+    img_bytes = dot.pipe(format=format)  # Renvoie un bytes object
+    return img_bytes
@@ -0,0 +1,164 @@
+"""
+-------------------------------------------------------------------------------
+batch.py
+
+Certitude d'un lot de paires (requête, base), sans refaire pour chaque paire
+le travail qu'elles partagent :
+  - check_queries   : N requêtes sur une même base. La base est parsée et
+                      chargée une seule fois dans un FactStore, dont les
+                      index servent à toutes les requêtes.
+  - check_databases : une requête sur N bases. La requête est parsée et
+                      analysée (garde, graphe d'attaque, réécriture, plan FO)
+                      une seule fois.
+Dans les deux cas l'analyse passe par le cache d'analyse (analyze_query) et
+les plans compilés par celui de compile_query : des requêtes de même forme
+canonique la partagent aussi.
+
+Les résultats sont produits au fil de l'eau, dans l'ordre des éléments. Avec
+workers > 1, les éléments sont répartis sur un pool de processus ; l'élément
+partagé (base ou requête) n'est envoyé qu'une fois à chaque processus, et au
+plus `window` éléments sont en cours à la fois.
+
+-------------------------------------------------------------------------------
+"""
+
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .parseur import parse, load
+from .factstore import FactStore
+from .certainty import analyze_query, decide
+from .evaluator import compile_query
+
+# Éléments en cours par processus de travail, en mode parallèle
+WINDOW_PER_WORKER = 4
+
+
+def as_query(query):
+    """
+    Requête [(neg, pred, pk_len, args), …] depuis un texte (@query ; une
+    éventuelle @database est ignorée) ou une requête déjà parsée.
+    """
+    if isinstance(query, str):
+        return parse(query, require_database=False)["query"]
+    return list(query)
+
+
+def as_database(database):
+    """
+    FactStore depuis un texte (@database ; une éventuelle @query est
+    ignorée), un FactStore, un dict {pred: […]} ou la liste parsée.
+    """
+    if isinstance(database, str):
+        return load(database.splitlines(), require_query=False)[0]
+    return FactStore.wrap(database)
+
+
+def evaluate(query, database):
+    """
+    Certitude de `query` (parsée) sur `database` (FactStore).
+    :return: dict {certain, guarded, cycle, engine, analysis_cache}, où
+        certain vaut None pour une requête non self-join free, comme pour
+        certainty.
+    """
+    analysis, hit = analyze_query(query)
+    guarded = analysis["guarded"]
+    res = {"certain": False, "guarded": guarded, "cycle": analysis["cycle"],
+           "engine": None, "analysis_cache": "hit" if hit else "miss"}
+    if not guarded[0]:
+        if guarded[1] == "not sjf":
+            res["certain"] = None
+        return res
+    stats = {}
+    res["certain"] = decide(query, database, analysis, stats=stats)
+    res["engine"] = stats["engine"]
+    return res
+
+
+def _against_database(database, item):
+    return evaluate(as_query(item), database)
+
+
+def _against_query(query, item):
+    return evaluate(query, as_database(item))
+
+
+def _run_item(fn, shared, item):
+    # Une erreur (élément mal formé, par exemple) ne concerne que son élément
+    start = time.perf_counter()
+    try:
+        res = fn(shared, item)
+        res["error"] = None
+    except Exception as e:
+        res = {"certain": None, "error": f"{type(e).__name__}: {e}"}
+    res["time"] = time.perf_counter() - start
+    return res
+
+
+# -----------------------------------------------------------------------------
+#  Exécution du lot
+
+# Élément partagé d'un processus de travail (fixé par _init_worker)
+_worker = {}
+
+
+def _init_worker(fn, shared):
+    _worker["fn"] = fn
+    _worker["shared"] = shared
+
+
+def _run_in_worker(item):
+    return _run_item(_worker["fn"], _worker["shared"], item)
+
+
+def _run(fn, shared, items, workers, window):
+    if workers is None or workers <= 1:
+        for index, item in enumerate(items):
+            yield dict(_run_item(fn, shared, item), index=index)
+        return
+    if window is None:
+        window = workers * WINDOW_PER_WORKER
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(),
+                             initializer=_init_worker, initargs=(fn, shared)) as pool:
+        pending = deque()
+        for index, item in enumerate(items):
+            pending.append((index, pool.submit(_run_in_worker, item)))
+            if len(pending) >= window:
+                done, future = pending.popleft()
+                yield dict(future.result(), index=done)
+        while pending:
+            done, future = pending.popleft()
+            yield dict(future.result(), index=done)
+
+
+def check_queries(queries, database, workers=None, window=None):
+    """
+    Certitude de chaque requête de `queries` sur une même base.
+    :param queries: itérable de requêtes (textes @query ou requêtes parsées).
+    :param database: la base (voir as_database), chargée une seule fois.
+    :param workers: nombre de processus (None ou 1 = séquentiel).
+    :param window: nombre maximal d'éléments en cours en mode parallèle
+        (par défaut WINDOW_PER_WORKER par processus).
+    :return: générateur de dicts, dans l'ordre des requêtes : ceux
+        d'evaluate, avec index (position de la requête), error (None, ou
+        l'erreur de cet élément) et time (secondes).
+    """
+    return _run(_against_database, as_database(database), queries, workers, window)
+
+
+def check_databases(query, databases, workers=None, window=None):
+    """
+    Certitude d'une même requête sur chaque base de `databases`.
+    :param query: la requête (voir as_query), analysée une seule fois.
+    :param databases: itérable de bases (voir as_database).
+    :return: comme check_queries, index étant la position de la base.
+    """
+    query = as_query(query)
+    # Analyse et plan faits ici : les processus de travail créés par fork
+    # héritent des caches
+    analysis, _ = analyze_query(query)
+    if analysis["guarded"][0] and not analysis["cycle"]:
+        compile_query(query)
+    return _run(_against_query, query, databases, workers, window)
@@ -0,0 +1,153 @@
+"""
+-------------------------------------------------------------------------------
+cache.py
+
+Petits outils de mise en cache partagés par les différents modules :
+  - LRUCache : table bornée avec éviction LRU et compteurs hits/misses,
+  - canonical_query : forme canonique d'une requête, où les variables sont
+    renommées dans leur ordre d'apparition,
+  - canonical_renaming : idem, avec la correspondance atomes/variables.
+
+-------------------------------------------------------------------------------
+"""
+
+import os
+from collections import OrderedDict
+from threading import Lock
+from weakref import WeakSet
+
+
+# =============================================================================
+# ------------------------------------------------------------------- LRU cache
+_MISSING = object()
+
+# Caches vivants, pour recréer leurs verrous après un fork
+_caches = WeakSet()
+
+
+def _reset_locks():
+    # Processus fils créé par fork (jobs, IsCertain parallèle) : un verrou
+    # tenu par un autre thread du parent au moment du fork ne serait jamais
+    # relâché dans le fils
+    for cache in list(_caches):
+        cache._lock = Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks)
+
+
+class LRUCache:
+    """
+    Dictionnaire borné : au-delà de `maxsize` entrées, l'entrée la moins
+    récemment utilisée est évincée. `maxsize=None` désactive la borne,
+    `maxsize=0` désactive le cache.
+    Les accès sont protégés par un verrou : un même cache peut être partagé
+    entre les threads du serveur. Le verrou est recréé dans un processus
+    fils créé par fork.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+        _caches.add(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        """
+        Copie des entrées [(clé, valeur), …], de la moins à la plus
+        récemment utilisée (sans compter d'accès).
+        """
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """
+        Compteurs du cache, sous forme de dict (sérialisable en JSON).
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# =============================================================================
+# ------------------------------------------------------------ Forme canonique
+def canonical_query(query, is_variable, sort_atoms=False):
+    """
+    Forme canonique (hachable) d'une requête [(neg, pred, pk_len, args), …].
+    Les variables sont remplacées par leur rang de première apparition
+    (des entiers, qui ne peuvent donc pas se confondre avec une constante).
+    Deux requêtes égales à renommage près ont la même forme canonique.
+
+    :param is_variable: prédicat décidant si un terme est une variable.
+    :param sort_atoms: si True, les atomes sont d'abord triés sur leur
+        structure, pour que l'ordre d'écriture n'ait plus d'importance.
+    """
+    return canonical_renaming(query, is_variable, sort_atoms)[0]
+
+
+def canonical_renaming(query, is_variable, sort_atoms=True):
+    """
+    Comme canonical_query, mais renvoie aussi de quoi passer d'une requête à
+    une autre de même forme canonique.
+    :return: (forme canonique, atomes dans l'ordre canonique, variables par
+        rang). Pour deux requêtes de même forme, les atomes de même rang se
+        correspondent, ainsi que les variables de même rang.
+    """
+    atoms = list(query)
+    if sort_atoms:
+        def shape(atom):
+            neg, pred, pk_len, args = atom
+            return (neg, pred, pk_len,
+                    tuple("" if is_variable(a) else str(a) for a in args))
+        atoms.sort(key=shape)
+
+    names = {}
+    canon = []
+    for neg, pred, pk_len, args in atoms:
+        new_args = []
+        for a in args:
+            if is_variable(a):
+                new_args.append(names.setdefault(a, len(names)))
+            else:
+                new_args.append(a)
+        canon.append((neg, pred, pk_len, tuple(new_args)))
+    return tuple(canon), atoms, list(names)
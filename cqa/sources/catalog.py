@@ -0,0 +1,84 @@
+"""
+-------------------------------------------------------------------------------
+catalog.py
+
+Catalogue de statistiques d'une base chargée, pour le planificateur de
+jointures (planner.py) :
+  - cardinalité de chaque relation,
+  - nombre de valeurs distinctes à chaque position,
+  - histogramme des tailles de blocs de clé (par longueur de clé).
+Les statistiques d'un prédicat sont calculées au premier accès, puis
+gardées par le FactStore (FactStore.statistics) tant que la taille de la
+relation ne s'écarte pas de plus de STATS_DRIFT (10 %) de celle qu'elles
+décrivent.
+
+-------------------------------------------------------------------------------
+"""
+
+from collections import Counter
+
+
+class RelationStats:
+    """
+    Statistiques d'une relation.
+    cardinality : nombre de faits
+    distinct    : nombre de valeurs distinctes par position
+    """
+    __slots__ = ("cardinality", "distinct", "_store", "_pred", "_histograms")
+
+    def __init__(self, facts, store=None, pred=None):
+        self.cardinality = len(facts)
+        arity = max(map(len, facts), default=0)
+        self.distinct = tuple(len({fact[i] for fact in facts if i < len(fact)})
+                              for i in range(arity))
+        self._store = store
+        self._pred = pred
+        self._histograms = {}
+
+    def histogram(self, pk_len):
+        """
+        Histogramme des tailles de blocs de clé : {taille: nombre de blocs}.
+        """
+        if self._store is None:
+            return {}
+        histogram = self._histograms.get(pk_len)
+        if histogram is None:
+            blocks = self._store.blocks(self._pred, pk_len).blocks
+            histogram = dict(sorted(Counter(map(len, blocks.values())).items()))
+            self._histograms[pk_len] = histogram
+        return histogram
+
+    def estimate(self, positions, pk_len=None):
+        """
+        Nombre estimé de faits renvoyés par une recherche sur `positions`
+        (valeurs supposées indépendantes d'une position à l'autre). Si toute
+        la clé est liée (pk_len), l'estimation est bornée par la taille
+        moyenne des blocs.
+        """
+        if not self.cardinality:
+            return 0.0
+        rows = float(self.cardinality)
+        for p in set(positions):
+            if p < len(self.distinct):
+                rows /= self.distinct[p]
+        if pk_len and set(range(pk_len)) <= set(positions):
+            histogram = self.histogram(pk_len)
+            rows = min(rows, self.cardinality / sum(histogram.values()))
+        return max(rows, 1.0)
+
+    def to_dict(self, pk_len=None):
+        res = {"cardinality": self.cardinality, "distinct": list(self.distinct)}
+        if pk_len is not None:
+            res["blocks"] = self.histogram(pk_len)
+        return res
+
+
+def describe(database, keys=None):
+    """
+    Catalogue lisible (sérialisable en JSON) de `database` (FactStore) :
+    {pred: {cardinality, distinct, blocks}}. `keys` ({pred: pk_len}, par
+    exemple depuis la requête) ajoute les histogrammes de blocs.
+    """
+    keys = keys or {}
+    return {pred: database.statistics(pred).to_dict(keys.get(pred))
+            for pred in sorted(database.predicates())}
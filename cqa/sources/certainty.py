@@ -14,13 +14,160 @@ from .parseur import parse
 from .ngfo import is_guarded
 from .attack_graph import build_attack_graph, detect_cycle, print_attack_graph
 from .attack_graph import draw_attack_graph
-from .IsCertain import is_certain_core
-from .rewriter import rewrite, fo_to_latex, rewrite_closed
+from .IsCertain import is_certain_core, is_variable
+from .evaluator import compile_query
+from .semijoin import reduce_database
+from .factstore import FactStore
+from .rewriter import fo_to_latex, rewrite_formula
+from .formula import render, rename
+from .cache import LRUCache, canonical_renaming
+from .tracing import Tracer, as_tracer, SUMMARY, STEPS, DEBUG, DEFAULT_MAX_EVENTS
+from .metrics import Metrics, SEARCH_COUNTERS
 import base64
 
 
+# =============================================================================
+# ------------------------------------------------------- Analyse de la requête
+# Garde, graphe d'attaque, cycle et réécriture ne dépendent que de la
+# @query : ils sont mis en cache sur la forme canonique de la requête
+# (variables renommées, atomes triés). Une requête égale à renommage et
+# réordonnancement près réutilise l'analyse, traduite dans ses propres noms.
+ANALYSIS_CACHE_SIZE = 1024
+_analyses = LRUCache(ANALYSIS_CACHE_SIZE)
+
+
+def _analyze(query, trace, metrics):
+    """
+    Analyse complète de la requête, chaque étape mesurée dans `metrics`.
+    :return: dict {guarded, graph (format {atome: [atomes]}), cycle, formula}
+    """
+    analysis = {"guarded": None, "graph": None, "cycle": None, "formula": None}
+    # -------------------------------------------------------------------- NGFO
+    trace.stage = "ngfo"
+    trace(SUMMARY, "Début de la vérification de négation gardée : ")
+    with metrics.stage("guard"):
+        guarded = is_guarded(query, trace=trace)
+    analysis["guarded"] = guarded
+    trace(SUMMARY, "Vérification de négation gardée terminée : {}", guarded)
+    if not guarded[0]:
+        return analysis
+
+    # ------------------------------------------------------------ Attack graph
+    trace.stage = "attack_graph"
+    trace(SUMMARY, "Début de la construction du graphe d'attaque")
+    with metrics.stage("attack_graph"):
+        base_graph = build_attack_graph(query, trace=trace)
+    analysis["graph"] = base_graph
+
+    # -------------------------------------------------- graphe Cycle
+    trace(SUMMARY, "Détection des cycles dans le graphe d'attaque (DFS)")
+    with metrics.stage("cycle"):
+        cycle = detect_cycle(base_graph, trace=trace)
+    analysis["cycle"] = cycle
+
+    # ---------------------------------------------------------------- Rewriter
+    # Réécriture de la requête, si gardée et acyclique (lemme 6.1)
+    trace.stage = "rewrite"
+    trace(SUMMARY, "\nDébut de la réécriture de la requête")
+    if not cycle:
+        with metrics.stage("rewrite"):
+            analysis["formula"] = rewrite_formula(query, trace=trace)
+    else:
+        trace(SUMMARY, "Requête non gardée ou cyclique, pas de réécriture")
+    return analysis
+
+
+def _translate(analysis, original, cached, current, query):
+    """
+    Traduit une analyse calculée pour la requête `original`, de même forme
+    canonique. `cached` et `current` sont les (atomes, variables) dans
+    l'ordre canonique renvoyés par canonical_renaming. Le graphe et la
+    réécriture suivent l'ordre des atomes de `query` : la réécriture n'est
+    reprise par renommage que si cet ordre est celui d'`original`.
+    """
+    atoms = dict(zip(cached[0], current[0]))
+    back = dict(zip(current[0], cached[0]))
+    variables = dict(zip(cached[1], current[1]))
+    position = {a: i for i, a in enumerate(query)}
+    translated = dict(analysis)
+    if analysis["graph"] is not None:
+        translated["graph"] = {a: sorted((atoms[b] for b in analysis["graph"][back[a]]),
+                                         key=position.get)
+                               for a in query}
+    if analysis["formula"] is not None:
+        if [atoms[a] for a in original] == list(query):
+            translated["formula"] = rename(analysis["formula"], variables)
+        else:
+            translated["formula"] = rewrite_formula(query)
+    return translated
+
+
+def analyze_query(query, trace=None, metrics=None):
+    """
+    Analyse de la requête, depuis le cache si une requête de même forme
+    canonique a déjà été analysée (les étapes n'apparaissent alors pas dans
+    `metrics`).
+    :return: (analyse, True si elle vient du cache)
+    """
+    trace = as_tracer(trace)
+    if metrics is None:
+        metrics = Metrics()
+    key, atoms, variables = canonical_renaming(query, is_variable)
+    entry = _analyses.get(key)
+    if entry is None:
+        analysis = _analyze(query, trace, metrics)
+        _analyses.put(key, (tuple(query), (atoms, variables), analysis))
+        return analysis, False
+    original, cached, analysis = entry
+    trace(SUMMARY, "Analyse de la requête trouvée en cache (forme canonique)")
+    if tuple(query) == original:
+        return analysis, True
+    return _translate(analysis, original, cached, (atoms, variables), query), True
+
+
+def analysis_cache_stats():
+    """
+    Compteurs du cache d'analyse (hits, misses, taille, taux de succès).
+    """
+    return _analyses.stats()
+
+
+def decide(query, database, analysis, trace=None, stats=None):
+    """
+    Certitude d'une requête gardée sur une base, à partir de son analyse
+    (analyze_query) : plan FO compilé si la requête est acyclique, recherche
+    IsCertain sinon.
+    :param stats: dict optionnel, complété avec le moteur ("engine") et,
+        pour IsCertain, les compteurs de la recherche.
+    """
+    trace = as_tracer(trace)
+    if stats is None:
+        stats = {}
+    if not analysis["cycle"]:
+        plan = compile_query(query)
+        trace(SUMMARY, "Évaluation par le plan FO compilé :")
+        if trace.steps:
+            for line in plan.explain().splitlines():
+                trace(STEPS, "  {}", line)
+        stats["engine"] = "fo"
+        return plan.evaluate(database)
+    certain = is_certain_core(query, database, trace=trace, stats=stats)
+    stats["engine"] = "iscertain"
+    trace(SUMMARY, "Mémo IsCertain : {} hits, {} misses",
+          stats["memo_hits"], stats["memo_misses"])
+    return certain
+
+
+def _finish(stats, metrics, tracer):
+    # Mesures et volume de la trace, ajoutés aux stats renvoyées
+    stats["timings"] = metrics.timings()
+    stats["metrics"] = metrics.to_dict()
+    stats["trace"] = tracer.stats()
+
+
 # -----------------------------------------------------------------------------
-def certainty(text, graph_png=False):
+def certainty(text, graph_png=False, database=None, trace_level="off",
+              max_trace_events=DEFAULT_MAX_EVENTS, reduce=True):
     """
     Fonction principale qui gère le flux de travail de la vérification de la 
     certitude.
@@ -30,43 +177,69 @@ def certainty(text, graph_png=False):
     
     :param text: Le texte d'entrée à analyser.
     :param graph_png: Si True, génère une image du graphe d'attaque.
+    :param database: base déjà chargée (FactStore, dict ou liste parsée),
+        par exemple par load_csv_database. Le texte n'a alors besoin que de
+        la section @query ; une éventuelle @database y est ignorée.
+    :param trace_level: niveau de la trace ("off", "summary", "steps",
+        "debug", voir tracing.py), ou un Tracer fourni par l'appelant (qui
+        garde alors les évènements structurés). Par défaut aucune trace.
+    :param max_trace_events: nombre maximal d'évènements de trace gardés.
+    :param reduce: réduit la base aux faits utiles à la requête avant le
+        calcul de certitude (semijoin.py). La réduction garde des blocs de
+        clé entiers et ne change pas la certitude (voir
+        TestSemiJoin.test_differentiel) ; False pour évaluer la base
+        complète.
+    :return: (data, guarded, graph, cycle, certain, rewriting, latex, trace,
+        stats), où trace est la liste des lignes de la trace, et stats
+        indique le moteur qui a répondu ("fo" pour le plan compilé,
+        "iscertain" pour la recherche), ses compteurs (mémo), si l'analyse
+        de la requête vient du cache ("analysis_cache"), la taille de la
+        base avant et après réduction ("database" : facts, reduced,
+        semijoin), la durée de chaque
+        étape en secondes ("timings"), les mesures détaillées ("metrics",
+        voir metrics.py : temps réel et CPU par étape, compteurs de la
+        recherche) et le volume de la trace ("trace").
+        Étapes : parse, analysis (qui englobe guard, attack_graph, cycle et
+        rewrite, absentes si l'analyse vient du cache), graph_png, reduce,
+        certainty, render.
     
     """
     data, guarded, graph, cycle, certain, rewriting, latex, trace = None, None, None, None, False, None, None, None
+    stats = {}
+    metrics = Metrics()
 
-    trace = []
-    trace.append("Initialisation de la fonction certainty")
+    tracer = trace_level if isinstance(trace_level, Tracer) else Tracer(trace_level, max_trace_events)
+    tracer.stage = "parse"
+    tracer(SUMMARY, "Initialisation de la fonction certainty")
     # =========================================================================
     # ------------------------------------------------------------------- Parse
-    data = parse(text)
-    trace.append("Parsing terminé")
+    with metrics.stage("parse"):
+        data = parse(text, require_database=database is None)
+    tracer(SUMMARY, "Parsing terminé")
+    if database is not None:
+        if data["database"]:
+            tracer(SUMMARY, "Base préchargée fournie : la section @database est ignorée")
+        data["database"] = database
 
     # =========================================================================
-    # -------------------------------------------------------------------- NGFO
-    trace.append("Début de la vérification de négation gardée : ")
-    guarded = is_guarded(data["query"], trace=trace)
-    
-    trace.append("Vérification de négation gardée terminée")
+    # ------------------------------------------------ NGFO, graphe, réécriture
+    with metrics.stage("analysis"):
+        analysis, hit = analyze_query(data["query"], tracer, metrics)
+    stats["analysis_cache"] = "hit" if hit else "miss"
+    guarded = analysis["guarded"]
     # Si la requête n'est pas sfj, on ne continue pas
     if not guarded[0]:
         if guarded[1] == "not sjf":
-            trace.append("Requête non self-join free (SJF), arrêt de la fonction certainty")
-            return data, guarded, graph, cycle, None, None, None, trace
-        return data, guarded, graph, cycle, certain, None, None, trace
-    # =========================================================================
-    # ------------------------------------------------------------ Attack graph
-    trace.append("Début de la construction du graphe d'attaque")
-    print(trace)
-    graph = {}
-    base_graph= build_attack_graph(data["query"], trace=trace)
-    
-    graph["base"] = base_graph
+            tracer(SUMMARY, "Requête non self-join free (SJF), arrêt de la fonction certainty")
+        _finish(stats, metrics, tracer)
+        if guarded[1] == "not sjf":
+            return data, guarded, graph, cycle, None, None, None, tracer.lines(), stats
+        return data, guarded, graph, cycle, certain, None, None, tracer.lines(), stats
+
+    base_graph = analysis["graph"]
+    cycle = analysis["cycle"]
+    graph = {"base": base_graph, "cycle": cycle}
 
-    # -------------------------------------------------- graphe Cycle
-    trace.append("Détection des cycles dans le graphe d'attaque (DFS)")
-    cycle = detect_cycle(base_graph, trace=trace)
-    graph["cycle"], trace = cycle, trace
-    
     # ---------------------------------------------------- graphe txt
     txt_graph = print_attack_graph(base_graph)
     graph["txt"] = txt_graph
@@ -82,9 +255,11 @@ def certainty(text, graph_png=False):
         except ImportError:
             print("graphviz not installed, graph_png set to None")
             graph_png = None
-        trace.append("Génération de l'image du graphe d'attaque")
-        img = draw_attack_graph(base_graph)
-        graph["png"] = base64.b64encode(img).decode('utf-8')
+        tracer.stage = "graph_png"
+        tracer(SUMMARY, "Génération de l'image du graphe d'attaque")
+        with metrics.stage("graph_png"):
+            img = draw_attack_graph(base_graph)
+            graph["png"] = base64.b64encode(img).decode('utf-8')
     
 
 
@@ -98,21 +273,42 @@ def certainty(text, graph_png=False):
 
     # =========================================================================
     # --------------------------------------------------------------- certainty
-    certain = is_certain_core(data["query"], data["database"], trace=trace)
+    # Seules étapes qui dépendent de la base.
+    # Réduction (par défaut) : seuls les blocs de clé utiles à la requête
+    # sont gardés.
+    tracer.stage = "reduce"
+    db = FactStore.wrap(data["database"])
+    if reduce:
+        with metrics.stage("reduce"):
+            reduced, applied = reduce_database(data["query"], db)
+        stats["database"] = {"facts": len(db), "reduced": len(reduced), "semijoin": applied}
+        tracer(SUMMARY, "Base réduite : {} faits sur {}{}", len(reduced), len(db),
+               "" if applied else " (partie positive cyclique, prédicats seulement)")
+        db = reduced
+    else:
+        stats["database"] = {"facts": len(db), "reduced": len(db), "semijoin": False}
+
+    # Requête gardée et acyclique : la réécriture FO compilée répond en une
+    # passe ; sinon, recherche IsCertain.
+    tracer.stage = "certainty"
+    with metrics.stage("certainty"):
+        certain = decide(data["query"], db, analysis, tracer, stats)
+        if stats["engine"] == "iscertain":
+            metrics.count(**{name: stats[name] for name in SEARCH_COUNTERS})
+    tracer(SUMMARY, "Certitude ({}) : {}", stats["engine"], certain)
 
     # =========================================================================
     # ---------------------------------------------------------------- Rewriter
-    # Réécriture de la requête, si gardée et acyclique (lemme 6.1)
-    trace.append("\nDébut de la réécriture de la requête")
-    if guarded[0] and not cycle:
-        rewriting = rewrite_closed(data["query"], trace=trace)
-        print("Rewriting:", rewriting)
-        # Conversion de la réécriture en LaTeX
-        latex = fo_to_latex(rewriting)
-    else:
-        trace.append("Requête non gardée ou cyclique, pas de réécriture")
-        rewriting = None
+    if analysis["formula"] is not None:
+        with metrics.stage("render"):
+            rewriting = render(analysis["formula"])
+            # Conversion de la réécriture en LaTeX (depuis l'AST, sans repasser
+            # par la chaîne)
+            latex = fo_to_latex(analysis["formula"])
+        tracer.stage = "render"
+        tracer(DEBUG, "Réécriture : {}", rewriting)
 
     # =========================================================================
     # ------------------------------------------------------------------ Return
-    return data, guarded, graph, cycle, certain, rewriting, latex, trace
+    _finish(stats, metrics, tracer)
+    return data, guarded, graph, cycle, certain, rewriting, latex, tracer.lines(), stats
@@ -0,0 +1,123 @@
+"""
+-------------------------------------------------------------------------------
+csv_loader.py
+
+Chargement direct de relations exportées en CSV/TSV.
+
+Chaque fichier contient une relation (une ligne par fait) et déclare la
+longueur de sa clé primaire. Les lignes sont lues par le module csv (lecteur
+C) et vont directement dans un FactStore, sans passer par la syntaxe
+`Pred(a, b; c)` ni par le parseur. L'index sur la clé primaire est rempli
+pendant la même lecture.
+
+Deux façons de déclarer les relations :
+  - un manifeste JSON :
+        {"Lives": {"file": "lives.csv", "key": 1, "header": true}, …}
+    les chemins étant relatifs au manifeste ; "delimiter" est optionnel
+    (tabulation pour un .tsv, virgule sinon) ;
+  - un répertoire : son manifest.json s'il existe, sinon chaque fichier
+    nommé <Pred>.<longueur de clé>.csv (ou .tsv).
+
+-------------------------------------------------------------------------------
+"""
+
+import csv
+import json
+import os
+import sys
+
+from .factstore import FactStore
+
+MANIFEST = "manifest.json"
+_EXTENSIONS = (".csv", ".tsv")
+
+
+# =============================================================================
+# -------------------------------------------------------------------- Relation
+def load_csv(path, pred, pk_len, store=None, delimiter=None, header=False):
+    """
+    Charge un fichier CSV/TSV comme relation `pred` de `store`.
+    :param pk_len: longueur de la clé primaire (colonnes de tête).
+    :param delimiter: séparateur (déduit de l'extension par défaut).
+    :param header: True si la première ligne contient les noms de colonnes.
+    :return: le FactStore complété.
+    :raises ValueError: ligne d'arité différente de la première.
+    """
+    if store is None:
+        store = FactStore()
+    path = os.fspath(path)
+    if delimiter is None:
+        delimiter = "\t" if path.endswith(".tsv") else ","
+    facts = []
+    key_index = {}
+    arity = None
+    intern = sys.intern
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        if header:
+            next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            fact = tuple(map(intern, row))
+            if arity is None:
+                arity = len(fact)
+                if pk_len > arity:
+                    raise ValueError(f"{path} : clé de longueur {pk_len} pour "
+                                     f"une relation d'arité {arity}")
+            elif len(fact) != arity:
+                raise ValueError(f"{path}, ligne {reader.line_num} : {len(fact)} "
+                                 f"colonnes au lieu de {arity}")
+            facts.append(fact)
+            key = fact[:pk_len]
+            block = key_index.get(key)
+            if block is None:
+                key_index[key] = [fact]
+            else:
+                block.append(fact)
+    indexes = {tuple(range(pk_len)): key_index} if pk_len else {}
+    store.add_relation(pred, facts, indexes)
+    return store
+
+
+# =============================================================================
+# -------------------------------------------------------------------- Base
+def _read_manifest(path):
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    base = os.path.dirname(path)
+    for pred, entry in entries.items():
+        if "file" not in entry or "key" not in entry:
+            raise ValueError(f"{path} : {pred} doit déclarer 'file' et 'key'")
+        yield (pred, os.path.join(base, entry["file"]), int(entry["key"]),
+               entry.get("delimiter"), bool(entry.get("header", False)))
+
+
+def _scan_directory(path):
+    for name in sorted(os.listdir(path)):
+        stem, ext = os.path.splitext(name)
+        if ext not in _EXTENSIONS:
+            continue
+        pred, _, pk_len = stem.rpartition(".")
+        if not pred or not pk_len.isdigit():
+            raise ValueError(f"{name} : nom attendu <Pred>.<longueur de clé>{ext}")
+        yield pred, os.path.join(path, name), int(pk_len), None, False
+
+
+def load_csv_database(source, store=None):
+    """
+    Charge toutes les relations déclarées par `source` (manifeste JSON ou
+    répertoire, voir l'en-tête du module).
+    :return: FactStore, utilisable par is_certain_core, compile_query(…).evaluate
+        et certainty(…, database=…).
+    """
+    if store is None:
+        store = FactStore()
+    if os.path.isdir(source):
+        manifest = os.path.join(source, MANIFEST)
+        entries = _read_manifest(manifest) if os.path.exists(manifest) else _scan_directory(source)
+    else:
+        entries = _read_manifest(source)
+    for pred, path, pk_len, delimiter, header in entries:
+        load_csv(path, pred, pk_len, store, delimiter=delimiter, header=header)
+    return store
@@ -0,0 +1,207 @@
+"""
+-------------------------------------------------------------------------------
+elimination.py
+
+Plan d'élimination d'une requête : la suite des atomes F choisis par
+select_unattacked_non_all_key_atom, suivie par is_certain_core, par le plan
+compilé (evaluator.py) et par la réécriture (rewriter.py).
+
+Le choix de F ne dépend que de la structure de la requête (positions des
+variables, longueurs de clé, polarités), pas des constantes substituées par
+apply_valuation ni de la base. On déroule donc une fois, symboliquement, les
+étapes de la recherche :
+  - branche A (clé avec variables) : les variables de la clé de F sont
+                               liées,
+  - branche B (clé close : vide ou sans variable) : le bloc de F est décidé,
+                               F est retiré, ses variables liées s'il est
+                               positif (thetas), libres s'il est négatif
+                               (q' et les ajouts de ¬E(ȳ), atome négatif
+                               all-key qui ne change pas les choix suivants),
+et on garde pour chaque étape la position de F dans la requête résiduelle,
+la branche et les variables liées.
+
+Un plan est partagé par toutes les requêtes de même forme (cache LRU) et se
+sérialise en JSON (to_dict / from_dict) : un serveur peut le garder d'une
+requête à l'autre, ou le transmettre à un autre processus.
+
+-------------------------------------------------------------------------------
+"""
+
+from .attack_graph import query_shape
+from .cache import LRUCache
+
+# IsCertain suit ce plan et importe ce module : is_variable et la sélection
+# de F sont importés dans les fonctions qui s'en servent.
+
+# Sortes d'étape
+KEY = "key"          # branche A : clé avec variables
+NOKEY = "nokey"      # branche B : clé close (vide ou sans variable)
+ALL_KEY = "all-key"  # cas de base : tous les atomes sont all-key
+STUCK = "stuck"      # aucun atome non-all-key unattacked
+
+PLAN_CACHE_SIZE = 1024
+
+
+def plan_shape(query):
+    """
+    Forme d'une requête pour le plan : la forme du graphe d'attaque
+    (attack_graph.query_shape) où chaque rang devient (rang, variable
+    d'IsCertain). Les deux heuristiques de variable diffèrent (x1 est une
+    variable pour le graphe d'attaque, une constante pour IsCertain) ; la
+    forme garde les deux.
+    :return: (forme, {variable: rang})
+    """
+    from .IsCertain import is_variable
+    shape, names = query_shape(query)
+    return tuple((neg, pk_len, tuple(None if rank is None else (rank, is_variable(a))
+                                     for rank, a in zip(pattern, atom[3])))
+                 for (neg, pk_len, pattern), atom in zip(shape, query)), names
+
+
+class Step:
+    """
+    Étape du plan.
+    index   : position de F dans la requête résiduelle (None pour ALL_KEY et
+              STUCK) ; les ¬E ajoutés par la recherche sont en fin de requête
+              et ne décalent pas les positions
+    kind    : KEY, NOKEY, ALL_KEY ou STUCK
+    negated : polarité de F
+    bound   : rangs (voir plan_shape) des variables liées par l'étape
+    """
+    __slots__ = ("index", "kind", "negated", "bound")
+
+    def __init__(self, kind, index=None, negated=False, bound=()):
+        self.kind = kind
+        self.index = index
+        self.negated = negated
+        self.bound = tuple(bound)
+
+    def to_dict(self):
+        return {"kind": self.kind, "index": self.index, "negated": self.negated,
+                "bound": list(self.bound)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["kind"], data["index"], data["negated"], data["bound"])
+
+    def __repr__(self):
+        return f"Step({self.kind!r}, {self.index!r}, {self.negated!r}, {self.bound!r})"
+
+
+def next_step(atoms, names=None):
+    """
+    Étape suivante pour la requête (résiduelle) `atoms`, calculée sur son
+    graphe d'attaque. `names` donne les rangs des variables (None : rangs
+    de `atoms`).
+    """
+    from .IsCertain import is_variable, is_all_key, select_unattacked_non_all_key_atom
+    if is_all_key(atoms):
+        return Step(ALL_KEY)
+    F = select_unattacked_non_all_key_atom(atoms)
+    if F is None:
+        return Step(STUCK)
+    if names is None:
+        names = plan_shape(atoms)[1]
+    index = next(i for i, a in enumerate(atoms) if a is F)
+    neg, _pred, pk_len, args = F
+    key = [t for t in args[:pk_len] if is_variable(t)]
+    if key:
+        return Step(KEY, index, neg, dict.fromkeys(names[t] for t in key))
+    bound = () if neg else args
+    return Step(NOKEY, index, neg, dict.fromkeys(names[t] for t in bound if is_variable(t)))
+
+
+def _ground(atoms, variables):
+    # Requête telle qu'IsCertain la verrait après substitution : les variables
+    # liées deviennent des constantes (un nom qui n'est pas une variable).
+    return [(neg, pred, pk_len, tuple(f"_{a}" if a in variables else a for a in args))
+            for neg, pred, pk_len, args in atoms]
+
+
+# =============================================================================
+# ------------------------------------------------------------------------ Plan
+class EliminationPlan:
+    """
+    Plan d'élimination d'une forme de requête (voir plan_shape). Les
+    variables liées par une étape sont des constantes pour les suivantes.
+    steps : liste de Step. La dernière est ALL_KEY ou STUCK.
+    """
+
+    cache = LRUCache(maxsize=PLAN_CACHE_SIZE)
+
+    def __init__(self, shape, steps):
+        self.shape = shape
+        self.steps = steps
+
+    @classmethod
+    def of(cls, query):
+        """
+        Plan de `query`, depuis le cache si la forme est connue.
+        """
+        shape, names = plan_shape(query)
+        plan = cls.cache.get(shape)
+        if plan is None:
+            plan = cls(shape, _compile_steps(query, names))
+            cls.cache.put(shape, plan)
+        return plan
+
+    def matches(self, query):
+        """
+        True si le plan s'applique à `query` (même forme).
+        """
+        return plan_shape(query)[0] == self.shape
+
+    def explain(self, query):
+        """
+        Description lisible du plan, avec les noms de variables de `query`.
+        """
+        names = {rank: name for name, rank in plan_shape(query)[1].items()}
+        remaining = list(query)
+        lines = []
+        for n, step in enumerate(self.steps, 1):
+            if step.index is None:
+                lines.append(f"{n}. {step.kind}")
+                continue
+            _neg, pred, _pk, args = remaining[step.index]
+            bound = ", ".join(names[v] for v in step.bound) or "-"
+            lines.append(f"{n}. {step.kind} {'¬' if step.negated else ''}"
+                         f"{pred}({', '.join(args)}) ; liées : {bound}")
+            if step.kind == NOKEY:
+                del remaining[step.index]
+        return "\n".join(lines)
+
+    # -------------------------------------------------------------------------
+    #  Sérialisation
+    def to_dict(self):
+        return {
+            "shape": [[neg, pk_len, [None if p is None else list(p) for p in pattern]]
+                      for neg, pk_len, pattern in self.shape],
+            "steps": [step.to_dict() for step in self.steps],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        shape = tuple((neg, pk_len, tuple(None if p is None else tuple(p) for p in pattern))
+                      for neg, pk_len, pattern in data["shape"])
+        return cls(shape, [Step.from_dict(s) for s in data["steps"]])
+
+
+def _compile_steps(query, names):
+    atoms = list(query)
+    steps = []
+    while True:
+        step = next_step(atoms, names)
+        steps.append(step)
+        if step.index is None:
+            return steps
+        variables = {v for v, rank in names.items() if rank in step.bound}
+        if step.kind == NOKEY:
+            atoms = atoms[:step.index] + atoms[step.index + 1:]
+        atoms = _ground(atoms, variables)
+
+
+def compile_plan(query):
+    """
+    Plan d'élimination de `query` (voir EliminationPlan).
+    """
+    return EliminationPlan.of(query)
@@ -0,0 +1,466 @@
+"""
+-------------------------------------------------------------------------------
+evaluator.py
+
+Compilation de la réécriture FO consistante en un plan exécutable.
+
+rewrite_closed ne produit la réécriture que sous forme de chaîne ; la
+certitude est ensuite décidée par le backtracking d'IsCertain, qui substitue
+des constantes dans la requête et recalcule tout à chaque appel.
+
+Pour une requête gardée et acyclique, les étapes d'IsCertain (atome choisi,
+branche, variables liées) ne dépendent que de la structure de la requête.
+On les déroule donc une seule fois, symboliquement, en un plan :
+  - ∃ sur les blocs de clé (branche A)    → boucle sur un index de hachage,
+  - ∀ sur les faits du bloc de F (branche B, F positif)
+                                          → boucle sur un index de hachage,
+  - q' puis q' ⊓ ¬E(ȳ) par fait du bloc (branche B, F négatif)
+                                          → couche E = {b̄} sur la base,
+  - conjonction all-key (lignes 1–2)      → jointure sur les faits fixes,
+  - base conforme aux clés (0-bis)        → test calculé une fois par base.
+Les variables liées sont gardées dans un environnement au lieu d'être
+substituées, et les sous-résultats sont mémorisés sur les valeurs des seules
+variables encore utiles. Un plan est compilé une fois par requête puis
+évalué sur autant de bases que nécessaire.
+
+La réécriture (rewriter.rewrite_formula) suit les mêmes étapes : chaque
+noeud du plan évalue la sous-formule de son étape, et le plan, la
+réécriture et IsCertain décident la même chose.
+
+-------------------------------------------------------------------------------
+"""
+
+from itertools import count
+
+from .IsCertain import (is_variable, is_all_key, unify_tuple, positive_relations,
+                        key_guard, select_unattacked_non_all_key_atom)
+from .elimination import _ground
+from .factstore import FactStore
+from .planner import plan_join
+from .cache import LRUCache, canonical_query
+
+# Noms des relations fraîches ¬E des blocs négatifs
+_fresh = count(1)
+
+
+# =============================================================================
+# ---------------------------------------------------------------------- Noeuds
+class _Const:
+    def __init__(self, value):
+        self.value = value
+
+    def run(self, ev, env):
+        return self.value
+
+    def explain(self, depth=0):
+        return ["  " * depth + ("⊤" if self.value else "⊥")]
+
+
+class _Join:
+    """
+    Évaluation directe d'une conjonction (équivalent de db_satisfies) :
+    boucles imbriquées sur les atomes positifs, chacune servie par un index
+    sur les positions déjà liées, dans l'ordre choisi par le planificateur
+    pour la base évaluée, et anti-jointures pour les atomes négatifs.
+    """
+
+    def __init__(self, atoms, bound, fixed=False):
+        self.atoms = atoms
+        self.bound = frozenset(bound)
+        # Cas all-key : les atomes positifs ne lisent que les faits fixes
+        self.fixed = frozenset(positive_relations(atoms)) if fixed else frozenset()
+        # Ordre d'écriture (backend SQL) ; l'évaluation suit le plan choisi
+        # sur les statistiques de la base (planner.py)
+        self.steps = []
+        bound = set(bound)
+        for neg in (False, True):
+            for _, pred, _, args in (a for a in atoms if a[0] == neg):
+                positions = tuple(i for i, t in enumerate(args)
+                                  if not is_variable(t) or t in bound)
+                self.steps.append((neg, pred, args, positions))
+                if not neg:
+                    bound |= {t for t in args if is_variable(t)}
+        self._pk_lens = dict(self.fixed)
+
+    def run(self, ev, env):
+        plan = ev.join_plan(self)
+        if ev.reads is None:
+            return plan.satisfiable(ev.view(self.fixed), env)
+        reads = set()
+        result = plan.satisfiable(ev.view(self.fixed), env, reads)
+        for pred, positions, values in reads:
+            pk_len = self._pk_lens.get(pred)
+            if pk_len is not None:
+                # Fait fixe : tout son bloc décide s'il l'est, l'accès est
+                # réduit aux positions de clé
+                kept = [i for i, p in enumerate(positions) if p < pk_len]
+                positions = tuple(positions[i] for i in kept)
+                values = tuple(values[i] for i in kept)
+            ev.reads.add((pred, positions, values))
+        return result
+
+    def explain(self, depth=0):
+        atoms = " ⊓ ".join(_atom_str(a) for a in self.atoms) or "⊤"
+        return ["  " * depth + f"join {atoms}" + (" (faits fixes)" if self.fixed else "")]
+
+
+class _Switch:
+    """
+    Test 0-bis d'IsCertain : si la base respecte les clés des prédicats de la
+    requête résiduelle, évaluation directe, sinon on continue la recherche.
+    Les deux branches décident la même chose : quand les lectures sont
+    relevées, la recherche est suivie directement, sans dépendre de la
+    conformité de relations entières.
+    """
+
+    def __init__(self, checks, direct, search):
+        self.checks = checks
+        self.direct = direct
+        self.search = search
+
+    def run(self, ev, env):
+        if ev.reads is None and ev.consistent(self.checks):
+            return self.direct.run(ev, env)
+        return self.search.run(ev, env)
+
+    def explain(self, depth=0):
+        preds = ", ".join(sorted(p for p, _ in self.checks))
+        return (["  " * depth + f"si clés respectées ({preds}) :"]
+                + self.direct.explain(depth + 1)
+                + ["  " * depth + "sinon :"]
+                + self.search.explain(depth + 1))
+
+
+class _Memo:
+    """
+    Mémorise le résultat d'un sous-plan sur les valeurs des variables liées
+    qui apparaissent encore dans la requête résiduelle.
+    """
+
+    def __init__(self, keys, child):
+        self.keys = tuple(sorted(keys))
+        self.child = child
+
+    def run(self, ev, env):
+        key = (id(self), tuple(env[v] for v in self.keys))
+        if ev.reads is not None:
+            return self._run_reads(ev, env, key)
+        result = ev.memo.get(key)
+        if result is None:
+            result = self.child.run(ev, env)
+            ev.memo[key] = result
+        return result
+
+    def _run_reads(self, ev, env, key):
+        # Lectures relevées : l'entrée garde celles du sous-plan, reportées
+        # à chaque réutilisation
+        entry = ev.memo.get(key)
+        if entry is None:
+            outer, ev.reads = ev.reads, set()
+            try:
+                entry = (self.child.run(ev, env), ev.reads)
+            finally:
+                ev.reads = outer
+            ev.memo[key] = entry
+        ev.reads.update(entry[1])
+        return entry[0]
+
+    def explain(self, depth=0):
+        return self.child.explain(depth)
+
+
+class _KeyExists:
+    """
+    Branche A : ∃ un bloc de clé de F (compatible avec les positions liées)
+    pour lequel la requête résiduelle est certaine.
+    """
+
+    def __init__(self, atom, key_vars, child, guard=None):
+        _, self.pred, self.pk_len, self.args = atom
+        self.key_vars = key_vars
+        self.positions = tuple(i for i in range(self.pk_len)
+                               if not is_variable(self.args[i]) or self.args[i] not in key_vars)
+        self.child = child
+        # F négatif : valeurs de clé lues sur un atome positif (key_guard)
+        self.guard = guard
+
+    def run(self, ev, env):
+        return any(self.child.run(ev, env2) for env2 in self.envs(ev, env))
+
+    def envs(self, ev, env):
+        """
+        `env` prolongé par les valeurs de clé de chaque bloc candidat.
+        """
+        if self.guard is not None:
+            yield from self._guard_envs(ev, env)
+            return
+        args = self.args
+        values = tuple(env[args[p]] if is_variable(args[p]) else args[p]
+                       for p in self.positions)
+        if ev.reads is not None:
+            ev.reads.add((self.pred, self.positions, values))
+        for key in ev.db.blocks(self.pred, self.pk_len).keys(self.positions, values):
+            env2 = unify_tuple(args[:self.pk_len], key, env)
+            if env2 is not None:
+                yield env2
+
+    def _guard_envs(self, ev, env):
+        _, pred, _, args = self.guard
+        bound = tuple(i for i, t in enumerate(args) if not is_variable(t) or t in env)
+        values = tuple(env.get(args[i], args[i]) for i in bound)
+        if ev.reads is not None:
+            ev.reads.add((pred, bound, values))
+        seen = set()
+        for fact in ev.db.lookup(pred, bound, values):
+            env2 = self.env_of(fact, env)
+            if env2 is not None:
+                key = tuple(env2[v] for v in self.key_vars)
+                if key not in seen:
+                    seen.add(key)
+                    yield env2
+
+    @property
+    def source(self):
+        # Relation dont les faits donnent les valeurs de clé
+        return self.pred if self.guard is None else self.guard[1]
+
+    def env_of(self, fact, env):
+        """
+        `env` prolongé par les valeurs de clé que donne `fact` (fait de la
+        relation source : F, ou sa garde), None si le fait ne convient pas.
+        """
+        if self.guard is None:
+            return unify_tuple(self.args[:self.pk_len], fact[:self.pk_len], env)
+        theta = unify_tuple(self.guard[3], fact, env)
+        return None if theta is None else {**env, **{v: theta[v] for v in self.key_vars}}
+
+    def has(self, ev, env2):
+        """
+        True si `env2` (voir envs) correspond encore à un bloc candidat.
+        """
+        if self.guard is None:
+            args = self.args[:self.pk_len]
+            return bool(ev.db.lookup(self.pred, range(self.pk_len), [env2.get(t, t) for t in args]))
+        _, pred, _, args = self.guard
+        bound = [i for i, t in enumerate(args) if not is_variable(t) or t in env2]
+        return any(unify_tuple(args, fact, env2) is not None
+                   for fact in ev.db.lookup(pred, bound, [env2.get(args[i], args[i]) for i in bound]))
+
+    def explain(self, depth=0):
+        head = f"∃ bloc {self.pred}({', '.join(self.args[:self.pk_len])})"
+        if self.guard is not None:
+            head += f" (clés lues sur {self.guard[1]}({', '.join(self.guard[3])}))"
+        return [f"{'  ' * depth}{head} :"] + self.child.explain(depth + 1)
+
+
+class _Block:
+    """
+    Branche B, F positif (clé close) : le bloc de F n'est pas vide, chacun de
+    ses faits est compatible avec F et, pour chacun, la requête résiduelle
+    est certaine.
+    """
+
+    def __init__(self, atom, child):
+        _, self.pred, self.pk_len, self.args = atom
+        self.child = child
+
+    def run(self, ev, env):
+        facts = _block(self, ev, env)
+        if not facts:
+            return False
+        args = self.args
+        for fact in dict.fromkeys(facts):
+            env2 = unify_tuple(args, fact, env)
+            if env2 is None or not self.child.run(ev, env2):
+                return False
+        return True
+
+    def explain(self, depth=0):
+        return (["  " * depth + f"∀ fait du bloc {self.pred}({', '.join(self.args)}) :"]
+                + self.child.explain(depth + 1))
+
+
+class _NegBlock:
+    """
+    Branche B, F négatif (clé close) : la requête résiduelle q' est certaine
+    et, pour chaque fait du bloc compatible avec F (valeurs b̄ de ses
+    variables libres ȳ), q' ⊓ ¬E(ȳ) l'est aussi, E étant une relation
+    fraîche qui ne contient que b̄ (évaluée sur une couche de la base).
+    """
+
+    def __init__(self, atom, y_vars, fresh, rest, excluded):
+        _, self.pred, self.pk_len, self.args = atom
+        self.y_vars = y_vars
+        self.fresh = fresh
+        self.rest = rest
+        self.excluded = excluded
+
+    def run(self, ev, env):
+        args = self.args
+        facts = _block(self, ev, env)
+        b_bars = []
+        for fact in facts:
+            env2 = unify_tuple(args, fact, env)
+            if env2 is not None:
+                b_bars.append(tuple(env2[v] for v in self.y_vars))
+        if b_bars and not self.y_vars:
+            return False
+        if not self.rest.run(ev, env):
+            return False
+        for b_bar in dict.fromkeys(b_bars):
+            layer = ev.db.overlay(self.fresh, [b_bar])
+            if not _Evaluation(layer, ev.reads).run(self.excluded, env):
+                return False
+        return True
+
+    def explain(self, depth=0):
+        y = ", ".join(self.y_vars)
+        return (["  " * depth + f"bloc de ¬{self.pred}({', '.join(self.args)}) : q' puis"
+                 f" ∀ fait compatible, ¬{self.fresh}({y}) :"]
+                + self.rest.explain(depth + 1) + self.excluded.explain(depth + 1))
+
+
+def _block(node, ev, env):
+    # Faits du bloc (clé close) de l'atome d'un noeud _Block / _NegBlock
+    key = tuple(env.get(t, t) for t in node.args[:node.pk_len])
+    if ev.reads is not None:
+        ev.reads.add((node.pred, tuple(range(node.pk_len)), key))
+    return ev.db.lookup(node.pred, range(node.pk_len), key)
+
+
+def _atom_str(atom):
+    neg, pred, _, args = atom
+    s = f"{pred}({', '.join(args)})"
+    return f"¬{s}" if neg else s
+
+
+# =============================================================================
+# ----------------------------------------------------------------- Compilation
+def _compile(atoms, bound):
+    checks = frozenset((a[1], a[2]) for a in atoms)
+    direct = _Join(atoms, bound)
+    view = _ground(atoms, bound)
+
+    if not atoms:
+        search = _Const(True)
+    elif is_all_key(view):
+        search = _Join(atoms, bound, fixed=True)
+    else:
+        F = select_unattacked_non_all_key_atom(view)
+        if F is None:
+            search = _Const(False)
+        else:
+            index_F = next(i for i, a in enumerate(view) if a is F)
+            search = _compile_branch(atoms, bound, index_F)
+
+    used = {a for atom in atoms for a in atom[3] if a in bound}
+    return _Memo(used, _Switch(checks, direct, search))
+
+
+def _compile_branch(atoms, bound, index_F):
+    F = atoms[index_F]
+    neg_F, _, pk_F, args_F = F
+
+    # Branche A : ∃ un bloc de F (valeurs des variables de la clé)
+    key_vars = tuple(dict.fromkeys(t for t in args_F[:pk_F] if is_variable(t) and t not in bound))
+    if key_vars:
+        view = _ground(atoms, bound)
+        guard = key_guard(view, view[index_F])
+        guard = None if guard is view[index_F] else atoms[view.index(guard)]
+        return _KeyExists(F, key_vars, _compile(atoms, bound | set(key_vars)), guard)
+
+    # Branche B : clé close, le bloc de F est décidé
+    rest = atoms[:index_F] + atoms[index_F + 1:]
+    y_vars = tuple(dict.fromkeys(t for t in args_F if is_variable(t) and t not in bound))
+    if neg_F:
+        fresh = f"E_{next(_fresh)}"
+        excluded = rest + [(True, fresh, len(y_vars), y_vars)]
+        return _NegBlock(F, y_vars, fresh, _compile(rest, bound), _compile(excluded, bound))
+    return _Block(F, _compile(rest, bound | set(y_vars)))
+
+
+# =============================================================================
+# ------------------------------------------------------------------------ Plan
+class Plan:
+    """
+    Plan compilé d'une requête : évalue la certitude sur une base en une
+    passe, avec le même résultat qu'is_certain_core.
+    `bound` : variables dont la valeur est fournie à l'évaluation (variables
+    libres d'une requête non booléenne) ; elles sont traitées comme des
+    constantes.
+    """
+
+    def __init__(self, query, bound=()):
+        self.query = list(query)
+        self.bound = frozenset(bound)
+        self.root = _compile(self.query, self.bound)
+
+    def evaluate(self, database, env=None):
+        """
+        :param database: liste parsée, dict {pred: […]} ou FactStore.
+        :param env: {variable: valeur} pour les variables de `bound`.
+        :return: True ssi la requête est certaine.
+        """
+        return _Evaluation(FactStore.wrap(database)).run(self.root, dict(env or {}))
+
+    def evaluator(self, database):
+        """
+        Fonction env → certitude sur `database`. Les appels successifs
+        partagent le mémo et les tests de clés : pour évaluer la même
+        requête sur de nombreuses valeurs des variables de `bound`.
+        """
+        ev = _Evaluation(FactStore.wrap(database))
+        return lambda env: ev.run(self.root, dict(env))
+
+    def explain(self):
+        """
+        Description lisible du plan, une ligne par étape.
+        """
+        return "\n".join(self.root.explain())
+
+
+class _Evaluation:
+    def __init__(self, db, reads=None):
+        self.db = db
+        self.memo = {}
+        self._joins = {}
+        # Lectures dans la base, relevées si `reads` est un ensemble (suivi
+        # des dépendances d'une Session) : (pred, positions, valeurs) des
+        # faits cherchés, positions () pour un parcours
+        self.reads = reads
+
+    def run(self, node, env):
+        return node.run(self, env)
+
+    def join_plan(self, node):
+        # Plan de jointure d'un noeud _Join, choisi une fois par évaluation
+        plan = self._joins.get(id(node))
+        if plan is None:
+            plan = plan_join(node.atoms, self.view(node.fixed), node.bound)
+            self._joins[id(node)] = plan
+        return plan
+
+    def view(self, fixed):
+        # Base lue par une jointure (voir FactStore.fixed)
+        return self.db.fixed(fixed) if fixed else self.db
+
+    def consistent(self, checks):
+        # Même critère que le test all_keys_ok d'IsCertain, lu sur les blocs
+        # de clé de la base (calculés une fois par base)
+        return not any(self.db.blocks(pred, pk_len).conflicts for pred, pk_len in checks)
+
+
+_plans = LRUCache(maxsize=1024)
+
+
+def compile_query(query):
+    """
+    Plan compilé de `query`, réutilisé pour toute requête égale à renommage
+    des variables près.
+    """
+    key = canonical_query(query, is_variable)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = Plan(query)
+        _plans.put(key, plan)
+    return plan
@@ -0,0 +1,425 @@
+"""
+-------------------------------------------------------------------------------
+factstore.py
+
+Stockage indexé des faits de la base de données.
+
+La base parsée est une liste [(pred, pk_len, args), …]. IsCertain la
+transformait en {pred: [fact, …]} puis parcourait toute la relation à chaque
+appel. Le FactStore garde la même organisation par prédicat, mais construit
+à la demande des index de hachage sur n'importe quel ensemble de positions
+liées (préfixe de clé, positions constantes, positions de jointure).
+Un index n'est construit qu'une seule fois, lors du premier accès, puis
+réutilisé par toutes les recherches suivantes.
+
+Les relations fraîches (E1, E2, …) de la branche B d'IsCertain sont ajoutées
+par "overlay" : une couche qui partage les relations et les index de sa base.
+
+Les blocs de clé (faits de même prédicat et de même valeur de clé primaire)
+sont eux aussi calculés une fois par (prédicat, longueur de clé) : nombre
+de blocs en conflit, qui répond au test "base conforme aux clés" d'IsCertain
+sans reparcourir la relation, et faits fixes (seuls dans leur bloc, donc
+présents dans toutes les repairs). fixed() donne la vue de la base réduite
+aux faits fixes de quelques relations : un atome positif all-key n'est
+certain que sur un fait fixe.
+
+extend et remove mettent à jour en place les index, les blocs de clé et les
+vues fixed() déjà construits (une Session modifie la base par petits lots) ;
+chaque modification donne un nouveau token à la couche.
+
+-------------------------------------------------------------------------------
+"""
+
+from itertools import count
+
+from .catalog import RelationStats
+
+_store_ids = count(1)
+
+# Variation relative de la taille d'une relation au-delà de laquelle ses
+# statistiques (simples estimations pour le planificateur) sont recalculées
+STATS_DRIFT = 0.1
+
+
+class FactStore:
+    """
+    Ensemble de faits indexés par prédicat.
+
+    :param relations: dict {pred: [fact, …]} (les faits sont des tuples).
+    :param parent: FactStore sous-jacent dans le cas d'un overlay.
+    """
+
+    def __init__(self, relations=None, parent=None):
+        self._relations = {}
+        self._indexes = {}
+        self._blocks = {}
+        self._stats = {}
+        self._fixed = {}
+        self.parent = parent
+        # Identifiant unique de la couche (sert de clé au mémo d'IsCertain)
+        self.token = next(_store_ids)
+        for pred, facts in (relations or {}).items():
+            self._relations[pred] = [tuple(f) for f in facts]
+
+    def __setstate__(self, state):
+        # Copie reçue par un autre processus : nouveau token, pour ne pas
+        # partager l'identifiant d'une couche locale dans les clés de mémo
+        self.__dict__.update(state)
+        self.token = next(_store_ids)
+
+    # -------------------------------------------------------------------------
+    #  Construction
+    @classmethod
+    def from_database(cls, database):
+        """
+        Construit un FactStore depuis la liste parsée [(pred, pk_len, args), …].
+        """
+        relations = {}
+        for pred, _, args in database:
+            relations.setdefault(pred, []).append(tuple(args))
+        return cls(relations)
+
+    @classmethod
+    def wrap(cls, database_or_dict):
+        """
+        Renvoie un FactStore pour un FactStore, un dict {pred: […]} ou
+        la liste parsée par @database.
+        """
+        if isinstance(database_or_dict, FactStore):
+            return database_or_dict
+        if isinstance(database_or_dict, dict):
+            return cls(database_or_dict)
+        return cls.from_database(database_or_dict)
+
+    def overlay(self, pred, facts):
+        """
+        Renvoie une nouvelle couche contenant en plus la relation `pred`.
+        Les relations (et leurs index) de la base ne sont pas copiées.
+        """
+        return FactStore({pred: facts}, parent=self)
+
+    def extend(self, pred, facts):
+        """
+        Ajoute des faits à la relation `pred` de cette couche (chargement par
+        lots). Les index et blocs de clé déjà construits sur `pred` sont mis
+        à jour en place.
+        """
+        facts = [tuple(f) for f in facts]
+        self._relations.setdefault(pred, []).extend(facts)
+        if facts:
+            self._update(pred, facts, ())
+
+    def remove(self, pred, facts):
+        """
+        Retire de la relation `pred` de cette couche toutes les occurrences
+        des faits `facts`. Les index et blocs de clé déjà construits sur
+        `pred` sont mis à jour en place.
+        """
+        drop = {tuple(f) for f in facts}
+        relation = self._relations.get(pred)
+        if relation is None or not drop:
+            return
+        removed = [fact for fact in relation if fact in drop]
+        if removed:
+            relation[:] = [fact for fact in relation if fact not in drop]
+            self._update(pred, (), removed)
+
+    def add_relation(self, pred, facts, indexes=None):
+        """
+        Installe la relation `pred` (liste de tuples, non copiée) avec des
+        index déjà construits {positions: {valeurs: [fact, …]}}, par exemple
+        par un chargeur qui les remplit pendant la lecture.
+        """
+        self._relations[pred] = facts
+        self._invalidate(pred)
+        for positions, index in (indexes or {}).items():
+            self._indexes[(pred, tuple(positions))] = index
+
+    def _invalidate(self, pred):
+        for cache in (self._indexes, self._blocks):
+            for key in [k for k in cache if k[0] == pred]:
+                del cache[key]
+        self._stats.pop(pred, None)
+        self._fixed.clear()
+        self.token = next(_store_ids)
+
+    def _update(self, pred, added, removed):
+        # Mise à jour en place après extend / remove. Les blocs de clé
+        # partagent l'index des positions de clé : on relève l'état des
+        # blocs touchés avant de modifier les index, puis après.
+        changed = list(added) + list(removed)
+        touched = []
+        for (p, pk_len), blocks in self._blocks.items():
+            if p == pred:
+                keys = {fact[:pk_len] for fact in changed}
+                touched.append((pk_len, blocks, keys, blocks.state(keys)))
+
+        drop = set(removed)
+        for (p, positions), index in self._indexes.items():
+            if p != pred:
+                continue
+            for fact in removed:
+                key = tuple(fact[i] for i in positions)
+                bucket = index.get(key)
+                if bucket is None:
+                    continue
+                bucket[:] = [f for f in bucket if f not in drop]
+                if not bucket:
+                    del index[key]
+            for fact in added:
+                index.setdefault(tuple(fact[i] for i in positions), []).append(fact)
+
+        for pk_len, blocks, keys, before in touched:
+            gained, lost = blocks.refresh(keys, before)
+            for relations, view in list(self._fixed.items()):
+                if (pred, pk_len) not in relations:
+                    continue
+                if view is self or pred not in view._relations:
+                    # Relation lue sans restriction : à restreindre si un
+                    # conflit apparaît
+                    if blocks.conflicts:
+                        del self._fixed[relations]
+                else:
+                    view.remove(pred, lost)
+                    view.extend(pred, gained)
+
+        stats = self._stats.get(pred)
+        if stats is not None and abs(len(self._relations[pred]) - stats.cardinality) \
+                > STATS_DRIFT * stats.cardinality:
+            del self._stats[pred]
+        self.token = next(_store_ids)
+
+    # -------------------------------------------------------------------------
+    #  Accès
+    def _layer_of(self, pred):
+        store = self
+        while store is not None:
+            if pred in store._relations:
+                return store
+            store = store.parent
+        return None
+
+    def facts(self, pred):
+        """
+        Tous les faits du prédicat (liste vide si inconnu).
+        """
+        layer = self._layer_of(pred)
+        return layer._relations[pred] if layer is not None else []
+
+    def predicates(self):
+        preds = set(self._relations)
+        if self.parent is not None:
+            preds |= self.parent.predicates()
+        return preds
+
+    def __contains__(self, pred):
+        return self._layer_of(pred) is not None
+
+    def __len__(self):
+        return sum(len(self.facts(p)) for p in self.predicates())
+
+    def get(self, pred, default=None):
+        """
+        Compatibilité avec l'ancien dict {pred: [fact, …]}.
+        """
+        layer = self._layer_of(pred)
+        return layer._relations[pred] if layer is not None else default
+
+    def to_dict(self):
+        return {p: list(self.facts(p)) for p in self.predicates()}
+
+    # -------------------------------------------------------------------------
+    #  Index
+    def index(self, pred, positions):
+        """
+        Index de hachage {valeurs aux positions: [fact, …]} pour `pred`.
+        Construit en un passage lors du premier appel, puis mis en cache dans
+        la couche qui possède la relation.
+        """
+        layer = self._layer_of(pred)
+        if layer is None:
+            return {}
+        positions = tuple(positions)
+        key = (pred, positions)
+        index = layer._indexes.get(key)
+        if index is None:
+            index = {}
+            for fact in layer._relations[pred]:
+                index.setdefault(tuple(fact[i] for i in positions), []).append(fact)
+            layer._indexes[key] = index
+        return index
+
+    def lookup(self, pred, positions, values):
+        """
+        Faits de `pred` dont les `positions` valent `values`.
+        """
+        if not positions:
+            return self.facts(pred)
+        return self.index(pred, positions).get(tuple(values), [])
+
+    # -------------------------------------------------------------------------
+    #  Blocs de clé
+    def blocks(self, pred, pk_len):
+        """
+        Partition des faits de `pred` en blocs de clé (voir KeyBlocks).
+        Construite lors du premier appel, sur l'index des positions de clé,
+        puis mise en cache dans la couche qui possède la relation.
+        """
+        layer = self._layer_of(pred)
+        if layer is None:
+            return KeyBlocks({}, pk_len)
+        key = (pred, pk_len)
+        blocks = layer._blocks.get(key)
+        if blocks is None:
+            blocks = KeyBlocks(layer.index(pred, range(pk_len)), pk_len)
+            layer._blocks[key] = blocks
+        return blocks
+
+    def fixed(self, relations):
+        """
+        Vue de la base où chaque relation (pred, pk_len) de `relations` ne
+        garde que ses faits fixes (seuls dans leur bloc de clé) ; les autres
+        relations sont inchangées. Les relations sans conflit sont lues
+        directement, et la vue est mise en cache dans cette couche.
+        """
+        relations = frozenset(relations)
+        view = self._fixed.get(relations)
+        if view is None:
+            restricted = {}
+            for pred, pk_len in relations:
+                blocks = self.blocks(pred, pk_len)
+                if blocks.conflicts:
+                    # Copie : la vue est ensuite mise à jour en place
+                    restricted[pred] = list(blocks.fixed())
+            view = FactStore(restricted, parent=self) if restricted else self
+            self._fixed[relations] = view
+        return view
+
+    # -------------------------------------------------------------------------
+    #  Statistiques
+    def statistics(self, pred):
+        """
+        Statistiques de `pred` (voir catalog.RelationStats), calculées lors
+        du premier appel puis mises en cache dans la couche qui possède la
+        relation.
+        """
+        layer = self._layer_of(pred)
+        if layer is None:
+            return RelationStats([])
+        stats = layer._stats.get(pred)
+        if stats is None:
+            stats = RelationStats(layer._relations[pred], layer, pred)
+            layer._stats[pred] = stats
+        return stats
+
+
+# =============================================================================
+# ---------------------------------------------------------------- Blocs de clé
+class KeyBlocks:
+    """
+    Blocs de clé d'un prédicat.
+    blocks    : {valeur de clé: [fact, …]}, dans l'ordre de première
+                apparition des clés (l'index du FactStore sur les positions
+                de clé, partagé)
+    conflicts : nombre de blocs d'au moins deux faits distincts (0 : la
+                relation respecte sa clé primaire ; un fait répété n'est pas
+                un conflit)
+    """
+    __slots__ = ("pk_len", "blocks", "conflicts", "_keys", "_fixed")
+
+    def __init__(self, blocks, pk_len):
+        self.pk_len = pk_len
+        self.blocks = blocks
+        self.conflicts = sum(1 for facts in blocks.values() if _conflicting(facts))
+        self._keys = {}
+        self._fixed = None
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def fixed(self):
+        """
+        Faits fixes : un par bloc qui ne contient qu'un fait distinct (ce
+        fait est dans toutes les repairs), dans l'ordre des blocs.
+        """
+        if self._fixed is None:
+            self._fixed = [facts[0] for facts in self.blocks.values()
+                           if not _conflicting(facts)]
+        return self._fixed
+
+    def state(self, keys):
+        """
+        Fait fixe (ou None) et conflit de chacun des blocs `keys`, relevés
+        avant une modification de la relation (voir refresh).
+        """
+        return {key: _block_state(self.blocks.get(key)) for key in keys}
+
+    def refresh(self, keys, before):
+        """
+        Met à jour le nombre de conflits et les index de clés après la
+        modification des blocs `keys` (l'index des blocs, partagé, est déjà
+        à jour), `before` étant leur état relevé par state.
+        :return: (faits devenus fixes, faits qui ne le sont plus)
+        """
+        gained, lost = [], []
+        for key in keys:
+            old_fixed, old_conflict = before[key]
+            facts = self.blocks.get(key)
+            new_fixed, new_conflict = _block_state(facts)
+            self.conflicts += new_conflict - old_conflict
+            if old_fixed != new_fixed:
+                if old_fixed is not None:
+                    lost.append(old_fixed)
+                if new_fixed is not None:
+                    gained.append(new_fixed)
+            existed = old_fixed is not None or old_conflict
+            if existed != bool(facts):
+                for positions, index in self._keys.items():
+                    values = tuple(key[p] for p in positions)
+                    if facts:
+                        index.setdefault(values, []).append(key)
+                    else:
+                        index[values].remove(key)
+                        if not index[values]:
+                            del index[values]
+        if gained or lost:
+            self._fixed = None
+        return gained, lost
+
+    def keys(self, positions=(), values=()):
+        """
+        Clés des blocs dont les `positions` (parmi celles de la clé) valent
+        `values`, dans l'ordre des blocs. Pour des positions partielles, un
+        index {valeurs: [clé, …]} est construit une fois sur les clés.
+        """
+        positions = tuple(positions)
+        if not positions:
+            return list(self.blocks)
+        if len(positions) == self.pk_len:
+            key = [None] * self.pk_len
+            for p, v in zip(positions, values):
+                key[p] = v
+            key = tuple(key)
+            return [key] if key in self.blocks else []
+        index = self._keys.get(positions)
+        if index is None:
+            index = {}
+            for key in self.blocks:
+                index.setdefault(tuple(key[p] for p in positions), []).append(key)
+            self._keys[positions] = index
+        return index.get(tuple(values), [])
+
+
+def _conflicting(facts):
+    # Au moins deux faits distincts dans le bloc
+    first = facts[0]
+    return any(fact != first for fact in facts)
+
+
+def _block_state(facts):
+    # (fait fixe ou None, 1 si le bloc est en conflit) ; bloc vide : (None, 0)
+    if not facts:
+        return None, 0
+    if _conflicting(facts):
+        return None, 1
+    return facts[0], 0
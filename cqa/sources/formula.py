@@ -0,0 +1,395 @@
+"""
+-------------------------------------------------------------------------------
+formula.py
+
+AST des formules FO produites par le rewriter.
+
+Les noeuds sont "hash-consés" : construire deux fois la même formule renvoie
+le même objet. Une sous-formule utilisée plusieurs fois (l'`inner` de la
+branche négative, repris sous chaque ajout de ¬E, par exemple) n'existe donc
+qu'une fois en mémoire et la formule est un DAG.
+
+Le rendu (texte, LaTeX) parcourt ce DAG. Quand le développement complet
+deviendrait trop long, les sous-formules partagées sont nommées
+(Φ1 := …) et référencées par leur nom, ce qui garde une sortie de taille
+linéaire en la taille du DAG.
+
+-------------------------------------------------------------------------------
+"""
+
+from weakref import WeakValueDictionary
+
+# Au-delà de cette taille (en caractères), le rendu nomme les sous-formules
+# partagées au lieu de les recopier.
+EXPAND_LIMIT = 4000
+
+_table = WeakValueDictionary()
+
+
+class Formula:
+    __slots__ = ("__weakref__",)
+
+    def children(self):
+        return ()
+
+    def __str__(self):
+        # Rendu texte (utilisé par les messages de trace, formatés à la demande)
+        return render(self)
+
+
+def _intern(cls, *fields):
+    key = (cls,) + fields
+    node = _table.get(key)
+    if node is None:
+        node = object.__new__(cls)
+        node._set(*fields)
+        _table[key] = node
+    return node
+
+
+# =============================================================================
+# ---------------------------------------------------------------------- Noeuds
+class Top(Formula):
+    __slots__ = ()
+
+    def __new__(cls):
+        return _intern(cls)
+
+    def _set(self):
+        pass
+
+
+class Atom(Formula):
+    __slots__ = ("neg", "pred", "args")
+
+    def __new__(cls, neg, pred, args):
+        return _intern(cls, bool(neg), pred, tuple(str(a) for a in args))
+
+    def _set(self, neg, pred, args):
+        self.neg, self.pred, self.args = neg, pred, args
+
+
+class Eq(Formula):
+    __slots__ = ("left", "right")
+
+    def __new__(cls, left, right):
+        return _intern(cls, str(left), str(right))
+
+    def _set(self, left, right):
+        self.left, self.right = left, right
+
+
+class Conj(Formula):
+    """
+    Conjonction du cas de base (requête all-key) : atomes, conditions de
+    fait fixe et ¬E ajoutés par la branche négative (add_base_atom).
+    """
+    __slots__ = ("atoms",)
+
+    def __new__(cls, atoms):
+        return _intern(cls, tuple(atoms))
+
+    def _set(self, atoms):
+        self.atoms = atoms
+
+    def children(self):
+        return self.atoms
+
+
+class And(Formula):
+    __slots__ = ("parts",)
+
+    def __new__(cls, *parts):
+        if not parts:
+            return Top()
+        if len(parts) == 1:
+            return parts[0]
+        return _intern(cls, tuple(parts))
+
+    def _set(self, parts):
+        self.parts = parts
+
+    def children(self):
+        return self.parts
+
+
+class Not(Formula):
+    __slots__ = ("sub",)
+
+    def __new__(cls, sub):
+        return _intern(cls, sub)
+
+    def _set(self, sub):
+        self.sub = sub
+
+    def children(self):
+        return (self.sub,)
+
+
+class Implies(Formula):
+    __slots__ = ("left", "right")
+
+    def __new__(cls, left, right):
+        return _intern(cls, left, right)
+
+    def _set(self, left, right):
+        self.left, self.right = left, right
+
+    def children(self):
+        return (self.left, self.right)
+
+
+class _Quantifier(Formula):
+    __slots__ = ("vars", "body")
+
+    def __new__(cls, vars_, body):
+        vars_ = tuple(vars_)
+        if not vars_:
+            return body
+        return _intern(cls, vars_, body)
+
+    def _set(self, vars_, body):
+        self.vars, self.body = vars_, body
+
+    def children(self):
+        return (self.body,)
+
+
+class Forall(_Quantifier):
+    __slots__ = ()
+
+
+class Exists(_Quantifier):
+    __slots__ = ()
+
+
+# Noeuds sans sous-formule
+_LEAVES = frozenset((Top, Atom, Eq))
+
+
+# =============================================================================
+# ------------------------------------------------------------- Transformations
+def _postorder(formula, leaves=()):
+    # Liste des noeuds distincts du DAG, chacun après ses sous-formules (de
+    # gauche à droite), dans l'ordre d'un parcours récursif mémoïsé ; les
+    # noeuds de type `leaves` ne sont pas descendus. Pile explicite : les
+    # formules des longues requêtes dépassent la limite de récursion.
+    order = []
+    opened = {}
+    stack = [formula]
+    while stack:
+        node = stack.pop()
+        key = id(node)
+        state = opened.get(key)
+        if state is None:
+            cls = node.__class__
+            if cls in _LEAVES or cls in leaves:
+                opened[key] = True
+                order.append(node)
+            else:
+                # Revu une fois ses sous-formules traitées
+                opened[key] = False
+                stack.append(node)
+                stack.extend(reversed(node.children()))
+        elif not state:
+            opened[key] = True
+            order.append(node)
+    return order
+
+
+def _rebuild(formula, leaf, var=None):
+    # Reconstruit le DAG en appliquant `leaf` aux noeuds sans sous-formule
+    # (Top, Atom, Eq, Conj) et `var` aux variables des quantificateurs.
+    # Chaque noeud partagé n'est transformé qu'une fois.
+    memo = {}
+    for node in _postorder(formula, leaves=(Conj,)):
+        if isinstance(node, And):
+            new = And(*(memo[id(p)] for p in node.parts))
+        elif isinstance(node, Not):
+            new = Not(memo[id(node.sub)])
+        elif isinstance(node, Implies):
+            new = Implies(memo[id(node.left)], memo[id(node.right)])
+        elif isinstance(node, _Quantifier):
+            vars_ = node.vars if var is None else map(var, node.vars)
+            new = type(node)(vars_, memo[id(node.body)])
+        else:
+            new = leaf(node)
+        memo[id(node)] = new
+    return memo[id(formula)]
+
+
+def add_base_atom(formula, atom):
+    """
+    Ajoute `atom` à chaque conjonction de base de la formule (le DAG est
+    parcouru une seule fois, les sous-formules partagées le restent).
+    """
+    return _rebuild(formula, lambda node: Conj(node.atoms + (atom,))
+                    if isinstance(node, Conj) else node)
+
+
+def rename(formula, mapping):
+    """
+    Renomme les variables de la formule selon `mapping` (les autres termes
+    sont inchangés). Le renommage est simultané : {x: y, y: x} échange x et y.
+    """
+    def term(t):
+        return mapping.get(t, t)
+
+    def leaf(node):
+        if isinstance(node, Atom):
+            return Atom(node.neg, node.pred, map(term, node.args))
+        if isinstance(node, Eq):
+            return Eq(term(node.left), term(node.right))
+        if isinstance(node, Conj):
+            return Conj(leaf(a) if a.__class__ in _LEAVES else rename(a, mapping)
+                        for a in node.atoms)
+        return node
+
+    return _rebuild(formula, leaf, term)
+
+
+def dag_size(formula):
+    """
+    Nombre de noeuds distincts de la formule.
+    """
+    seen = set()
+    stack = [formula]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.extend(node.children())
+    return len(seen)
+
+
+# =============================================================================
+# ---------------------------------------------------------------------- Rendu
+class _Syntax:
+    top = "⊤"
+    land = " ⊓ "
+    implies = " → "
+    neg = "¬"
+    forall = "∀"
+    exists = "∃"
+    define = " := "
+    sep = "\n"
+
+    @staticmethod
+    def name(i):
+        return f"Φ{i}"
+
+    @staticmethod
+    def atom(node):
+        return f"{node.pred}({', '.join(node.args)})"
+
+
+class _LatexSyntax(_Syntax):
+    top = r"\top"
+    land = r" \land "
+    implies = r" \rightarrow "
+    neg = r"\lnot "
+    forall = r"\forall "
+    exists = r"\exists "
+    sep = " \\\\\n"
+
+    @staticmethod
+    def name(i):
+        return rf"\Phi_{{{i}}}"
+
+
+def _lengths(formula, syntax):
+    # Longueur du rendu développé de chaque noeud, calculée sur le DAG
+    lengths = {}
+    for node in _postorder(formula):
+        if isinstance(node, Top):
+            n = len(syntax.top)
+        elif isinstance(node, Atom):
+            n = len(syntax.atom(node)) + (len(syntax.neg) if node.neg else 0)
+        elif isinstance(node, Eq):
+            n = len(node.left) + len(node.right) + 3
+        elif isinstance(node, Conj):
+            n = (sum(lengths[id(a)] for a in node.atoms) + len(syntax.land) * (len(node.atoms) - 1)
+                 if node.atoms else len(syntax.top))
+        elif isinstance(node, And):
+            n = sum(lengths[id(p)] for p in node.parts) + len(syntax.land) * (len(node.parts) - 1)
+        elif isinstance(node, Not):
+            n = lengths[id(node.sub)] + len(syntax.neg) + 2
+        elif isinstance(node, Implies):
+            n = lengths[id(node.left)] + lengths[id(node.right)] + len(syntax.implies)
+        else:
+            q = syntax.forall if isinstance(node, Forall) else syntax.exists
+            n = lengths[id(node.body)] + len(q) + len(", ".join(node.vars)) + 5
+        lengths[id(node)] = n
+    return lengths[id(formula)]
+
+
+def _shared(formula):
+    # Noeuds composés référencés plus d'une fois dans le DAG
+    refs = {}
+    stack = [formula]
+    seen = set()
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        for child in node.children():
+            refs[id(child)] = refs.get(id(child), 0) + 1
+        stack.extend(node.children())
+    return {i for i, n in refs.items() if n > 1}
+
+
+def render(formula, share=None, syntax=_Syntax):
+    """
+    Rendu textuel de la formule.
+
+    :param share: True pour nommer les sous-formules partagées (Φ1 := …),
+        False pour tout développer, None pour ne les nommer que si le
+        développement dépasse EXPAND_LIMIT caractères.
+    """
+    if share is None:
+        share = _lengths(formula, syntax) > EXPAND_LIMIT
+    shared = _shared(formula) if share else set()
+    names = {}
+    definitions = []
+    cache = {}
+
+    def text(node):
+        key = id(node)
+        return names[key] if key in names else cache[key]
+
+    for node in _postorder(formula):
+        key = id(node)
+        if isinstance(node, Top):
+            s = syntax.top
+        elif isinstance(node, Atom):
+            s = (syntax.neg if node.neg else "") + syntax.atom(node)
+        elif isinstance(node, Eq):
+            s = f"{node.left} = {node.right}"
+        elif isinstance(node, Conj):
+            s = syntax.land.join(text(a) for a in node.atoms) or syntax.top
+        elif isinstance(node, And):
+            s = syntax.land.join(text(p) for p in node.parts)
+        elif isinstance(node, Not):
+            s = f"{syntax.neg}({text(node.sub)})"
+        elif isinstance(node, Implies):
+            s = f"{text(node.left)}{syntax.implies}{text(node.right)}"
+        else:
+            q = syntax.forall if isinstance(node, Forall) else syntax.exists
+            s = f"{q}{', '.join(node.vars)} ( {text(node.body)} )"
+        if key in shared and not isinstance(node, (Atom, Eq, Top)):
+            name = syntax.name(len(names) + 1)
+            names[key] = name
+            definitions.append(f"{name}{syntax.define}{s}")
+        else:
+            cache[key] = s
+
+    return syntax.sep.join(definitions + [text(formula)])
+
+
+def to_latex(formula, share=None):
+    """
+    Rendu LaTeX de la formule (mêmes règles de partage que render).
+    """
+    return render(formula, share=share, syntax=_LatexSyntax)
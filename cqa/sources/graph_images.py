@@ -0,0 +1,62 @@
+"""
+-------------------------------------------------------------------------------
+graph_images.py
+
+Cache des images de graphes d'attaque.
+
+Dessiner un graphe lance un processus Graphviz `dot`. Les graphes sont donc
+seulement enregistrés (description et signature, sans rendu) pendant le
+traitement d'une requête ; l'image n'est rendue que lorsqu'un client la
+demande, puis gardée en cache par (signature, format).
+
+-------------------------------------------------------------------------------
+"""
+
+from .attack_graph import graph_description, graph_signature, draw_attack_graph
+from .cache import LRUCache
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+class GraphImages:
+    """
+    :param maxsize: nombre maximal d'images rendues gardées.
+    :param max_graphs: nombre maximal de graphes enregistrés (non rendus).
+    """
+
+    def __init__(self, maxsize=256, max_graphs=4096):
+        self._graphs = LRUCache(max_graphs)
+        self._images = LRUCache(maxsize)
+
+    def register(self, graph):
+        """
+        Enregistre un graphe ({atome: [atomes]} ou description) sans le
+        dessiner.
+        :return: sa signature, qui identifie l'image.
+        """
+        description = graph if isinstance(graph, tuple) else graph_description(graph)
+        signature = graph_signature(description)
+        # Toujours put : un graphe déjà connu redevient le plus récent
+        self._graphs.put(signature, description)
+        return signature
+
+    def image(self, signature, format="png"):
+        """
+        Image du graphe `signature`, rendue au premier appel.
+        :return: bytes, ou None si le graphe est inconnu.
+        :raises ValueError: format non supporté.
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Format d'image non supporté : {format}")
+        key = (signature, format)
+        img = self._images.get(key)
+        if img is None:
+            description = self._graphs.get(signature)
+            if description is None:
+                return None
+            img = draw_attack_graph(description, format=format)
+            self._images.put(key, img)
+        return img
+
+    def stats(self):
+        return {"graphs": len(self._graphs), "images": self._images.stats()}
@@ -0,0 +1,229 @@
+"""
+-------------------------------------------------------------------------------
+jobs.py
+
+Exécution en arrière-plan des calculs de certitude longs.
+
+Un JobManager garde une file bornée de jobs et un nombre fixe de threads de
+travail. Chaque job tourne dans son propre processus : c'est ce qui permet
+de l'arrêter vraiment, à l'expiration de son délai ou sur annulation (un
+thread Python ne peut pas être interrompu au milieu d'une recherche).
+
+États d'un job : queued → running → done | failed | timeout | cancelled.
+
+-------------------------------------------------------------------------------
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Intervalle de vérification de l'annulation / du délai pendant un job
+_POLL_INTERVAL = 0.05
+
+FINISHED = ("done", "failed", "timeout", "cancelled")
+
+
+class QueueFull(Exception):
+    """
+    La file d'attente des jobs est pleine.
+    """
+
+
+def _context():
+    # fork quand il existe : le processus du job hérite de l'état déjà chargé
+    # (bases préchargées, caches) et ne réimporte pas le module principal
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def _child(conn, fn, args):
+    # Corps du processus d'un job : renvoie (statut, résultat ou erreur)
+    try:
+        conn.send(("done", fn(*args)))
+    except Exception as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+# =============================================================================
+# ------------------------------------------------------------------------ Job
+class Job:
+    def __init__(self, fn, args, timeout, on_done=None):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.timeout = timeout
+        self.on_done = on_done
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    def _finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self._done.set()
+
+    def to_dict(self):
+        """
+        État du job, sérialisable en JSON.
+        """
+        res = {
+            "job": self.id,
+            "status": self.status,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.status == "done":
+            res["result"] = self.result
+        if self.error is not None:
+            res["error"] = self.error
+        return res
+
+
+# =============================================================================
+# ---------------------------------------------------------------- Job manager
+class JobManager:
+    """
+    :param workers: nombre de jobs exécutés en même temps.
+    :param max_queue: nombre maximal de jobs en attente (au-delà, QueueFull).
+    :param timeout: délai par défaut d'un job, en secondes (None = aucun).
+    :param keep: nombre de jobs terminés gardés pour consultation.
+    """
+
+    def __init__(self, workers=2, max_queue=32, timeout=300, keep=1000):
+        self.timeout = timeout
+        self.keep = keep
+        self._queue = queue.Queue(max_queue)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._context = _context()
+        self._threads = [threading.Thread(target=self._worker, daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    # -------------------------------------------------------------------------
+    #  API
+    def submit(self, fn, *args, timeout=None, on_done=None):
+        """
+        Ajoute un job exécutant fn(*args) dans un processus séparé. `fn`, ses
+        arguments et son résultat doivent pouvoir passer entre processus.
+        :param on_done: fonction appliquée au résultat dans ce processus-ci
+            (pour y enregistrer des données), son retour devient le résultat.
+        :raises QueueFull: si la file d'attente est pleine.
+        """
+        job = Job(fn, args, self.timeout if timeout is None else timeout, on_done)
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull("File d'attente des jobs pleine") from None
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Annule un job en attente ou en cours (son processus est arrêté).
+        :return: le job, ou None s'il est inconnu.
+        """
+        # Sous le verrou : un job en attente est soit annulé ici, soit
+        # démarré par _worker, jamais les deux
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status not in FINISHED:
+                job._cancel.set()
+                if job.status == "queued":
+                    job._finish("cancelled")
+        return job
+
+    def wait(self, job_id, timeout=None):
+        """
+        Attend la fin d'un job au plus `timeout` secondes.
+        :return: le job (éventuellement encore en cours), ou None.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            job._done.wait(timeout)
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {"queue": self._queue.qsize(), "jobs": counts}
+
+    # -------------------------------------------------------------------------
+    #  Exécution
+    def _prune(self):
+        # Oublie les plus anciens jobs terminés au-delà de `keep`
+        finished = [i for i, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job._cancel.is_set() or job.status in FINISHED:
+                    continue
+                job.status = "running"
+                job.started = time.time()
+            self._run(job)
+
+    def _run(self, job):
+        receive, send = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_child, args=(send, job.fn, job.args),
+                                        daemon=True)
+        process.start()
+        send.close()
+        deadline = None if job.timeout is None else job.started + job.timeout
+        try:
+            while True:
+                if receive.poll(_POLL_INTERVAL):
+                    try:
+                        status, value = receive.recv()
+                    except EOFError:
+                        job._finish("failed", error=f"Processus arrêté (code {process.exitcode})")
+                        return
+                    if status == "done":
+                        try:
+                            if job.on_done is not None:
+                                value = job.on_done(value)
+                        except Exception as e:
+                            job._finish("failed", error=f"{type(e).__name__}: {e}")
+                            return
+                        job._finish("done", result=value)
+                    else:
+                        job._finish("failed", error=value)
+                    return
+                if job._cancel.is_set():
+                    job._finish("cancelled")
+                    return
+                if deadline is not None and time.time() > deadline:
+                    job._finish("timeout", error=f"Délai de {job.timeout} s dépassé")
+                    return
+        finally:
+            receive.close()
+            if process.is_alive():
+                process.terminate()
+            process.join()
@@ -0,0 +1,59 @@
+"""
+-------------------------------------------------------------------------------
+metrics.py
+
+Mesures d'une exécution du pipeline de certitude : temps réel et temps CPU
+par étape, et compteurs de la recherche IsCertain.
+
+Le temps CPU est celui du thread courant (time.thread_time) : le serveur
+traite plusieurs requêtes en parallèle dans des threads, le temps CPU du
+processus les mélangerait. Le travail des processus du mode parallèle
+d'IsCertain n'y est donc pas compté (il l'est dans le temps réel).
+
+-------------------------------------------------------------------------------
+"""
+
+import time
+from contextlib import contextmanager
+
+# Compteurs de la recherche IsCertain (voir IsCertain._Search)
+SEARCH_COUNTERS = ("calls", "valuations", "facts_scanned", "max_depth",
+                   "fresh_relations", "memo_hits", "memo_misses")
+
+
+class Metrics:
+    """
+    stages   : {étape: {"wall": secondes, "cpu": secondes}}, cumulés si une
+               étape est mesurée plusieurs fois.
+    counters : {nom: valeur}
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Mesure le bloc `with` comme l'étape `name`.
+        """
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            stage["wall"] += time.perf_counter() - wall
+            stage["cpu"] += time.thread_time() - cpu
+
+    def count(self, **counters):
+        self.counters.update(counters)
+
+    def timings(self):
+        """
+        Temps réel de chaque étape : {étape: secondes}.
+        """
+        return {name: stage["wall"] for name, stage in self.stages.items()}
+
+    def to_dict(self):
+        return {"stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counters": dict(self.counters)}
@@ -22,6 +22,8 @@ not Likes(t,p)    ← (t,p) apparaissent aussi dans Lives
 
 from itertools import combinations
 
+from .tracing import as_tracer, STEPS
+
 
 def is_guarded(query, trace=None):
     """
@@ -39,27 +41,29 @@ def is_guarded(query, trace=None):
     # Séparation des atomes positifs et négatifs
     q_plus = [a for a in query if not a[0]] # Atome positif
     q_minus = [a for a in query if a[0]] # Atome négatif
-    trace.append(f" - Atomes positifs : {q_plus}")
-    trace.append(f" - Atomes négatifs : {q_minus}")
+    trace = as_tracer(trace)
+    if trace.steps:
+        trace(STEPS, " - Atomes positifs : {}", q_plus)
+        trace(STEPS, " - Atomes négatifs : {}", q_minus)
 
     # sjf
     if not _is_self_join_free(q_plus):
-        trace.append(" - Requête non self-join free (SJF)")
+        trace(STEPS, " - Requête non self-join free (SJF)")
         return False, "not sjf"
 
     # NGFO
     if _is_ngfo(q_plus, q_minus):
-        trace.append(" - Requête en NGFO")
+        trace(STEPS, " - Requête en NGFO")
         return True, "NGFO"
 
     # Weakly-guarded
     elif _is_weakly_guarded(q_plus, q_minus):
-        trace.append(" - Requête weakly-guarded")
+        trace(STEPS, " - Requête weakly-guarded")
         return True, "WG"
     
     # La requête n'est pas en NGFO, ni weakly-guarded
     else:
-        trace.append(" - Requête non NGFO, ni weakly-guarded")
+        trace(STEPS, " - Requête non NGFO, ni weakly-guarded")
         return False, None
 
 # =============================================================================
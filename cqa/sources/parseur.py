@@ -5,29 +5,67 @@ parseur.py
 Objet définissant le parseur permettant de passer d'un fichier/texte brut
 vers un dictionnaire de données python.
 
+Deux interfaces :
+  - parse(text) : le texte complet en mémoire → dictionnaire de listes,
+  - iter_parse(source) / load(source) : lecture en flux d'un chemin, d'un
+    fichier ouvert ou d'un itérable de lignes. Les faits sont produits par
+    lots de taille bornée et peuvent aller directement dans un FactStore,
+    sans jamais construire la liste complète de la @database.
+
 --------------------------------------------------------------------------------
 """
 
+import os
 import re
+import sys
+
+from .factstore import FactStore
+
+# Taille par défaut des lots de faits produits par iter_parse
+DEFAULT_BATCH_SIZE = 10_000
+
+_ATOM = re.compile(r"(\w+)\s*\(([^)]*)\)\s*")
+_SEPARATORS = re.compile(r"[,\s]+")
 
-def parse(text):
+
+# =============================================================================
+# ------------------------------------------------------------------- Lignes
+def _lines(source):
     """
-    Fonction permettant de parser un fichier texte brut en un dictionnaire python.
-    :param text: Le texte brut à parser.
-    :return: Un dictionnaire contenant les données du fichier texte.
-    :raises ValueError: Si le texte ne contient pas de données valides.
+    Itère sur les lignes de `source` : chemin de fichier, fichier ouvert ou
+    itérable de lignes. Un chemin est ouvert (et refermé) ici.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8") as f:
+            yield from f
+    else:
+        yield from source
 
-    @database (predicat, longueur de la clé primaire, [attributs])
-    @query (negation, predicat, longueur de la clé primaire, [attributs])
-    
+
+def _parse_atom(line, lineno, raw):
+    """
+    Découpe `pred(k1, k2; a1, a2)` en (pred, pk_len, args).
+    Les chaînes sont internées : une même constante répétée sur des millions
+    de faits n'est stockée qu'une fois.
+    """
+    m = _ATOM.fullmatch(line)
+    if not m:
+        raise ValueError(f"Ligne mal formée (ligne {lineno}) : {raw.rstrip()}")
+    pred, argblock = m.groups()
+    # Séparation clé primaire / autres attributs
+    pk_part, *rest_part = argblock.split(";", 1)
+    pk_args = [sys.intern(a) for a in _SEPARATORS.split(pk_part) if a]
+    rest_args = [sys.intern(a) for a in _SEPARATORS.split(rest_part[0]) if a] if rest_part else []
+    return sys.intern(pred), len(pk_args), tuple(pk_args + rest_args)
+
+
+def _parse_lines(lines):
+    """
+    Coeur du parseur : produit (section, numéro de ligne, élément) pour
+    chaque fait de la @database et chaque atome de la @query.
     """
-    # Var
     current = None
-    database = []
-    query    = []
-    # Parsing
-    # ligne par ligne
-    for raw in text.splitlines():
+    for lineno, raw in enumerate(lines, 1):
         line = raw.strip()
         if not line:
             continue
@@ -48,26 +86,40 @@ def parse(text):
         if current == "query" and (line.startswith("not ") or line.startswith("Not ")):
             neg = True
             line = line[4:].lstrip()
-        
-        # Prédicat et arguments (on garde la position du ";")
-        m = re.fullmatch(r"(\w+)\s*\(([^)]*)\)\s*", line)
-        if not m:
-            raise ValueError(f"Ligne mal formée : {raw}")
-        pred, argblock = m.groups()
-        # Séparation clé primaire / autres attributs
-        pk_part, *rest_part = argblock.split(";", 1)
-        pk_args   = [a.strip() for a in re.split(r"[,\s]+", pk_part) if a.strip()]
-        rest_args = [a.strip() for a in re.split(r"[,\s]+", rest_part[0]) if a.strip()] if rest_part else []
-        args   = pk_args + rest_args
-        args   = tuple(args)
-        pk_len = len(pk_args)
-        # Ajout dans le dictionnaire
+
+        pred, pk_len, args = _parse_atom(line, lineno, raw)
         if current == "database":
-            database.append((pred, pk_len, args))
+            yield current, lineno, (pred, pk_len, args)
         else:
-            query.append((neg, pred, pk_len, args))
+            yield current, lineno, (neg, pred, pk_len, args)
+
+
+# =============================================================================
+# ---------------------------------------------------------------------- Texte
+def parse(text, require_database=True):
+    """
+    Fonction permettant de parser un fichier texte brut en un dictionnaire python.
+    :param text: Le texte brut à parser.
+    :param require_database: False si la base est fournie à part (chargée
+        depuis des CSV, par exemple) : la section @database devient optionnelle.
+    :return: Un dictionnaire contenant les données du fichier texte.
+    :raises ValueError: Si le texte ne contient pas de données valides.
+
+    @database (predicat, longueur de la clé primaire, [attributs])
+    @query (negation, predicat, longueur de la clé primaire, [attributs])
+
+    """
+    # Var
+    database = []
+    query    = []
+    # Parsing ligne par ligne
+    for section, _, item in _parse_lines(text.splitlines()):
+        if section == "database":
+            database.append(item)
+        else:
+            query.append(item)
     # Vérification
-    if not database:
+    if not database and require_database:
         raise ValueError("Aucune @database trouvée")
     if not query:
         raise ValueError("Aucune @query trouvée")
@@ -78,3 +130,61 @@ def parse(text):
         "query": query
     }
 
+
+# =============================================================================
+# ---------------------------------------------------------------------- Flux
+def iter_parse(source, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Parse `source` en flux.
+    :param source: chemin, fichier ouvert ou itérable de lignes.
+    :param batch_size: nombre maximal de faits par lot.
+    :return: générateur de ("database", [(pred, pk_len, args), …]) et
+        ("query", [(neg, pred, pk_len, args), …]). Les faits d'un lot sont
+        dans l'ordre du fichier ; la requête est produite en un seul lot,
+        à la fin.
+    :raises ValueError: ligne mal formée (avec son numéro).
+    """
+    batch = []
+    query = []
+    for section, _, item in _parse_lines(_lines(source)):
+        if section == "query":
+            query.append(item)
+            continue
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield "database", batch
+            batch = []
+    if batch:
+        yield "database", batch
+    if query:
+        yield "query", query
+
+
+def load(source, store=None, batch_size=DEFAULT_BATCH_SIZE, require_query=True):
+    """
+    Charge `source` en flux, les faits allant directement dans un FactStore.
+    :param store: FactStore à compléter (un nouveau par défaut).
+    :param require_query: False pour une base seule (la requête est fournie
+        à part) : la section @query devient optionnelle.
+    :return: (FactStore, requête [(neg, pred, pk_len, args), …]).
+    :raises ValueError: mêmes cas que parse.
+    """
+    if store is None:
+        store = FactStore()
+    query = []
+    loaded = 0
+    for section, items in iter_parse(source, batch_size):
+        if section == "query":
+            query.extend(items)
+            continue
+        by_pred = {}
+        for pred, _, args in items:
+            by_pred.setdefault(pred, []).append(args)
+        for pred, facts in by_pred.items():
+            store.extend(pred, facts)
+        loaded += len(items)
+    if not loaded:
+        raise ValueError("Aucune @database trouvée")
+    if not query and require_query:
+        raise ValueError("Aucune @query trouvée")
+    return store, query
@@ -0,0 +1,273 @@
+"""
+-------------------------------------------------------------------------------
+planner.py
+
+Ordre d'évaluation d'une conjonction d'atomes (db_satisfies, jointures du
+plan FO), choisi d'après les statistiques de la base (catalog.py).
+
+db_satisfies parcourait les atomes positifs dans l'ordre d'écriture : une
+requête mal ordonnée pouvait énumérer un produit cartésien avant la
+première jointure. Le planificateur choisit, à chaque pas, l'atome positif
+dont la recherche par index sur les positions déjà liées (constantes et
+variables des atomes précédents) renvoie le moins de faits estimés, et
+place chaque atome négatif dès que ses variables partagées avec les atomes
+positifs sont liées (il ne fait que filtrer). Le résultat (satisfiable ou
+non) ne dépend pas de l'ordre.
+
+Les atomes négatifs sont vérifiés par anti-jointure de hachage : au lieu
+d'unifier chaque fait compatible, la présence de la clé liée dans l'index
+suffit (sauf variable non liée répétée dans l'atome). Un atome négatif placé
+juste après l'atome positif qui lie ses dernières variables filtre
+directement les faits de cet atome, sur l'ensemble des clés négatives
+regroupées par les valeurs liées avant lui.
+
+Le plan choisi est un JoinPlan, lisible par explain() et to_dict().
+
+-------------------------------------------------------------------------------
+"""
+
+# IsCertain planifie ses jointures avec ce module : is_variable et
+# unify_tuple sont importés dans les fonctions.
+
+
+class JoinStep:
+    """
+    Étape du plan.
+    atom      : (neg, pred, pk_len, args)
+    positions : positions liées à l'exécution (recherche par index)
+    estimate  : nombre estimé de faits renvoyés par la recherche
+    """
+    __slots__ = ("atom", "positions", "estimate")
+
+    def __init__(self, atom, positions, estimate):
+        self.atom = atom
+        self.positions = positions
+        self.estimate = estimate
+
+    def to_dict(self):
+        neg, pred, _, args = self.atom
+        return {"negated": neg, "pred": pred, "args": list(args),
+                "positions": list(self.positions), "estimate": self.estimate}
+
+
+# =============================================================================
+# ------------------------------------------------------------------------ Plan
+class JoinPlan:
+    """
+    Ordre d'évaluation d'une conjonction sur une base.
+    bound : variables liées avant la première étape
+    steps : liste de JoinStep
+    """
+
+    def __init__(self, bound, steps):
+        self.bound = bound
+        self.steps = steps
+        self._prepared = None
+
+    def explain(self):
+        """
+        Description lisible du plan, une ligne par étape.
+        """
+        lines = []
+        for n, step in enumerate(self.steps, 1):
+            neg, pred, _, args = step.atom
+            access = f"index {list(step.positions)}" if step.positions else "parcours"
+            if neg:
+                access = f"anti-jointure, {access}"
+            lines.append(f"{n}. {'¬' if neg else ''}{pred}({', '.join(args)}) ; "
+                         f"{access} ; ~{step.estimate:g} faits")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"bound": sorted(self.bound), "steps": [s.to_dict() for s in self.steps]}
+
+    def satisfiable(self, db, env=None, reads=None):
+        """
+        True ssi la conjonction a une correspondance dans `db` (FactStore)
+        qui prolonge `env` et ne contredit aucun atome négatif.
+        :param reads: ensemble où relever les accès à `db` (pred, positions,
+            valeurs), positions () pour un parcours ; None pour ne rien
+            relever.
+        """
+        from .IsCertain import unify_tuple
+        probes = self._probes(db)
+        if not probes:
+            return True
+
+        def candidates(probe, env):
+            if reads is not None:
+                reads.add((probe.pred, probe.positions, probe.key(env)))
+                reads.update(anti.read(env) for anti in probe.filters)
+            facts = probe.index.get(probe.key(env), ()) if probe.index is not None \
+                else db.facts(probe.pred)
+            if probe.anti:
+                # Un seul fait compatible suffit à rejeter env
+                if probe.exact:
+                    return iter(()) if facts else iter((env,))
+                for fact in facts:
+                    if unify_tuple(probe.args, fact, env) is not None:
+                        return iter(())
+                return iter((env,))
+            for anti in probe.filters:
+                excluded = anti.excluded(env)
+                if excluded:
+                    project = anti.project
+                    facts = [fact for fact in facts if project(fact) not in excluded]
+            return (env2 for env2 in (unify_tuple(probe.args, fact, env) for fact in facts)
+                    if env2 is not None)
+
+        # Backtracking sur une pile explicite : pour chaque étape engagée,
+        # l'itérateur de ses environnements prolongés
+        iterators = [candidates(probes[0], dict(env or {}))]
+        while iterators:
+            env = next(iterators[-1], None)
+            if env is None:
+                iterators.pop()
+            elif len(iterators) == len(probes):
+                return True
+            else:
+                iterators.append(candidates(probes[len(iterators)], env))
+        return False
+
+    def _probes(self, db):
+        # Accès de chaque étape à `db`, préparés une fois par base
+        if self._prepared is not None and self._prepared[0] == db.token:
+            return self._prepared[1]
+        probes = []
+        for step in self.steps:
+            # Anti-jointure exacte placée juste après l'atome positif qui lie
+            # ses dernières variables : vérifiée sur les faits de cet atome,
+            # avant de prolonger l'environnement
+            if step.atom[0] and _exact(step) and probes and not probes[-1].anti:
+                probes[-1].filters.append(_AntiJoin(step, probes[-1], db))
+            else:
+                probes.append(_Probe(step, db))
+        self._prepared = (db.token, probes)
+        return probes
+
+
+class _Probe:
+    """
+    Accès d'une étape à la base pendant satisfiable : l'index de hachage sur
+    ses positions liées (None sans position liée) et la clé de recherche.
+    Pour un atome négatif (anti), `exact` indique que la présence de la clé
+    dans l'index décide seule : les variables non liées n'y sont pas
+    répétées et s'unifient avec n'importe quel fait.
+    Pour un atome positif, `filters` liste les anti-jointures (_AntiJoin)
+    vérifiées sur ses faits.
+    """
+    __slots__ = ("pred", "args", "positions", "anti", "exact", "index", "key", "filters")
+
+    def __init__(self, step, db):
+        from .IsCertain import is_variable
+        neg, pred, _, args = step.atom
+        self.pred = pred
+        self.args = args
+        self.positions = step.positions
+        self.anti = neg
+        self.exact = _exact(step)
+        self.index = db.index(pred, step.positions) if step.positions else None
+        self.key = _key([(args[p], is_variable(args[p])) for p in step.positions])
+        self.filters = []
+
+
+class _AntiJoin:
+    """
+    Anti-jointure par hachage d'un atome négatif exact sur les faits de
+    l'atome positif qui le précède. Les faits négatifs sont cherchés par la
+    partie de la clé liée avant l'atome positif (constantes, environnement) ;
+    excluded(env) est l'ensemble, calculé une fois par valeur de cette
+    partie, des projections de faits positifs à rejeter, project(fact) la
+    projection d'un fait positif et read(env) l'accès correspondant à la base
+    (voir JoinPlan.satisfiable).
+    """
+    __slots__ = ("excluded", "project", "read")
+
+    def __init__(self, step, positive, db):
+        from .IsCertain import is_variable
+        _, pred, _, args = step.atom
+        outer, inner, columns = [], [], []
+        for p in step.positions:
+            t = args[p]
+            if is_variable(t) and t in positive.args:
+                inner.append(p)
+                columns.append(positive.args.index(t))
+            else:
+                outer.append(p)
+        key = _key([(args[p], is_variable(args[p])) for p in outer])
+        groups = {}
+
+        def excluded(env):
+            values = key(env)
+            group = groups.get(values)
+            if group is None:
+                group = groups[values] = {tuple(fact[p] for p in inner)
+                                          for fact in db.lookup(pred, outer, values)}
+            return group
+
+        self.excluded = excluded
+        outer_positions = tuple(outer)
+        self.read = lambda env: (pred, outer_positions, key(env))
+        if len(columns) == 1:
+            c = columns[0]
+            self.project = lambda fact: (fact[c],)
+        else:
+            self.project = lambda fact: tuple(fact[c] for c in columns)
+
+
+def _exact(step):
+    # Atome dont les variables non liées ne sont pas répétées : toute
+    # correspondance sur les positions liées s'unifie
+    from .IsCertain import is_variable
+    args = step.atom[3]
+    free = [args[i] for i in range(len(args))
+            if i not in step.positions and is_variable(args[i])]
+    return len(set(free)) == len(free)
+
+
+def _key(terms):
+    # Clé de recherche depuis l'environnement : [(terme, variable ?), …]
+    return lambda env: tuple(env[t] if var else t for t, var in terms)
+
+
+def plan_join(atoms, db, bound=()):
+    """
+    Plan d'évaluation de la conjonction `atoms` sur `db` (FactStore), les
+    variables `bound` étant déjà liées.
+    """
+    from .IsCertain import is_variable
+    initial = frozenset(bound)
+    bound = set(bound)
+    positive = [a for a in atoms if not a[0]]
+    negative = [a for a in atoms if a[0]]
+    positive_vars = {t for _, _, _, args in positive for t in args if is_variable(t)}
+    steps = []
+
+    def bound_positions(args):
+        return tuple(i for i, t in enumerate(args) if not is_variable(t) or t in bound)
+
+    def place_negatives():
+        # Les variables absentes des atomes positifs restent libres : elles
+        # s'unifient avec n'importe quelle valeur, où que soit l'atome
+        for atom in list(negative):
+            args = atom[3]
+            if all(t in bound for t in args if is_variable(t) and t in positive_vars):
+                positions = bound_positions(args)
+                steps.append(JoinStep(atom, positions,
+                                      db.statistics(atom[1]).estimate(positions, atom[2])))
+                negative.remove(atom)
+
+    place_negatives()
+    while positive:
+        best = None
+        for atom in positive:
+            positions = bound_positions(atom[3])
+            estimate = db.statistics(atom[1]).estimate(positions, atom[2])
+            if best is None or estimate < best[2]:
+                best = (atom, positions, estimate)
+        atom, positions, estimate = best
+        positive.remove(atom)
+        steps.append(JoinStep(atom, positions, estimate))
+        bound |= {t for t in atom[3] if is_variable(t)}
+        place_negatives()
+    return JoinPlan(initial, steps)
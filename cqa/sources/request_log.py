@@ -0,0 +1,76 @@
+"""
+-------------------------------------------------------------------------------
+request_log.py
+
+Journal des requêtes du serveur, au format JSON lines.
+
+Le thread qui traite une requête ne fait que déposer l'enregistrement dans
+une file (QueueHandler) ; un thread d'arrière-plan (QueueListener) l'écrit
+dans le fichier. Le fichier tourne par taille (RotatingFileHandler) :
+queries.jsonl, queries.jsonl.1, …
+
+Un enregistrement par ligne, par exemple :
+  {"time": "2025-01-01T12:00:00", "ip": "1.2.3.4", "query_hash": "…",
+   "timings": {"parse": 0.001, …}, "outcome": {"certain": true, …}}
+
+-------------------------------------------------------------------------------
+"""
+
+import hashlib
+import json
+import logging
+import queue
+from datetime import datetime
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+_log_ids = count(1)
+
+
+def query_hash(text):
+    """
+    Empreinte courte (sha256 tronqué) du texte d'une requête.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class _JSONFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.fields, ensure_ascii=False, default=str)
+
+
+class RequestLog:
+    """
+    :param path: fichier du journal.
+    :param max_bytes: taille au-delà de laquelle le fichier tourne.
+    :param backup_count: nombre d'anciens fichiers gardés.
+    """
+
+    def __init__(self, path="queries.jsonl", max_bytes=10_000_000, backup_count=5):
+        handler = RotatingFileHandler(path, maxBytes=max_bytes,
+                                      backupCount=backup_count, encoding="utf-8")
+        handler.setFormatter(_JSONFormatter())
+        self._queue = queue.Queue()
+        self._listener = QueueListener(self._queue, handler)
+        self._logger = logging.getLogger(f"cqa.requests.{next(_log_ids)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(QueueHandler(self._queue))
+        self._listener.start()
+
+    def record(self, **fields):
+        """
+        Ajoute un enregistrement (sans attendre l'écriture). L'horodatage
+        est ajouté s'il n'est pas fourni.
+        """
+        fields.setdefault("time", datetime.now().isoformat(timespec="milliseconds"))
+        self._logger.info("request", extra={"fields": fields})
+
+    def close(self):
+        """
+        Écrit les enregistrements en attente et arrête le thread d'écriture.
+        """
+        self._listener.stop()
+        self._logger.handlers.clear()
+        for handler in self._listener.handlers:
+            handler.close()
@@ -4,7 +4,11 @@
 # Redo du module en entier... 
 
 from itertools import count
-from .IsCertain import is_variable, is_all_key_atom, select_unattacked_non_all_key_atom
+from .IsCertain import is_variable, key_guard
+from .elimination import EliminationPlan, plan_shape, _ground, KEY, ALL_KEY, STUCK
+from .formula import (Formula, Top, Atom, Eq, Conj, And, Not, Implies, Forall, Exists,
+                      add_base_atom, render, to_latex)
+from .tracing import as_tracer, STEPS, DEBUG
 
 
 _var_counter = count(1)
@@ -16,22 +20,6 @@ def _non_key_var_positions(atom):
     neg, pred, pk_len, args = atom
     return [i for i in range(pk_len, len(args)) if is_variable(args[i])]
 
-def _distinct_non_key_var_map(atom):
-    """Retourne (mapping, positions) pour les variables hors-clé.
-       mapping: { var -> fresh_var }
-       positions: { var -> [pos1, pos2, ...] } (toutes les occurrences)
-    """
-    neg, pred, pk_len, args = atom
-    mapping = {}
-    positions = {}
-    for j in range(pk_len, len(args)):
-        a = args[j]
-        if is_variable(a):
-            if a not in mapping:
-                mapping[a] = f"{a}{next(_var_counter)}"  # un seul frais par variable
-            positions.setdefault(a, []).append(j)
-    return mapping, positions
-
 # -----------------------------------------------------------------------------
 #  Pretty-printing FO
 def atom_to_str(atom):
@@ -52,6 +40,8 @@ def exists(vars_, phi):
     return f"∃{', '.join(vars_)} ( {phi} )" if vars_ else phi
 
 def fo_to_latex(fo_string):
+    if isinstance(fo_string, Formula):
+        return to_latex(fo_string)
     return (
         fo_string
         .replace("∀", r"\forall ")
@@ -63,12 +53,6 @@ def fo_to_latex(fo_string):
         .replace(",", ", ")
     )
 
-# -----------------------------------------------------------------------------
-#  nouveaux symboles frais  (E1, E2, …)  pour le cas pk vide
-_fresh = count(1)
-def fresh_rel():
-    return f"E{next(_fresh)}"
-
 # -----------------------------------------------------------------------------
 #  utilitaires variables
 def _key_vars(atom):
@@ -91,14 +75,6 @@ def _free_vars_atoms(atoms):
 def _format_positive(pred, args):
     return f"{pred}({', '.join(args)})"
 
-# nonkey helpers (post memoire)
-def _nonkey_positions(F):
-    """Renvoie les indices de positions hors-clé, en supposant que
-    les positions de clé sont les 'pk_len' premières."""
-    neg, pred, pk_len, args = F
-    n = len(args)
-    return [i for i in range(n) if i >= pk_len]
-
 # si tu n’as pas déjà un fresh_var():
 def fresh_var(prefix="z"):
     global _var_counter
@@ -109,21 +85,6 @@ def fresh_var(prefix="z"):
         _var_counter = count(1)
     return f"{prefix}{next(_var_counter)}"
 
-def _fresh_nonkey_per_position(F):
-    """Une variable fraîche par **position hors-clé** (inclut constantes/répétitions dans les égalités)."""
-    neg, pred, pk_len, args = F
-    nonkey_pos = _nonkey_positions(F)
-    zvars = [fresh_var() for _ in nonkey_pos]
-
-    # antécédent: R(key, z...) en remplaçant chaque position hors-clé par sa fraîche
-    ant_args = list(args)
-    for i, zi in zip(nonkey_pos, zvars):
-        ant_args[i] = zi
-
-    # égalités positionnelles: zi = args[i] (constantes ou variables, répétitions incluses)
-    eq_atoms = [f"{zi} = {args[i]}" for i, zi in zip(nonkey_pos, zvars)]
-    return zvars, ant_args, eq_atoms
-
 def _vars_in_atoms(atoms):
     """Variables (strings) apparaissant dans une liste d’atomes."""
     vs = set()
@@ -134,168 +95,247 @@ def _vars_in_atoms(atoms):
     return sorted(vs)
 
 # -----------------------------------------------------------------------------
-#  réécriture principale (récursive)
-def rewrite(query, trace=None):
+#  réécriture principale
+# La réécriture suit les étapes de la recherche d'IsCertain (plan
+# d'élimination, voir elimination.py) : chaque étape quantifie les variables
+# qu'elle lie et n'a qu'un sous-appel (inner, réécriture du reste). La
+# réécriture est une chaîne de descentes (_rewrite_descend, jusqu'à un cas de
+# base) suivie des remontées dans l'ordre inverse (_rewrite_ascend, qui
+# construit la formule de l'étape autour de inner).
+def rewrite(query, trace=None, plan=None):
+    """
+    Retourne la formule FO (AST, voir formula.py), close, qui décide la même
+    chose qu'is_certain_core :
+      - clé de F avec variables : ∃ clé (∃ fait du bloc ⊓ rew(q)) ,
+      - clé close, F positif : le bloc est non vide et chacun de ses faits
+          s'unifie avec F et rend le reste certain :
+          ∃z R(k, z) ⊓ ∀z ( R(k, z) → ∃ȳ (∧ z_i = arg_i ⊓ rew(q')) ) ,
+      - clé close, F négatif : rew(q') et, pour chaque fait du bloc qui
+          s'unifie avec F (valeurs b̄ de ȳ), rew(q' ⊓ ¬E(ȳ)) avec E = {b̄} ;
+          ¬E(ȳ) devient ¬(∧ y_i = b_i) dans les conjonctions de base,
+      - cas de base all-key : un atome positif doit être un fait fixe (seul
+          dans son bloc), un atome négatif est lu sur toute la base.
+    Les variables liées par une étape sont quantifiées à cette étape (pas de
+    fermeture globale), et les variables qui n'apparaissent que dans des
+    atomes négatifs le sont sous la négation, comme dans la recherche.
+    Les sous-formules réutilisées (inner) sont partagées dans le DAG ; chaque
+    atome négatif à clé close reprend toutefois la suite sous un nouveau ¬E,
+    et le DAG peut doubler à chacun de ces atomes.
+    Itérative (pile des étapes) : pas de limite de profondeur ;
+    rewrite_recursive est la version récursive de référence.
     """
-    Retourne une chaîne FO. Conforme aux points suivants:
-      - sélection d’un atome non-all-key unattacked,
-      - cas pk>0 :
-          * négatif = ∀ (fraîches par position hors-clé) [
-              R(key, z) → ∃( rew(rest) ∧ ¬(∧ égalités positionnelles z_i = arg_i) )
-            ]  ET  rew(rest) au niveau courant (conjonction extérieure),
-          * positif = cas spécial clé simple avec garde ; sinon ∃key(F)(F ⊓ rew(rest))
-      - cas pk=0 : usage d’un symbole frais E pour le négatif ; garde universelle,
-      - cas de base all-key : conjonction fermée sur les variables libres.
+    trace = as_tracer(trace)
+    state = _State(query, plan)
+    frames = []
+    while True:
+        frame, rest = _rewrite_descend(query, trace, state)
+        if frame is None:
+            break
+        frames.append(frame)
+        query = rest
+    result = rest
+    for frame in reversed(frames):
+        result = _rewrite_ascend(frame, result, trace)
+    return result
+
+
+def rewrite_recursive(query, trace=None, plan=None):
     """
-    if trace is None:
-        trace = []
+    Version récursive de rewrite, même résultat, gardée comme référence pour
+    les tests différentiels. Limitée par la profondeur de récursion.
+    """
+    return _rewrite_recursive(query, as_tracer(trace), _State(query, plan))
 
-    trace.append(f"== Appel rewrite sur requête : {query}")
 
-    # Cas base : tous all-key -> on ferme existentiellement les variables libres
-    if all(is_all_key_atom(a) for a in query):
-        base = conj(query)
-        trace.append(" - Cas de base : all-key → conjonction brute")
-        trace.append(f"   → {base}")
-        return base
+def _rewrite_recursive(query, trace, state):
+    frame, rest = _rewrite_descend(query, trace, state)
+    if frame is None:
+        return rest
+    return _rewrite_ascend(frame, _rewrite_recursive(rest, trace, state), trace)
 
-    # Sélection d’un atome non-all-key et unattacked (suivant l’algo)
-    F = select_unattacked_non_all_key_atom(query, trace=trace)
-    if F is None:
-        # sécurité : si rien de sélectionnable, on renvoie la conjonction fermée existentiellement
-        base = conj(query)
-        trace.append(" - Aucun atome non-all-key unattacked → conjonction brute")
-        trace.append(f"   → {base}")
-        return base
 
-    trace.append(f" - Atome choisi pour élimination : {F}")
+class _State:
+    """
+    Avancement dans le plan d'élimination : étapes, rang des variables et
+    variables déjà quantifiées par les étapes précédentes.
+    """
 
-    neg, pred, pk_len, args = F
-    key_vars = _key_vars(F)
-    non_key_vars = _non_key_vars(F)
-    rest_query = [a for a in query if a is not F]
+    def __init__(self, query, plan):
+        if plan is None:
+            plan = EliminationPlan.of(query)
+        elif not plan.matches(query):
+            raise ValueError("Le plan d'élimination ne correspond pas à la requête")
+        self.steps = plan.steps
+        self.position = 0
+        self.names = {rank: name for name, rank in plan_shape(query)[1].items()}
+        self.bound = set()
 
-    # -----------------------------------------------------------
-    # A) Clé non vide
-    if pk_len > 0:
-        trace.append(f" - Clé non vide (pk_len = {pk_len}) → branche A")
-        # inner = rewrite(rest_query, trace)
+    def next(self):
+        step = self.steps[self.position]
+        self.position += 1
+        return step
 
-        if not neg:
-            trace.append(" - F est positif")
-
-            # 1) formulation de l'intérieur
-            inner = rewrite(rest_query, trace)
-
-            # 2) hors-clé : distincts + copies fraîches
-            mapping, positions = _distinct_non_key_var_map(F)
-            y = list(mapping.keys())        # variables hors-clé originales
-            yprime = list(mapping.values()) # leurs copies fraîches (∀)
-
-            # 3) atome-témoin exact (avec constantes hors-clé intactes)
-            block_atom = _format_positive(pred, list(args))
-
-            # 4) atome-garde : on remplace chacune des var hors-clé par sa copie fraîche partout
-            guard_args = list(args)
-            for v, newv in mapping.items():
-                for j in positions[v]:
-                    guard_args[j] = newv
-            block_guard = _format_positive(pred, guard_args)
-
-            # 5) garde universelle (PAS d'∃ interne sur y)
-            block_cond = forall(yprime, f"{block_guard} → {inner}")
-            result = f"{block_atom} ⊓ {block_cond}"
-            return result
-
-        # Branche else, pré mémoire
-        # else:
-        #     trace.append(" - F est négatif")
-        #     mapping, positions = _distinct_non_key_var_map(F)
-        #     uvars = list(mapping.values())  # quantifier une fois par var distincte
-        #     ant_args = list(args)
-        #     for v, newv in mapping.items():
-        #         for j in positions[v]:
-        #             ant_args[j] = newv
-        #     antecedent = _format_positive(pred, ant_args)
-        #     result = forall(uvars, f"{antecedent} → {inner}")   # équiv. à (antecedent → inner)
-        #     trace.append(f"   - Négatif pk>0 (∀ hors-clé, frais par variable) → {result}")
-        #     return result
-        # Branche else, post mémoire...
-        else: # Nouvelle branche post mémoire...
-            trace.append(" - F est négatif")
-
-            # 1) fraiches par position + antécédent + égalités
-            zvars, ant_args, eq_atoms = _fresh_nonkey_per_position(F)
-            antecedent = _format_positive(pred, ant_args)
-
-            # 2) réécriture du reste
-            inner = rewrite(rest_query, trace)
-
-            # 3) négation de la conjonction d’égalités (si pas d’hors-clé → ⊤)
-            eq_conj = " ⊓ ".join(eq_atoms) if eq_atoms else "⊤"
-            guarded = f"{inner} ⊓ ¬({eq_conj})"
-
-            # 4) ∃ **à l’intérieur** (témoins pouvant dépendre de z)
-            # witnesses = _vars_in_atoms(rest_query)   # simple et robuste
-            # inner_exist = exists(witnesses, guarded) # exists([], φ) doit rendre φ inchangé
-            inner_exist = guarded  # on ne quantifie pas, cf. erratum
-
-            # 5) >>> ICI LA DIFFÉRENCE IMPORTANTE <<<
-            guard_clause = forall(zvars, f"{antecedent} → {inner_exist}")
-            result = f"{inner} ⊓ {guard_clause}"   # on conserve inner AU NIVEAU COURANT
-            trace.append("   - Négatif pk>0 → inner ∧ ∀(ant → ∃(inner ∧ ¬(∧=)))")
-
-            return result
+    def later(self):
+        # Variables que les étapes restantes quantifieront
+        return {self.names[rank] for step in self.steps[self.position:] for rank in step.bound}
 
-    # -----------------------------------------------------------
-    # B) Clé vide
-    trace.append(" - Clé vide → branche B")
-    var_part = [t for t in args if is_variable(t)]
-    fresh_E = fresh_rel()
-    inner = rewrite(rest_query, trace)
 
+def _rewrite_descend(query, trace, state):
+    """
+    Partie d'une étape (suivante du plan) qui précède la réécriture du reste :
+    cas de base, choix de F, traces et variables fraîches tirées avant inner
+    (l'ordre des compteurs de fraîcheur est celui de la version récursive).
+    :return: (None, formule) pour un cas de base, sinon
+        ((F, données de l'étape), requête restante).
+    """
+    if trace.debug:
+        trace(DEBUG, "== Appel rewrite sur requête : {}", query)
+    step = state.next()
+
+    if step.kind == ALL_KEY:
+        base = _base(query, state.bound)
+        if trace.steps:
+            trace(STEPS, " - Cas de base : all-key → conjonction sur les faits fixes")
+            trace(DEBUG, "   → {}", base)
+        return None, base
+
+    if step.kind == STUCK:
+        # Comme la recherche : rien de sélectionnable → faux
+        if trace.steps:
+            trace(STEPS, " - Aucun atome non-all-key unattacked → ⊥")
+        return None, Not(Top())
+
+    F = query[step.index]
+    if trace.steps:
+        trace(STEPS, " - Atome choisi pour élimination : {}", F)
+    neg, pred, pk_len, args = F
+
+    if step.kind == KEY:
+        # A) Clé avec variables : F reste dans la requête, clé liée. Les
+        # valeurs de clé sont lues sur les blocs de F ou, pour F négatif, sur
+        # l'atome positif qui le garde (key_guard)
+        if trace.steps:
+            trace(STEPS, " - Clé avec variables → branche A")
+        key_vars = list(dict.fromkeys(t for t in args[:pk_len]
+                                      if is_variable(t) and t not in state.bound))
+        view = _ground(query, state.bound)
+        guard = key_guard(view, view[step.index])
+        if guard is view[step.index]:
+            zvars = [fresh_var() for _ in range(pk_len, len(args))]
+            block = Atom(False, pred, list(args[:pk_len]) + zvars)
+        else:
+            _, g_pred, _, g_args = query[view.index(guard)]
+            others = {t: fresh_var() for t in g_args if is_variable(t)
+                      and t not in state.bound and t not in key_vars}
+            zvars = list(others.values())
+            block = Atom(False, g_pred, [others.get(t, t) for t in g_args])
+        state.bound.update(key_vars)
+        return (step, F, key_vars, zvars, block), query
+
+    # B) Clé close : le bloc de F est décidé
+    if trace.steps:
+        trace(STEPS, " - Clé close → branche B")
+        trace(STEPS, " - F est négatif" if neg else " - F est positif")
+    zvars = [fresh_var() for _ in range(pk_len, len(args))]
+    y_vars = list(dict.fromkeys(t for t in args if is_variable(t) and t not in state.bound))
+    rest_query = query[:step.index] + query[step.index + 1:]
+    later = None
     if neg:
-        trace.append(" - F est négatif")
-        # ajoute not E(var_part) dans la requête résiduelle
-        inner_negE = rewrite(rest_query + [(True, fresh_E, len(var_part), tuple(var_part))], trace)
-        guarded = forall(var_part, f"{_format_positive(pred, list(args))} → {inner_negE}")
-        result = f"{inner} ⊓ {guarded}"
-        trace.append(f"   - Négatif pk=0 avec symbole frais → {result}")
-        return result
+        later = state.later() | _vars(a for a in rest_query if not a[0])
     else:
-        trace.append(" - F est positif")
-        theta_inner = exists(var_part, inner)
-        guarded = forall(var_part, f"{_format_positive(pred, list(args))} → {theta_inner}")
-        result = exists(var_part, f"{_format_positive(pred, list(args))} ⊓ {guarded}")
-        trace.append(f"   - Positif pk=0 → {result}")
+        state.bound.update(y_vars)
+    return (step, F, y_vars, zvars, later), rest_query
+
+
+def _rewrite_ascend(frame, inner, trace):
+    """
+    Formule d'une étape, une fois inner (réécriture du reste) connue.
+    """
+    step, F, variables, zvars, data = frame
+    neg, pred, pk_len, args = F
+
+    # -----------------------------------------------------------
+    # A) Clé avec variables : une valeur de clé (data : atome qui la lit)
+    # pour laquelle le reste est certain
+    if step.kind == KEY:
+        return Exists(variables + zvars, And(data, inner))
+
+    # -----------------------------------------------------------
+    # B) Clé close : égalités qui unifient un fait du bloc (z) avec F
+    block = Atom(False, pred, list(args[:pk_len]) + zvars)
+    eqs = [Eq(z, a) for z, a in zip(zvars, args[pk_len:])]
+
+    if not neg:
+        result = And(Exists(zvars, block),
+                     Forall(zvars, Implies(block, Exists(variables, And(*eqs, inner)))))
+        if trace.debug:
+            trace(DEBUG, "   - Positif, clé close → {}", result)
         return result
 
-def rewrite_closed(query, trace=None):
+    # ¬E(ȳ) avec E = {b̄}, b̄ lu dans z. Une variable de ȳ qu'aucune étape ni
+    # atome positif du reste ne lie reste libre sous ¬E et accepte tout b̄.
+    first = {}
+    for z, a in zip(zvars, args[pk_len:]):
+        first.setdefault(a, z)
+    neg_E = Not(And(*(Eq(y, first[y]) for y in variables if y in data)))
+    excluded = add_base_atom(inner, neg_E)
+    matches = And(block, Exists(variables, And(*eqs)))
+    result = And(inner, Forall(zvars, Implies(matches, excluded)))
+    if trace.debug:
+        trace(DEBUG, "   - Négatif, clé close → {}", result)
+    return result
+
+
+def _vars(atoms):
+    return {t for _, _, _, args in atoms for t in args if is_variable(t)}
+
+
+def _base(query, bound):
     """
-    Ferme la formule FO par des ∃ sur les variables de la requête d'origine.
+    Cas de base (requête all-key) : un atome positif est lu sur un fait fixe
+    (aucun autre fait de son bloc), un atome négatif sur toute la base, ses
+    variables propres quantifiées sous la négation.
     """
-    global _var_counter, _fresh
-    _var_counter = count(1)   # reset pour les variables fraîches t1, t2, …
-    _fresh = count(1)         # reset pour les prédicats frais E1, E2, …
-    if trace is None:
-        trace = []
+    positives = [a for a in query if not a[0]]
+    free = [v for v in dict.fromkeys(t for *_, args in positives for t in args)
+            if is_variable(v) and v not in bound]
+    parts = []
+    for neg, pred, pk_len, args in query:
+        if not neg:
+            parts.append(Atom(False, pred, args))
+            if pk_len < len(args):
+                zvars = [fresh_var() for _ in range(pk_len, len(args))]
+                block = Atom(False, pred, list(args[:pk_len]) + zvars)
+                eqs = [Eq(z, a) for z, a in zip(zvars, args[pk_len:])]
+                parts.append(Forall(zvars, Implies(block, And(*eqs))))
+            continue
+        own = [v for v in dict.fromkeys(args)
+               if is_variable(v) and v not in bound and v not in free]
+        parts.append(Not(Exists(own, Atom(False, pred, args))) if own
+                     else Atom(True, pred, args))
+    return Exists(free, Conj(parts))
 
-    trace.append("[rewrite_closed] called")
+def rewrite_closed(query, trace=None):
+    """
+    Réécriture FO close de la requête (chaque variable est quantifiée par
+    l'étape qui la lie), sous forme de chaîne (voir rewrite_formula pour
+    l'AST).
+    """
+    return render(rewrite_formula(query, trace))
 
-    # 1) Formule intermédiaire (peut contenir des ∀ internes)
-    fo = rewrite(query, trace)
-    trace.append(f"[rewrite_closed] after rewrite => {fo}")
 
-    # 2) Variables de la requête d’origine à fermer
-    base_vars, seen = [], set()
-    for (_, _, _, args) in query:
-        for a in args:
-            if is_variable(a) and a not in seen:
-                seen.add(a)
-                base_vars.append(a)
-    trace.append(f"[rewrite_closed] base_vars (to existentially close) => {base_vars}")
-
-    # 3) Fermeture existentielle en tête
-    closed = exists(base_vars, fo)
-    trace.append(f"[rewrite_closed] final (closed) => {closed}")
-    return closed
\ No newline at end of file
+def rewrite_formula(query, trace=None, recursive=False):
+    """
+    Comme rewrite_closed, mais renvoie l'AST de la formule.
+    `recursive` utilise rewrite_recursive (version de référence).
+    """
+    global _var_counter
+    _var_counter = count(1)   # reset pour les variables fraîches z1, z2, …
+    trace = as_tracer(trace)
+
+    if trace.steps:
+        trace(STEPS, "[rewrite_closed] called")
+    closed = (rewrite_recursive if recursive else rewrite)(query, trace)
+    if trace.steps:
+        trace(STEPS, "[rewrite_closed] final (closed) => {}", closed)
+    return closed
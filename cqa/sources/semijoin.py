@@ -0,0 +1,162 @@
+"""
+-------------------------------------------------------------------------------
+semijoin.py
+
+Réduction de la base avant le calcul de certitude (semi-jointures à la
+Yannakakis).
+
+Un fait qui ne participe à aucune correspondance des atomes positifs de la
+requête dans la base ne participe à aucune correspondance dans une repair
+(une repair est une sous-base). Seuls les prédicats de la requête sont
+gardés et, quand la partie positive est acyclique (réduction GYO), deux
+passes de semi-jointures le long de l'arbre de jointure (des feuilles vers
+la racine, puis de la racine vers les feuilles) ne laissent que les faits
+qui participent à une correspondance.
+
+Les repairs choisissent un fait par bloc de clé : retirer une partie d'un
+bloc changerait les repairs. Un bloc est donc gardé en entier dès qu'un de
+ses faits est utile, et retiré en entier sinon. Pour un atome négatif, un
+fait est utile s'il est compatible avec les valeurs que les atomes positifs
+laissent aux variables partagées.
+
+La réduction ne change pas l'ensemble des repairs utiles, et les moteurs
+décident chaque bloc de clé sur tous ses faits : la certitude est la même
+sur la base réduite et sur la base complète (voir
+TestSemiJoin.test_differentiel). certainty l'applique par défaut
+(reduce=False pour la désactiver).
+
+-------------------------------------------------------------------------------
+"""
+
+from operator import itemgetter
+
+from .IsCertain import is_variable, unify_tuple, matching_facts
+from .factstore import FactStore
+
+
+# =============================================================================
+# ---------------------------------------------------------- Arbre de jointure
+def join_tree(atoms):
+    """
+    Réduction GYO des atomes (hyperarêtes : leurs variables).
+    :return: [(oreille, parent), …] dans l'ordre de retrait (indices dans
+        `atoms`, parent None pour la racine de chaque composante), ou None
+        si les atomes forment un hypergraphe cyclique.
+    """
+    variables = [{t for t in args if is_variable(t)} for _, _, _, args in atoms]
+    remaining = list(range(len(atoms)))
+    order = []
+    while len(remaining) > 1:
+        for e in remaining:
+            others = [f for f in remaining if f != e]
+            shared = variables[e] & set().union(*(variables[f] for f in others))
+            parent = next((f for f in others if shared <= variables[f]), None)
+            if parent is not None:
+                # Sans variable partagée, e est une composante à lui seul
+                order.append((e, parent if shared else None))
+                remaining.remove(e)
+                break
+        else:
+            return None
+    order.extend((e, None) for e in remaining)
+    return order
+
+
+def _projection(args, variables):
+    # Fonction fact → valeurs des `variables` (première position de chacune)
+    positions = [args.index(v) for v in variables]
+    if len(positions) == 1:
+        p = positions[0]
+        return lambda fact: fact[p]
+    return itemgetter(*positions)
+
+
+def _semijoin(rels, atoms, target, source):
+    # rels[target] ⋉ rels[source] sur leurs variables communes
+    args_t, args_s = atoms[target][3], atoms[source][3]
+    shared = sorted({t for t in args_t if is_variable(t)} & set(args_s))
+    if not shared:
+        if not rels[source]:
+            rels[target] = []
+        return
+    keys = set(map(_projection(args_s, shared), rels[source]))
+    project = _projection(args_t, shared)
+    rels[target] = [fact for fact in rels[target] if project(fact) in keys]
+
+
+def _matching(db, args, pred):
+    # Faits compatibles avec l'atome : constantes (par index) et variables
+    # répétées
+    facts = matching_facts(db, pred, args)
+    variables = [t for t in args if is_variable(t)]
+    if len(set(variables)) == len(variables):
+        return list(facts)
+    return [fact for fact in facts if unify_tuple(args, fact, {}) is not None]
+
+
+# =============================================================================
+# ------------------------------------------------------------------ Réduction
+def reduce_database(query, database):
+    """
+    Base réduite aux faits utiles à `query`, blocs de clé entiers.
+    :param database: liste parsée, dict {pred: […]} ou FactStore.
+    :return: (FactStore réduit, ou `database` elle-même si rien n'est
+        retiré ; True si les semi-jointures ont été appliquées, False si la
+        partie positive est cyclique ou vide, la base étant alors seulement
+        restreinte aux prédicats de la requête).
+    """
+    db = FactStore.wrap(database)
+    positive = [a for a in query if not a[0]]
+    negative = [a for a in query if a[0]]
+    tree = join_tree(positive) if positive else None
+    if tree is None:
+        return _store(db, {pred: db.facts(pred) for _, pred, _, _ in query}), False
+
+    # Faits compatibles avec chaque atome (constantes, variables répétées)
+    rels = [_matching(db, args, pred) for _, pred, _, args in positive]
+    for e, parent in tree:
+        if parent is not None:
+            _semijoin(rels, positive, parent, e)
+    for e, parent in reversed(tree):
+        if parent is not None:
+            _semijoin(rels, positive, e, parent)
+    # Composantes sans variable commune : une composante vide vide toute la
+    # correspondance
+    if not all(rels):
+        rels = [[] for _ in rels]
+
+    # Valeurs possibles de chaque variable après réduction
+    values = {}
+    for (_, _, _, args), facts in zip(positive, rels):
+        for v in {t for t in args if is_variable(t)}:
+            column = set(map(_projection(args, [v]), facts))
+            values[v] = values[v] & column if v in values else column
+
+    relations = {}
+    for (_, pred, pk_len, _), facts in zip(positive, rels):
+        relations[pred] = _whole_blocks(db, pred, pk_len, facts)
+    for _, pred, pk_len, args in negative:
+        checks = [(i, values[t]) for i, t in enumerate(args) if t in values]
+        useful = [fact for fact in _matching(db, args, pred)
+                  if all(fact[i] in column for i, column in checks)]
+        relations[pred] = _whole_blocks(db, pred, pk_len, useful)
+    return _store(db, relations), True
+
+
+def _store(db, relations):
+    # Base inchangée : on la garde, avec ses index déjà construits
+    if db.predicates() == set(relations) and all(
+            facts is db.facts(pred) for pred, facts in relations.items()):
+        return db
+    return FactStore(relations)
+
+
+def _whole_blocks(db, pred, pk_len, facts):
+    # Tous les faits des blocs de clé qui contiennent un fait de `facts`,
+    # dans l'ordre de la base
+    everything = db.facts(pred)
+    if len(facts) == len(everything):
+        return everything
+    keys = {fact[:pk_len] for fact in facts}
+    kept = [fact for fact in everything if fact[:pk_len] in keys]
+    return everything if len(kept) == len(everything) else kept
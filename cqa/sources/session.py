@@ -0,0 +1,391 @@
+"""
+-------------------------------------------------------------------------------
+session.py
+
+Requêtes permanentes sur une base qui change par petits lots de faits.
+
+Une Session garde la base (sa propre copie, dans un FactStore, mise à jour
+en place : index, blocs de clé et vues des faits fixes) et les requêtes
+enregistrées. apply(insert, delete) modifie la base puis ne recalcule que ce
+que le lot touche :
+  - requête acyclique (plan FO compilé) : sa valeur est tenue bloc par bloc
+    (_Blockwise). La racine du plan est le plus souvent un ∃ sur les blocs
+    de clé d'un atome ; chaque bloc est évalué à part en relevant ses
+    lectures dans la base (blocs de clé, faits cherchés par index),
+    et un lot ne réévalue que les blocs dont une lecture voit un fait
+    ajouté ou retiré, ainsi que les blocs qu'il crée ; comme le ∃, le suivi
+    s'arrête au premier bloc certain, les autres blocs attendent qu'il ne le
+    soit plus pour être évalués. La base complète est
+    évaluée : la réduction ne change pas la certitude (voir
+    TestSemiJoin.test_differentiel) et coûterait un parcours par lot ;
+  - requête cyclique (recherche IsCertain) : une requête dont aucun
+    prédicat n'est modifié garde sa valeur ; avec la réduction, et si elle
+    s'applique à la requête (partie positive acyclique, voir semijoin.py),
+    seuls comptent les blocs de clé compatibles avec un atome de la
+    requête. Une requête touchée est réduite à nouveau et, si ses
+    relations réduites n'ont pas changé, elle garde sa valeur ; sinon elle
+    est réévaluée, et le mémo des sous-requêtes est gardé d'un lot à
+    l'autre : le résultat d'une sous-requête ne dépend que des relations
+    de ses prédicats, et une entrée reste valable tant qu'aucune de ces
+    relations (réduites ou non) n'a changé.
+Les valeurs sont celles que renverrait certainty(…, reduce=reduce) sur la
+base courante ; comme pour certainty, la réduction est activée par défaut.
+
+-------------------------------------------------------------------------------
+"""
+
+import time
+
+from .IsCertain import unify_tuple, _Search, DEFAULT_MEMO_SIZE
+from .cache import LRUCache
+from .certainty import analyze_query
+from .elimination import EliminationPlan
+from .evaluator import compile_query, _Evaluation, _Switch, _Memo, _KeyExists
+from .factstore import FactStore
+from .parseur import iter_parse
+from .semijoin import join_tree, reduce_database
+from .batch import as_query, as_database
+
+
+def _facts(delta):
+    """
+    {pred: [fact, …]} depuis un texte (@database) ou une liste
+    [(pred, pk_len, args), …] comme celle de parse.
+    """
+    if isinstance(delta, str):
+        delta = [item for section, items in iter_parse(delta.splitlines())
+                 if section == "database" for item in items]
+    facts = {}
+    for pred, _, args in delta:
+        facts.setdefault(pred, []).append(tuple(args))
+    return facts
+
+
+# =============================================================================
+# ------------------------------------------------------------- Suivi par bloc
+def _unwrap(node):
+    while isinstance(node, _Memo):
+        node = node.child
+    return node
+
+
+class _Blockwise:
+    """
+    Certitude d'une requête acyclique (plan compilé) tenue à jour bloc par
+    bloc. Les lectures relevées, les tests 0-bis ne sont pas faits (voir
+    _Switch) : seule la recherche est suivie, sans dépendre de la
+    conformité de relations entières. Quand elle commence par un
+    ∃ sur les blocs de clé d'un atome (_KeyExists), la requête est certaine
+    ssi le sous-plan l'est pour un de ces blocs : chaque bloc (valeurs des
+    variables de la clé) est évalué à part, avec ses lectures. Une autre
+    racine est suivie comme un seul bloc, de clé ().
+    Comme le ∃, le suivi s'arrête au premier bloc certain : les autres
+    blocs attendent (pending) et ne sont évalués que si plus aucun bloc
+    évalué n'est certain.
+    results : {bloc évalué: certitude}
+    pending : {bloc: None}, les blocs pas encore évalués
+    reads   : {bloc: lectures} (voir _Evaluation.reads)
+    readers : {pred: {positions: {valeurs: {bloc, …}}}}, l'index inverse des
+              lectures
+    """
+
+    def __init__(self, plan):
+        root = _unwrap(plan.root)
+        self.search = _unwrap(root.search) if isinstance(root, _Switch) else root
+        self.exists = self.search if isinstance(self.search, _KeyExists) else None
+        self.results = {}
+        self.pending = {}
+        self.reads = {}
+        self.readers = {}
+        self.certain = 0
+
+    def update(self, store, delta=None):
+        """
+        Met à jour la certitude après le lot `delta` ({pred: [fait, …]},
+        faits ajoutés ou retirés ; None : tout évaluer).
+        :return: (certitude, nombre de blocs évalués)
+        """
+        ev = _Evaluation(store)
+        evaluated = 0
+        if delta is None:
+            self._reset()
+            if self.exists is None:
+                self.pending[()] = None
+            else:
+                self.pending.update((self._block(env), None) for env in self.exists.envs(ev, {}))
+        else:
+            for block in self._affected(delta):
+                if block in self.results:
+                    self._evaluate(ev, block)
+                    evaluated += 1
+                else:
+                    self.pending[block] = None
+        # Comme le ∃ de la racine, on s'arrête au premier bloc certain
+        while not self.certain and self.pending:
+            block = self.pending.popitem()[0]
+            self._evaluate(ev, block)
+            evaluated += 1
+        return self.certain > 0, evaluated
+
+    def _reset(self):
+        self.results.clear()
+        self.pending.clear()
+        self.reads.clear()
+        self.readers.clear()
+        self.certain = 0
+
+    def _block(self, env):
+        return tuple(env[v] for v in self.exists.key_vars)
+
+    def _affected(self, delta):
+        # Blocs dont une lecture voit un fait du lot, et blocs (nouveaux ou
+        # vidés) des faits de la relation source de la racine
+        blocks = set()
+        for pred, facts in delta.items():
+            for positions, readers in self.readers.get(pred, {}).items():
+                for fact in facts:
+                    blocks.update(readers.get(tuple(fact[p] for p in positions), ()))
+            if self.exists is not None and pred == self.exists.source:
+                for fact in facts:
+                    env = self.exists.env_of(fact, {})
+                    if env is not None:
+                        blocks.add(self._block(env))
+        return blocks
+
+    def _evaluate(self, ev, block):
+        self._forget(block)
+        if self.exists is not None:
+            env = dict(zip(self.exists.key_vars, block))
+            if not self.exists.has(ev, env):
+                return
+            node = self.exists.child
+        else:
+            env, node = {}, self.search
+        # Le mémo est partagé par les blocs d'un même lot (ses entrées
+        # gardent leurs lectures)
+        reads = set()
+        ev.reads = reads
+        result = node.run(ev, env)
+        ev.reads = None
+        self.results[block] = result
+        self.certain += result
+        self.reads[block] = reads
+        for pred, positions, values in reads:
+            self.readers.setdefault(pred, {}).setdefault(positions, {}) \
+                .setdefault(values, set()).add(block)
+
+    def _forget(self, block):
+        if block not in self.results:
+            return
+        self.certain -= self.results.pop(block)
+        for pred, positions, values in self.reads.pop(block):
+            by_values = self.readers[pred][positions]
+            by_values[values].discard(block)
+            if not by_values[values]:
+                del by_values[values]
+
+
+# =============================================================================
+# ------------------------------------------------------------ Requête suivie
+class _Standing:
+    """
+    État d'une requête enregistrée : son analyse, sa valeur et, pour une
+    requête acyclique, son suivi par bloc (_Blockwise) ; pour IsCertain,
+    les motifs de clé dont elle dépend et le mémo de la dernière évaluation
+    avec les relations réduites sur lesquelles il a été calculé.
+    """
+
+    def __init__(self, query, memo_size, reduce):
+        self.query = query
+        self.memo_size = memo_size
+        self.reduce = reduce
+        analysis, _ = analyze_query(query)
+        self.guarded = analysis["guarded"]
+        self.cycle = analysis["cycle"]
+        self.engine = None
+        self.preds = {pred for _, pred, _, _ in query}
+        positive = [a for a in query if not a[0]]
+        # Dépendance par bloc de clé : seulement si la réduction s'applique
+        by_block = reduce and bool(positive) and join_tree(positive) is not None
+        self.keys = {pred: tuple(args[:pk_len]) if by_block else None
+                     for _, pred, pk_len, args in query}
+        self.relations = None
+        self.memo = None
+        self.token = None
+        self.certain = None if self.guarded[1] == "not sjf" else False
+        self.blockwise = None
+        if self.guarded[0] and not self.cycle:
+            self.engine = "fo"
+            self.blockwise = _Blockwise(compile_query(query))
+
+    def update(self, store, delta=None):
+        """
+        Met à jour la valeur après le lot `delta` ({pred: [fait, …]} ; None
+        pour la première évaluation).
+        :return: dict {touched, recomputed, memo_reused, blocks} ; blocks
+            est le nombre de blocs réévalués (requête acyclique).
+        """
+        info = {"touched": False, "recomputed": False, "memo_reused": 0, "blocks": 0}
+        if self.blockwise is not None:
+            certain, blocks = self.blockwise.update(store, delta)
+            self.certain = certain
+            info.update(touched=blocks > 0, recomputed=blocks > 0, blocks=blocks)
+        elif delta is None or self.touched(delta):
+            info["touched"] = delta is not None
+            info.update(self.evaluate(store))
+        return info
+
+    def touched(self, delta):
+        """
+        True si un fait de `delta` ({pred: [fact, …]}) peut changer la
+        valeur de la requête.
+        """
+        if not self.guarded[0]:
+            return False
+        for pred, facts in delta.items():
+            if pred not in self.keys:
+                continue
+            key = self.keys[pred]
+            if key is None:
+                return True
+            for fact in facts:
+                if unify_tuple(key, fact[:len(key)], {}) is not None:
+                    return True
+        return False
+
+    def evaluate(self, store):
+        """
+        Réévalue la requête (cyclique) sur `store`.
+        :return: dict {recomputed, memo_reused} ; recomputed vaut False si
+            les relations (réduites) de la requête n'ont pas changé.
+        """
+        if not self.guarded[0]:
+            return {"recomputed": False, "memo_reused": 0}
+        db = reduce_database(self.query, store)[0] if self.reduce else store
+        relations = {pred: tuple(db.facts(pred)) for pred in self.preds}
+        if relations == self.relations:
+            return {"recomputed": False, "memo_reused": 0}
+        unchanged = {pred for pred in self.preds
+                     if self.relations is not None and relations[pred] == self.relations[pred]}
+        self.relations = relations
+        self.engine = "iscertain"
+        reused = self._carry_memo(unchanged, db.token)
+        search = _Search(None, self.memo_size)
+        search.memo = self.memo
+        self.certain = search.solve(self.query, db, (EliminationPlan.of(self.query), 0))
+        self.token = db.token
+        return {"recomputed": True, "memo_reused": reused}
+
+    def _carry_memo(self, unchanged, token):
+        # Entrées calculées sur la base réduite précédente (pas sur ses
+        # overlays E1, E2, …) dont toutes les relations sont inchangées
+        memo = LRUCache(self.memo_size)
+        if self.memo is not None:
+            for (canon, layer), value in self.memo.items():
+                if layer == self.token and {a[1] for a in canon} <= unchanged:
+                    memo.put((canon, token), value)
+        self.memo = memo
+        return len(memo)
+
+
+# =============================================================================
+# -------------------------------------------------------------------- Session
+class Session:
+    """
+    Base modifiable et requêtes permanentes.
+
+    :param database: base initiale (voir batch.as_database), copiée ; par
+        défaut vide.
+    :param memo_size: taille du mémo IsCertain gardé pour chaque requête.
+    :param reduce: évalue les requêtes cycliques sur la base réduite,
+        comme certainty (False : sur la base complète). Les requêtes
+        acycliques sont suivies bloc par bloc sur la base complète, avec la
+        même valeur.
+    """
+
+    def __init__(self, database=None, memo_size=DEFAULT_MEMO_SIZE, reduce=True):
+        relations = as_database(database).to_dict() if database is not None else {}
+        self.store = FactStore(relations)
+        self.memo_size = memo_size
+        self.reduce = reduce
+        self._present = {pred: set(facts) for pred, facts in relations.items()}
+        self._queries = {}
+
+    def register(self, query, name=None):
+        """
+        Enregistre une requête (texte @query ou requête parsée) et l'évalue.
+        :param name: nom de la requête (par défaut son numéro d'ordre).
+        :return: (nom, certitude), la certitude valant None pour une
+            requête non self-join free, comme pour certainty.
+        :raises ValueError: nom déjà utilisé.
+        """
+        if name is None:
+            name = str(len(self._queries))
+        if name in self._queries:
+            raise ValueError(f"Requête déjà enregistrée : {name}")
+        standing = _Standing(as_query(query), self.memo_size, self.reduce)
+        standing.update(self.store)
+        self._queries[name] = standing
+        return name, standing.certain
+
+    def unregister(self, name):
+        del self._queries[name]
+
+    def results(self):
+        """
+        Certitude courante de chaque requête : {nom: certitude}.
+        """
+        return {name: q.certain for name, q in self._queries.items()}
+
+    def apply(self, insert=(), delete=()):
+        """
+        Applique un lot de modifications (les suppressions d'abord), puis met
+        à jour les requêtes touchées.
+        :param insert: faits à ajouter (texte @database ou liste
+            [(pred, pk_len, args), …]) ; un fait déjà présent est ignoré.
+        :param delete: faits à retirer, même format ; un fait absent est
+            ignoré.
+        :return: dict {results ({nom: certitude}), changed (noms dont la
+            valeur a changé), queries ({nom: {touched, recomputed, engine,
+            memo_reused, blocks, time}}), inserted, deleted, time
+            (secondes)}.
+        """
+        start = time.perf_counter()
+        delta = {}
+        deleted = inserted = 0
+        for pred, facts in _facts(delete).items():
+            present = self._present.get(pred, set())
+            facts = [f for f in dict.fromkeys(facts) if f in present]
+            if facts:
+                self.store.remove(pred, facts)
+                present.difference_update(facts)
+                delta.setdefault(pred, []).extend(facts)
+                deleted += len(facts)
+        for pred, facts in _facts(insert).items():
+            present = self._present.setdefault(pred, set())
+            facts = [f for f in dict.fromkeys(facts) if f not in present]
+            if facts:
+                self.store.extend(pred, facts)
+                present.update(facts)
+                delta.setdefault(pred, []).extend(facts)
+                inserted += len(facts)
+
+        queries, changed = {}, []
+        for name, standing in self._queries.items():
+            began = time.perf_counter()
+            before = standing.certain
+            info = standing.update(self.store, delta)
+            info["engine"] = standing.engine
+            info["time"] = time.perf_counter() - began
+            queries[name] = info
+            if standing.certain != before:
+                changed.append(name)
+        return {"results": self.results(), "changed": changed, "queries": queries,
+                "inserted": inserted, "deleted": deleted,
+                "time": time.perf_counter() - start}
+
+    def insert(self, facts):
+        return self.apply(insert=facts)
+
+    def delete(self, facts):
+        return self.apply(delete=facts)
@@ -0,0 +1,277 @@
+"""
+-------------------------------------------------------------------------------
+sql_backend.py
+
+Exécution du plan compilé dans SQLite.
+
+Le plan compilé (evaluator.py) est traduit en une seule requête SQL faite de
+EXISTS / NOT EXISTS corrélés. Le plan suit les étapes de la réécriture
+(rewriter.rewrite_formula) : la requête SQL décide la même chose que la
+formule et qu'is_certain_core (voir TestSQLite.test_traduction_du_plan).
+
+Les relations de @database sont chargées dans une base sqlite3 (en mémoire ou
+sur disque), une table par prédicat (colonnes c0, c1, …). Une base
+inconsistante contient justement plusieurs faits par clé : la clé primaire
+ne peut pas être une contrainte d'unicité. Elle est déclarée dans la table
+cqa_keys (prédicat, longueur de clé), lue par keys(), et les colonnes de la
+clé sont indexées.
+
+-------------------------------------------------------------------------------
+"""
+
+import sqlite3
+from itertools import count
+
+from .evaluator import (compile_query, _Const, _Join, _Switch, _Memo,
+                        _KeyExists, _Block, _NegBlock)
+from .IsCertain import is_variable
+
+
+# =============================================================================
+# ----------------------------------------------------------------- Traduction
+def _table(pred):
+    return '"' + pred.replace('"', '""') + '"'
+
+
+class _Translator:
+    """
+    Traduit les noeuds d'un plan en expressions SQL booléennes.
+    `env` associe chaque variable liée à l'expression SQL (colonne d'un alias
+    englobant) qui porte sa valeur ; les constantes sont passées en
+    paramètres nommés.
+    """
+
+    def __init__(self):
+        self.params = {}
+        # Relations fraîches E des blocs négatifs : {pred: expressions de b̄}
+        self.fresh = {}
+        self.switched = False
+        self._aliases = count()
+        self._params = count()
+
+    def param(self, value):
+        name = f"p{next(self._params)}"
+        self.params[name] = value
+        return f":{name}"
+
+    def alias(self):
+        return f"t{next(self._aliases)}"
+
+    def term(self, t, env):
+        return env[t] if is_variable(t) else self.param(t)
+
+    def match(self, alias, args, env, positions=None):
+        """
+        Conditions WHERE pour lier `alias` aux termes `args`. Les variables
+        libres sont ajoutées à une copie de `env` (la première occurrence
+        les lie, les suivantes deviennent des égalités).
+        """
+        env = dict(env)
+        conds = []
+        for i, t in enumerate(args):
+            if positions is not None and i not in positions:
+                continue
+            col = f"{alias}.c{i}"
+            if is_variable(t) and t not in env:
+                env[t] = col
+            else:
+                conds.append(f"{col} = {self.term(t, env)}")
+        return conds, env
+
+    # -------------------------------------------------------------------------
+    def node(self, node, env):
+        if isinstance(node, _Memo):
+            return self.node(node.child, env)
+        if isinstance(node, _Const):
+            return "1" if node.value else "0"
+        if isinstance(node, _Switch):
+            # Seul le premier test de cohérence est traduit : les suivants ne
+            # sont que des raccourcis, et chaque CASE imbriqué consomme la
+            # pile (bornée) de l'analyseur de SQLite
+            if self.switched:
+                return self.node(node.search, env)
+            self.switched = True
+            return (f"CASE WHEN {self.consistent(node.checks)} "
+                    f"THEN {self.node(node.direct, env)} "
+                    f"ELSE {self.node(node.search, env)} END")
+        if isinstance(node, _Join):
+            return self.join(node, env)
+        if isinstance(node, _KeyExists):
+            return self.key_exists(node, env)
+        if isinstance(node, _Block):
+            return self.block(node, env)
+        if isinstance(node, _NegBlock):
+            return self.neg_block(node, env)
+        raise TypeError(f"Noeud de plan inconnu : {node!r}")
+
+    def consistent(self, checks):
+        parts = []
+        for pred, pk_len in sorted(checks):
+            if pred in self.fresh:
+                continue
+            # Un bloc en conflit a au moins deux faits distincts
+            table = f"(SELECT DISTINCT * FROM {_table(pred)})"
+            if pk_len == 0:
+                parts.append(f"(SELECT COUNT(*) FROM {table}) <= 1")
+            else:
+                cols = ", ".join(f"c{i}" for i in range(pk_len))
+                parts.append(f"NOT EXISTS (SELECT 1 FROM {table} "
+                             f"GROUP BY {cols} HAVING COUNT(*) > 1)")
+        return "(" + " AND ".join(parts or ["1"]) + ")"
+
+    def fixed(self, pred, pk_len, arity, alias):
+        # Le fait de `alias` est seul dans son bloc : aucun autre fait de
+        # même clé ne diffère sur une autre position
+        other = self.alias()
+        same = [f"{other}.c{i} = {alias}.c{i}" for i in range(pk_len)]
+        differs = " OR ".join(f"{other}.c{i} <> {alias}.c{i}" for i in range(pk_len, arity))
+        return (f"NOT EXISTS (SELECT 1 FROM {_table(pred)} {other} "
+                f"WHERE {' AND '.join(same + [f'({differs})'])})")
+
+    def join(self, node, env):
+        tables, conds = [], []
+        pk_lens = dict(node.fixed)
+        for neg, pred, args, _positions in node.steps:
+            if neg:
+                continue
+            alias = self.alias()
+            tables.append(f"{_table(pred)} {alias}")
+            new_conds, env = self.match(alias, args, env)
+            conds.extend(new_conds)
+            if pred in pk_lens and pk_lens[pred] < len(args):
+                conds.append(self.fixed(pred, pk_lens[pred], len(args), alias))
+        for neg, pred, args, _positions in node.steps:
+            if not neg:
+                continue
+            if pred in self.fresh:
+                # Les variables de ȳ restées libres acceptent tout b̄
+                same = [f"{self.term(t, env)} = {e}" for t, e in zip(args, self.fresh[pred])
+                        if not is_variable(t) or t in env]
+                conds.append(f"NOT ({' AND '.join(same or ['1'])})")
+                continue
+            alias = self.alias()
+            neg_conds, _ = self.match(alias, args, env)
+            where = " WHERE " + " AND ".join(neg_conds) if neg_conds else ""
+            conds.append(f"NOT EXISTS (SELECT 1 FROM {_table(pred)} {alias}{where})")
+        if not tables:
+            return "(" + " AND ".join(conds or ["1"]) + ")"
+        sql = "SELECT 1 FROM " + ", ".join(tables)
+        if conds:
+            sql += " WHERE " + " AND ".join(conds)
+        return f"EXISTS ({sql})"
+
+    def key_exists(self, node, env):
+        if node.guard is not None:
+            # Valeurs de clé lues sur l'atome positif qui garde F
+            alias = self.alias()
+            _, pred, _, args = node.guard
+            conds, env2 = self.match(alias, args, env)
+            child_env = dict(env, **{v: env2[v] for v in node.key_vars})
+            conds.append(self.node(node.child, child_env))
+            return (f"EXISTS (SELECT 1 FROM {_table(pred)} {alias} "
+                    f"WHERE {' AND '.join(conds)})")
+        alias = self.alias()
+        conds, env2 = self.match(alias, node.args, env, positions=range(node.pk_len))
+        conds.append(self.node(node.child, env2))
+        return (f"EXISTS (SELECT 1 FROM {_table(node.pred)} {alias} "
+                f"WHERE {' AND '.join(conds)})")
+
+    def in_block(self, node, alias, env):
+        # Faits de `alias` dans le bloc (clé close) de l'atome du noeud
+        return [f"{alias}.c{i} = {self.term(node.args[i], env)}" for i in range(node.pk_len)]
+
+    def block(self, node, env):
+        some = self.alias()
+        some_where = " WHERE " + " AND ".join(self.in_block(node, some, env)) if node.pk_len else ""
+        every = self.alias()
+        conds, env2 = self.match(every, node.args, env, positions=range(node.pk_len, len(node.args)))
+        inner = " AND ".join(conds + [self.node(node.child, env2)])
+        where = self.in_block(node, every, env) + [f"NOT ({inner})"]
+        return (f"(EXISTS (SELECT 1 FROM {_table(node.pred)} {some}{some_where}) "
+                f"AND NOT EXISTS (SELECT 1 FROM {_table(node.pred)} {every} "
+                f"WHERE {' AND '.join(where)}))")
+
+    def neg_block(self, node, env):
+        alias = self.alias()
+        conds, env2 = self.match(alias, node.args, env, positions=range(node.pk_len, len(node.args)))
+        self.fresh[node.fresh] = [env2[v] for v in node.y_vars]
+        excluded = self.node(node.excluded, env)
+        del self.fresh[node.fresh]
+        where = self.in_block(node, alias, env) + conds + [f"NOT ({excluded})"]
+        return (f"({self.node(node.rest, env)} AND NOT EXISTS (SELECT 1 FROM "
+                f"{_table(node.pred)} {alias} WHERE {' AND '.join(where)}))")
+
+
+def query_to_sql(query):
+    """
+    Traduit le plan compilé de `query` (compile_query) en une requête SQL qui
+    renvoie une seule ligne : 1 si la requête est certaine, 0 sinon.
+    :return: (sql, paramètres nommés)
+    """
+    translator = _Translator()
+    expr = translator.node(compile_query(query).root, {})
+    return f"SELECT CASE WHEN {expr} THEN 1 ELSE 0 END", translator.params
+
+
+# =============================================================================
+# ---------------------------------------------------------------------- Moteur
+# Clés primaires des relations chargées (une ligne par prédicat)
+KEYS_TABLE = "cqa_keys"
+
+class SQLiteEngine:
+    """
+    Base sqlite3 chargée depuis la liste parsée [(pred, pk_len, args), …].
+
+    :param database: liste parsée par @database.
+    :param path: fichier de la base (":memory:" par défaut).
+    """
+
+    def __init__(self, database, path=":memory:"):
+        self.conn = sqlite3.connect(path)
+        self.arity = {}
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {KEYS_TABLE} "
+                          "(pred TEXT PRIMARY KEY, pk_len INTEGER NOT NULL)")
+        self.load(database)
+
+    def load(self, database):
+        relations = {}
+        pk_lens = {}
+        for pred, pk_len, args in database:
+            relations.setdefault(pred, []).append(tuple(args))
+            pk_lens.setdefault(pred, pk_len)
+        with self.conn:
+            for pred, facts in relations.items():
+                self._create(pred, len(facts[0]), pk_lens[pred])
+                marks = ", ".join("?" * len(facts[0]))
+                self.conn.executemany(f"INSERT INTO {_table(pred)} VALUES ({marks})", facts)
+
+    def _create(self, pred, arity, pk_len=0):
+        if pred in self.arity:
+            return
+        cols = ", ".join(f"c{i} TEXT" for i in range(arity))
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {_table(pred)} ({cols})")
+        self.conn.execute(f"INSERT OR IGNORE INTO {KEYS_TABLE} VALUES (?, ?)", (pred, pk_len))
+        if pk_len:
+            key = ", ".join(f"c{i}" for i in range(pk_len))
+            index = _table(f"{pred}_pk")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {_table(pred)} ({key})")
+        self.arity[pred] = arity
+
+    def keys(self):
+        """
+        Longueur de la clé primaire de chaque relation : {pred: pk_len}.
+        """
+        return dict(self.conn.execute(f"SELECT pred, pk_len FROM {KEYS_TABLE}"))
+
+    def certain(self, query):
+        """
+        Certitude de `query` sur la base chargée.
+        """
+        # Les prédicats absents de la base sont des relations vides
+        for _, pred, pk_len, args in query:
+            self._create(pred, len(args), pk_len)
+        sql, params = query_to_sql(query)
+        return bool(self.conn.execute(sql, params).fetchone()[0])
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,159 @@
+"""
+-------------------------------------------------------------------------------
+tracing.py
+
+Trace à niveaux du pipeline de certitude.
+
+Niveaux, du plus discret au plus bavard :
+  - off     : aucune trace (défaut des appels de bibliothèque et par lots) ;
+  - summary : une ligne par étape du pipeline (parsing, garde, cycle, moteur,
+              résultat) ;
+  - steps   : les étapes des algorithmes (atomes choisis, branches, arêtes) ;
+  - debug   : tout, y compris la requête complète à chaque appel récursif.
+
+Les messages sont construits paresseusement : un évènement garde un modèle
+("... {} ...") et ses arguments, le texte n'est produit que si on le lit.
+Les appelants testent d'abord le niveau (`if tracer.steps:`), si bien qu'une
+trace désactivée ne coûte qu'un test d'attribut. Le nombre d'évènements
+gardés est borné (max_events) ; les suivants sont seulement comptés.
+
+Par compatibilité, une simple liste peut encore être passée comme `trace` :
+elle reçoit alors toutes les lignes, déjà formatées.
+
+-------------------------------------------------------------------------------
+"""
+
+OFF, SUMMARY, STEPS, DEBUG = range(4)
+LEVELS = {"off": OFF, "summary": SUMMARY, "steps": STEPS, "debug": DEBUG}
+_NAMES = {v: k for k, v in LEVELS.items()}
+
+DEFAULT_MAX_EVENTS = 10_000
+
+
+def level_of(level):
+    """
+    Niveau numérique depuis un nom ("off", "steps", …) ou un entier.
+    :raises ValueError: niveau inconnu.
+    """
+    if isinstance(level, str):
+        try:
+            return LEVELS[level.lower()]
+        except KeyError:
+            raise ValueError(f"Niveau de trace inconnu : {level}") from None
+    if level not in _NAMES:
+        raise ValueError(f"Niveau de trace inconnu : {level}")
+    return level
+
+
+# =============================================================================
+# ---------------------------------------------------------------------- Event
+class Event:
+    """
+    Évènement de trace : niveau, étape du pipeline, modèle du message et ses
+    arguments, plus d'éventuels champs structurés.
+    """
+    __slots__ = ("level", "stage", "message", "args", "fields")
+
+    def __init__(self, level, stage, message, args, fields):
+        self.level = level
+        self.stage = stage
+        self.message = message
+        self.args = args
+        self.fields = fields
+
+    def text(self):
+        return self.message.format(*self.args) if self.args else self.message
+
+    def to_dict(self):
+        res = {"level": _NAMES[self.level], "stage": self.stage,
+               "message": self.text()}
+        if self.fields:
+            res["fields"] = self.fields
+        return res
+
+
+# =============================================================================
+# --------------------------------------------------------------------- Tracer
+class Tracer:
+    """
+    :param level: niveau maximal des évènements gardés (nom ou entier).
+    :param max_events: nombre maximal d'évènements gardés (None = illimité).
+
+    Usage : `if tracer.steps: tracer(STEPS, "Atome choisi : {}", F)`.
+    L'attribut `stage` (étape courante du pipeline) est recopié dans chaque
+    évènement.
+    """
+
+    def __init__(self, level=STEPS, max_events=DEFAULT_MAX_EVENTS):
+        self.level = level_of(level)
+        self.summary = self.level >= SUMMARY
+        self.steps = self.level >= STEPS
+        self.debug = self.level >= DEBUG
+        self.max_events = max_events
+        self.stage = None
+        self.events = []
+        self.dropped = 0
+
+    def __call__(self, level, message, *args, **fields):
+        if level > self.level:
+            return
+        if self.max_events is not None and len(self.events) >= self.max_events:
+            self.dropped += 1
+            return
+        self.events.append(Event(level, self.stage, message, args, fields))
+
+    def enabled(self, level):
+        return level <= self.level
+
+    # -------------------------------------------------------------------------
+    #  Lecture
+    def lines(self):
+        """
+        Textes des évènements (formatés maintenant), suivis du nombre
+        d'évènements omis s'il y en a.
+        """
+        lines = [event.text() for event in self.events]
+        if self.dropped:
+            lines.append(f"... {self.dropped} évènements de trace omis "
+                         f"(limite : {self.max_events})")
+        return lines
+
+    def to_dicts(self):
+        return [event.to_dict() for event in self.events]
+
+    def stats(self):
+        return {"level": _NAMES[self.level], "events": len(self.events),
+                "dropped": self.dropped}
+
+
+class _ListTracer(Tracer):
+    # Compatibilité : une liste passée comme trace reçoit toutes les lignes,
+    # formatées immédiatement.
+    def __init__(self, target):
+        super().__init__(DEBUG, None)
+        self.events = target
+
+    def __call__(self, level, message, *args, **fields):
+        self.events.append(message.format(*args) if args else message)
+
+    def lines(self):
+        return list(self.events)
+
+    def to_dicts(self):
+        return [{"level": "debug", "stage": None, "message": line}
+                for line in self.events]
+
+
+NULL = Tracer(OFF)
+
+
+def as_tracer(trace):
+    """
+    Tracer depuis l'argument `trace` des fonctions du pipeline : None (trace
+    désactivée), un Tracer, ou une liste (compatibilité).
+    """
+    if trace is None:
+        return NULL
+    if isinstance(trace, Tracer):
+        return trace
+    return _ListTracer(trace)
@@ -5,10 +5,40 @@ Fichier de test unitaire pour le projet d'implémentation du mémoire.
 """
 
 import unittest
-from sources.parseur import parse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from sources.parseur import parse, iter_parse, load
 from sources.ngfo import is_guarded
-from sources.attack_graph import build_attack_graph, detect_cycle
-from sources.certainty import certainty
+from sources.attack_graph import build_attack_graph, detect_cycle, AttackGraph
+from sources.attack_graph import graph_description, graph_signature
+from sources.graph_images import GraphImages
+from sources.certainty import certainty, analyze_query, analysis_cache_stats
+from sources.factstore import FactStore
+from sources.csv_loader import load_csv, load_csv_database
+from sources.jobs import JobManager, QueueFull
+from sources.request_log import RequestLog, query_hash
+from sources.IsCertain import is_certain_core, key_valuations, is_variable
+from sources.cache import LRUCache, canonical_query
+from sources.evaluator import compile_query
+from sources.sql_backend import SQLiteEngine, query_to_sql
+from sources.rewriter import rewrite_formula, rewrite_closed
+from sources.formula import Atom, And, Not, Eq, dag_size, render, to_latex, rename
+from sources.tracing import Tracer, SUMMARY, STEPS, DEBUG
+from sources.elimination import EliminationPlan, compile_plan, NOKEY, ALL_KEY
+from sources.batch import check_queries, check_databases
+from sources.answers import certain_answers, candidates
+from sources.semijoin import join_tree, reduce_database
+from sources.catalog import describe
+from sources.planner import plan_join
+from sources.IsCertain import db_satisfies, explain_satisfies
+from sources.session import Session
+from bench.workload import generate_query, generate_database, to_text
+from bench.suite import compare
 
 # =============================================================================
 # --------------------------------------------------------------------- Parseur
@@ -164,6 +194,49 @@ class TestParseur(unittest.TestCase):
         self.assertEqual(data["query"], [
             (False, "Likes", 2, ("p", "t"))
         ])
+    # --------------------------------------------------------- Flux
+    STREAM = """@database
+R(A; B)
+R(A; C)
+S(B;)
+@query
+R(x; y)
+not S(y;)
+"""
+
+    def test_flux_par_lots(self):
+        """
+        Teste la lecture en flux : lots bornés, mêmes faits que parse.
+        """
+        batches = list(iter_parse(io.StringIO(self.STREAM), batch_size=2))
+        self.assertEqual([section for section, _ in batches], ["database", "database", "query"])
+        self.assertTrue(all(len(items) <= 2 for _, items in batches))
+        facts = [f for section, items in batches if section == "database" for f in items]
+        self.assertEqual(facts, parse(self.STREAM)["database"])
+        self.assertEqual(batches[-1][1], parse(self.STREAM)["query"])
+
+    def test_flux_fichier(self):
+        """
+        Teste le chargement d'un fichier directement dans un FactStore.
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".cqa", delete=False) as f:
+            f.write(self.STREAM)
+        try:
+            store, query = load(f.name, batch_size=1)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(store.facts("R"), [("A", "B"), ("A", "C")])
+        self.assertEqual(store.lookup("R", (0,), ("A",)), [("A", "B"), ("A", "C")])
+        self.assertEqual(query, parse(self.STREAM)["query"])
+
+    def test_flux_numero_de_ligne(self):
+        """
+        Teste que l'erreur indique le numéro de la ligne mal formée.
+        """
+        lines = ["@database", "R(A; B)", "", "R A; B)", "@query", "R(x; y)"]
+        with self.assertRaises(ValueError) as context:
+            list(iter_parse(iter(lines)))
+        self.assertIn("ligne 4", str(context.exception))
 
 
 # =============================================================================
@@ -348,6 +421,1296 @@ class TestAttackGraph(unittest.TestCase):
         graph = build_attack_graph(query)
         self.assertTrue(detect_cycle(graph))
 
+    def test_cache_par_forme(self):
+        """
+        Deux requêtes de même forme (constantes et noms différents)
+        partagent le même graphe.
+        """
+        q1 = [(False, 'A', 1, ('x', 'y')), (True, 'B', 1, ('y', 'Paris'))]
+        q2 = [(False, 'C', 1, ('p', 't')), (True, 'D', 1, ('t', 'London'))]
+        self.assertIs(AttackGraph.of(q1), AttackGraph.of(q2))
+        self.assertEqual(AttackGraph.of(q1).to_dict(q1), build_attack_graph(q1))
+
+# =============================================================================
+# ------------------------------------------------------------------ Fact store
+class TestFactStore(unittest.TestCase):
+    def setUp(self):
+        self.store = FactStore.from_database([
+            ("Lives", 1, ("John", "London")),
+            ("Lives", 1, ("John", "Paris")),
+            ("Lives", 1, ("Mary", "Paris")),
+        ])
+
+    def test_lookup_cle(self):
+        """
+        Recherche par préfixe de clé.
+        """
+        self.assertEqual(self.store.lookup("Lives", (0,), ("John",)),
+                         [("John", "London"), ("John", "Paris")])
+        self.assertEqual(self.store.lookup("Lives", (0,), ("Bob",)), [])
+
+    def test_lookup_sans_position(self):
+        """
+        Sans position liée, on obtient toute la relation.
+        """
+        self.assertEqual(len(self.store.lookup("Lives", (), ())), 3)
+        self.assertEqual(self.store.lookup("Unknown", (0,), ("John",)), [])
+
+    def test_overlay(self):
+        """
+        Un overlay voit la base et sa propre relation, sans modifier la base.
+        """
+        layer = self.store.overlay("E1", [("John",)])
+        self.assertEqual(layer.lookup("E1", (0,), ("John",)), [("John",)])
+        self.assertEqual(layer.lookup("Lives", (1,), ("Paris",)),
+                         [("John", "Paris"), ("Mary", "Paris")])
+        self.assertNotIn("E1", self.store)
+        self.assertNotEqual(layer.token, self.store.token)
+
+    def test_blocs(self):
+        """
+        Blocs de clé : contenu, conflits ; recalculés après un ajout de
+        faits.
+        """
+        blocks = self.store.blocks("Lives", 1)
+        self.assertEqual((len(blocks), blocks.conflicts), (2, 1))
+        self.assertEqual(len(blocks.blocks[("John",)]), 2)
+        self.assertEqual(blocks.blocks[("Mary",)], [("Mary", "Paris")])
+        self.assertIs(self.store.blocks("Lives", 1), blocks)
+        self.assertEqual(self.store.blocks("Lives", 2).conflicts, 0)
+        self.assertEqual(self.store.blocks("Lives", 2).keys((1,), ("Paris",)),
+                         [("John", "Paris"), ("Mary", "Paris")])
+        self.assertEqual(len(self.store.blocks("Unknown", 1)), 0)
+        self.store.extend("Lives", [("Mary", "Rome")])
+        self.assertEqual(self.store.blocks("Lives", 1).conflicts, 2)
+
+    def test_key_valuations(self):
+        """
+        Une valuation par bloc de clé compatible avec les constantes.
+        """
+        atom = (False, "Lives", 1, ("p", "t"))
+        self.assertEqual(key_valuations(atom, self.store),
+                         [{"p": "John"}, {"p": "Mary"}])
+        atom = (False, "Lives", 1, ("Mary", "t"))
+        self.assertEqual(key_valuations(atom, self.store), [{}])
+
+    def test_is_certain_store(self):
+        """
+        is_certain_core accepte indifféremment la liste parsée ou un FactStore.
+        """
+        query = [(False, "Lives", 1, ("p", "t")), (True, "Likes", 2, ("p", "t"))]
+        database = [("Lives", 1, ("John", "London")),
+                    ("Likes", 2, ("John", "Paris"))]
+        self.assertEqual(is_certain_core(query, database),
+                         is_certain_core(query, FactStore.from_database(database)))
+
+# =============================================================================
+# ------------------------------------------------------------------------- CSV
+class TestCSV(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def write(self, name, text):
+        with open(os.path.join(self.dir, name), "w") as f:
+            f.write(text)
+        return os.path.join(self.dir, name)
+
+    def test_relation(self):
+        """
+        Faits chargés tels quels, index de clé construit pendant la lecture.
+        """
+        path = self.write("lives.tsv", "John\tLondon\nJohn\tParis\nMary\tParis\n")
+        store = load_csv(path, "Lives", 1)
+        self.assertEqual(store.facts("Lives"), [("John", "London"), ("John", "Paris"), ("Mary", "Paris")])
+        self.assertIn(("Lives", (0,)), store._indexes)
+        self.assertEqual(store.lookup("Lives", (0,), ("John",)), [("John", "London"), ("John", "Paris")])
+
+    def test_arite(self):
+        """
+        Une ligne d'arité différente est refusée avec son numéro.
+        """
+        path = self.write("r.csv", "a,b\nc\n")
+        with self.assertRaises(ValueError) as context:
+            load_csv(path, "R", 1)
+        self.assertIn("ligne 2", str(context.exception))
+
+    def test_manifeste_et_certainty(self):
+        """
+        Base chargée par manifeste, passée à certainty avec une requête seule.
+        """
+        self.write("parent.csv", "x,y\nJohn,Mary\n")
+        self.write("teacher.csv", "John\n")
+        self.write("manifest.json", json.dumps({
+            "Parent": {"file": "parent.csv", "key": 2, "header": True},
+            "Teacher": {"file": "teacher.csv", "key": 1},
+        }))
+        store = load_csv_database(self.dir)
+        text = """
+        @query
+        Parent(x, y;)
+        Teacher(x;)
+        not Student(y;)
+        """
+        result = certainty(text, database=store)
+        self.assertTrue(result[4])
+        self.assertIs(result[0]["database"], store)
+
+    def test_base_vide(self):
+        """
+        Une base préchargée vide (FactStore faux en contexte booléen) reste
+        la base utilisée : la section @database du texte est ignorée.
+        """
+        store = load_csv_database(self.dir)
+        self.assertEqual(len(store), 0)
+        text = "@query\nParent(x; y)\n@database\nParent(John; Mary)\n"
+        result = certainty(text, database=store)
+        self.assertIs(result[0]["database"], store)
+        self.assertFalse(result[4])
+        self.assertTrue(certainty(text)[4])
+
+    def test_repertoire(self):
+        """
+        Sans manifeste, la longueur de clé vient du nom de fichier.
+        """
+        self.write("Lives.1.csv", "John,London\nJohn,Paris\n")
+        store = load_csv_database(self.dir)
+        self.assertEqual(store.lookup("Lives", (0,), ("John",)), [("John", "London"), ("John", "Paris")])
+        self.assertFalse(is_certain_core([(False, "Lives", 1, ("p", "Rome"))], store))
+
+# =============================================================================
+# ------------------------------------------------------------------------ Memo
+class TestMemo(unittest.TestCase):
+    def test_lru_eviction(self):
+        """
+        L'entrée la moins récemment utilisée est évincée.
+        """
+        cache = LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_canonical_renommage(self):
+        """
+        Deux requêtes égales à renommage près ont la même forme canonique.
+        """
+        q1 = [(False, "R", 1, ("x", "y")), (True, "S", 1, ("y", "Paris"))]
+        q2 = [(False, "R", 1, ("a", "b")), (True, "S", 1, ("b", "Paris"))]
+        q3 = [(False, "R", 1, ("a", "b")), (True, "S", 1, ("a", "Paris"))]
+        self.assertEqual(canonical_query(q1, is_variable),
+                         canonical_query(q2, is_variable))
+        self.assertNotEqual(canonical_query(q1, is_variable),
+                            canonical_query(q3, is_variable))
+
+    def test_canonical_tri(self):
+        """
+        Avec sort_atoms, l'ordre des atomes n'a plus d'importance.
+        """
+        q1 = [(False, "R", 1, ("x", "y")), (False, "S", 1, ("y", "z"))]
+        q2 = [(False, "S", 1, ("b", "c")), (False, "R", 1, ("a", "b"))]
+        self.assertEqual(canonical_query(q1, is_variable, sort_atoms=True),
+                         canonical_query(q2, is_variable, sort_atoms=True))
+
+    def test_compteurs(self):
+        """
+        Les sous-requêtes identiques ne sont résolues qu'une fois, et le
+        résultat ne dépend pas de la taille du mémo.
+        """
+        query = [(False, "R0", 1, ("x", "y")), (False, "R1", 0, ("y", "z"))]
+        database = [("R0", 1, ("D", "A")), ("R1", 0, ("A", "B")), ("R1", 0, ("A", "C"))]
+        stats = {}
+        result = is_certain_core(query, database, stats=stats)
+        self.assertTrue(result)
+        self.assertGreater(stats["memo_hits"], 0)
+        no_memo = {}
+        self.assertEqual(is_certain_core(query, database, memo_size=0,
+                                         stats=no_memo), result)
+        self.assertEqual(no_memo["memo_hits"], 0)
+
+# =============================================================================
+# ------------------------------------------------------------------ Parallèle
+class TestParallel(unittest.TestCase):
+    def test_accord_sequentiel(self):
+        """
+        Le mode parallèle donne le même résultat que la recherche séquentielle.
+        """
+        query = TestEvaluator.QUERY
+        for database in TestEvaluator.DATABASES:
+            stats = {}
+            self.assertEqual(is_certain_core(query, database, workers=2,
+                                             parallel_min_facts=0, stats=stats),
+                             is_certain_core(query, database), database)
+            self.assertIn("memo_misses", stats)
+
+    def test_repli_sequentiel(self):
+        """
+        Sous le seuil de faits, aucune branche n'est envoyée au pool.
+        """
+        trace = []
+        is_certain_core(TestEvaluator.QUERY, TestEvaluator.DATABASES[4], trace=trace, workers=2)
+        self.assertFalse(any("Exploration parallèle" in line for line in trace))
+
+# =============================================================================
+# ------------------------------------------------------------------- Plan FO
+class TestEvaluator(unittest.TestCase):
+    QUERY = [(False, "Lives", 1, ("p", "t")), (False, "Mayor", 1, ("t", "m")),
+             (True, "Likes", 2, ("p", "m"))]
+
+    DATABASES = [
+        [("Lives", 1, ("John", "London")), ("Mayor", 1, ("London", "Khan"))],
+        [("Lives", 1, ("John", "London")), ("Lives", 1, ("John", "Paris")),
+         ("Mayor", 1, ("London", "Khan")), ("Mayor", 1, ("Paris", "Hidalgo"))],
+        [("Lives", 1, ("John", "London")), ("Lives", 1, ("John", "Paris")),
+         ("Mayor", 1, ("London", "Khan"))],
+        [("Lives", 1, ("John", "London")), ("Mayor", 1, ("London", "Khan")),
+         ("Mayor", 1, ("London", "Johnson")), ("Likes", 2, ("John", "Khan"))],
+        [("Lives", 1, ("John", "London")), ("Lives", 1, ("Mary", "Paris")),
+         ("Lives", 1, ("Mary", "Rome")), ("Mayor", 1, ("Paris", "Hidalgo")),
+         ("Mayor", 1, ("Rome", "Gualtieri")), ("Likes", 2, ("John", "Khan"))],
+    ]
+
+    def test_accord_iscertain(self):
+        """
+        Le plan compilé donne le même résultat qu'is_certain_core.
+        """
+        plan = compile_query(self.QUERY)
+        for database in self.DATABASES:
+            self.assertEqual(plan.evaluate(database),
+                             is_certain_core(self.QUERY, database), database)
+
+    def test_plan_reutilise(self):
+        """
+        Une requête renommée réutilise le plan déjà compilé.
+        """
+        renamed = [(False, "Lives", 1, ("a", "b")), (False, "Mayor", 1, ("b", "c")),
+                   (True, "Likes", 2, ("a", "c"))]
+        self.assertIs(compile_query(self.QUERY), compile_query(renamed))
+
+    def test_explain(self):
+        """
+        Le plan est lisible : les quantificateurs sur les blocs apparaissent.
+        """
+        text = compile_query(self.QUERY).explain()
+        self.assertIn("∃ bloc Lives(p)", text)
+        self.assertIn("join", text)
+
+    def test_bloc_de_cle_close(self):
+        """
+        Une fois la clé liée, le bloc est décidé sur tous ses faits : le bloc
+        R0(C, B) n'a qu'un fait, la requête est certaine pour la réécriture,
+        le plan et is_certain_core.
+        """
+        query = [(False, "R0", 2, ("y", "B", "z"))]
+        database = [("R0", 2, ("B", "C", "A")), ("R0", 2, ("C", "B", "B")),
+                    ("R0", 2, ("B", "A", "B")), ("R0", 2, ("B", "A", "B")),
+                    ("R0", 2, ("B", "A", "C"))]
+        self.assertEqual(render(rewrite_formula(query)),
+                         "∃y, z1 ( R0(y, B, z1) ⊓ ∃z2 ( R0(y, B, z2) ) ⊓ "
+                         "∀z2 ( R0(y, B, z2) → ∃z ( z2 = z ⊓ ⊤ ) ) )")
+        self.assertEqual([f for f in FactStore.wrap(database).facts("R0") if f[1] == "B"],
+                         [("C", "B", "B")])
+        self.assertTrue(compile_query(query).evaluate(database))
+        self.assertTrue(is_certain_core(query, database))
+        result = certainty("@query\nR0(y, B; z)\n", database=database)
+        self.assertEqual((result[4], result[8]["engine"]), (True, "fo"))
+
+# =============================================================================
+# ---------------------------------------------------------------------- SQLite
+class TestSQLite(unittest.TestCase):
+    def test_accord_iscertain(self):
+        """
+        Le moteur SQLite donne le même résultat qu'is_certain_core.
+        """
+        query = TestEvaluator.QUERY
+        for database in TestEvaluator.DATABASES:
+            engine = SQLiteEngine(database)
+            self.assertEqual(engine.certain(query),
+                             is_certain_core(query, database), database)
+            engine.close()
+
+    def test_relation_absente(self):
+        """
+        Un prédicat négatif absent de la base est une relation vide.
+        """
+        query = [(False, "Parent", 2, ("x", "y")), (True, "Student", 1, ("y",))]
+        engine = SQLiteEngine([("Parent", 2, ("John", "Mary"))])
+        self.assertTrue(engine.certain(query))
+        engine.close()
+
+    def test_parametres(self):
+        """
+        Les constantes passent en paramètres, jamais dans le texte SQL.
+        """
+        query = [(False, "Lives", 1, ("p", "Robert'); DROP TABLE x;--"))]
+        sql, params = query_to_sql(query)
+        self.assertNotIn("DROP", sql)
+        self.assertIn("Robert'); DROP TABLE x;--", params.values())
+
+    def test_traduction_du_plan(self):
+        """
+        Le SQL traduit le plan compilé, qui suit les étapes de la réécriture :
+        même résultat que le plan, et la même réponse que la formule affichée
+        (voir TestEvaluator.test_bloc_de_cle_close).
+        """
+        query = [(False, "R0", 2, ("y", "B", "z"))]
+        database = [("R0", 2, ("B", "C", "A")), ("R0", 2, ("C", "B", "B")),
+                    ("R0", 2, ("B", "A", "B")), ("R0", 2, ("B", "A", "C"))]
+        cases = [(query, database)]
+        for seed in range(20):
+            query = generate_query(atoms=3, key_length=(0, 2), negated=0.3, seed=seed)
+            cases.append((query, generate_database(
+                query, facts=20, block_size=2, conflicts=0.2, domain=4, seed=seed)))
+        for query, database in cases:
+            engine = SQLiteEngine(database)
+            with self.subTest(query=query):
+                certain = engine.certain(query)
+                self.assertEqual(certain, compile_query(query).evaluate(database))
+                self.assertEqual(certain, is_certain_core(query, database))
+            engine.close()
+        self.assertEqual(rewrite_closed(cases[0][0]),
+                         "∃y, z1 ( R0(y, B, z1) ⊓ ∃z2 ( R0(y, B, z2) ) ⊓ "
+                         "∀z2 ( R0(y, B, z2) → ∃z ( z2 = z ⊓ ⊤ ) ) )")
+        engine = SQLiteEngine(cases[0][1])
+        self.assertTrue(engine.certain(cases[0][0]))
+        engine.close()
+
+    def test_cles(self):
+        """
+        La clé primaire de chaque relation est déclarée dans cqa_keys, y
+        compris pour une relation de la requête absente de la base.
+        """
+        engine = SQLiteEngine([("Lives", 1, ("John", "London")),
+                               ("Lives", 1, ("John", "Paris"))])
+        engine.certain([(False, "Lives", 1, ("p", "t")), (True, "Likes", 2, ("p", "t"))])
+        self.assertEqual(engine.keys(), {"Lives": 1, "Likes": 2})
+        engine.close()
+
+# =============================================================================
+# -------------------------------------------------------------------- Formules
+class TestFormula(unittest.TestCase):
+    @staticmethod
+    def negations(n):
+        return [(False, "R", 2, ("x", "y"))] + [(True, f"N{i}", 1, ("x", "y")) for i in range(n)]
+
+    def test_hash_consing(self):
+        """
+        Deux constructions identiques renvoient le même noeud.
+        """
+        a = And(Atom(False, "R", ("x", "y")), Not(Eq("x", "y")))
+        b = And(Atom(False, "R", ("x", "y")), Not(Eq("x", "y")))
+        self.assertIs(a, b)
+
+    def test_taille(self):
+        """
+        Chaque atome négatif à clé close reprend la suite de la réécriture
+        sous un nouveau ¬E : le DAG double (au plus) à chaque atome, et le
+        partage évite de recopier la suite une seconde fois.
+        """
+        sizes = [dag_size(rewrite_formula(self.negations(n))) for n in range(1, 9)]
+        for a, b in zip(sizes, sizes[1:]):
+            self.assertLessEqual(b, 2 * a)
+        expanded = [len(render(rewrite_formula(self.negations(n)), share=False)) for n in (4, 5)]
+        self.assertGreater(expanded[1], 2 * expanded[0])
+
+    def test_partage(self):
+        """
+        Les sous-formules partagées sont nommées une seule fois, et le rendu
+        par défaut ne les nomme que pour les grandes formules.
+        """
+        small = rewrite_formula(self.negations(1))
+        self.assertEqual(render(small), render(small, share=False))
+        self.assertEqual(render(small), rewrite_closed(self.negations(1)))
+
+        big = rewrite_formula(self.negations(10))
+        text = render(big)
+        self.assertIn("Φ1 := ", text)
+        self.assertLess(len(text), len(render(big, share=False)) * 0.6)
+
+    def test_latex(self):
+        """
+        Rendu LaTeX direct depuis l'AST.
+        """
+        formula = And(Atom(False, "R", ("x",)), Not(Eq("x", "A")))
+        self.assertEqual(to_latex(formula), r"R(x) \land \lnot (x = A)")
+
+# =============================================================================
+# ------------------------------------------------------------------------ Jobs
+def _sleep_then(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+def _fail():
+    raise ValueError("erreur volontaire")
+
+
+def _wait_running(job, timeout=10):
+    # Attente active (bornée) du démarrage d'un job
+    deadline = time.monotonic() + timeout
+    while job.status == "queued" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job.status
+
+
+def _locked_get(cache, key):
+    # Processus fils : lecture d'un cache dont le verrou était tenu au fork
+    return cache.get(key)
+
+
+class TestJobs(unittest.TestCase):
+    TEXT = """
+    @database
+    Parent(John, Mary;)
+    Teacher(John;)
+    @query
+    Parent(x, y;)
+    Teacher(x;)
+    not Student(y;)
+    """
+
+    def test_resultat(self):
+        """
+        Un job terminé renvoie son résultat ; une exception donne "failed".
+        """
+        manager = JobManager(workers=1, timeout=30)
+        job = manager.wait(manager.submit(certainty, self.TEXT).id, 30)
+        self.assertEqual(job.status, "done")
+        self.assertEqual(job.result[4], certainty(self.TEXT)[4])
+        failed = manager.wait(manager.submit(_fail).id, 30)
+        self.assertEqual(failed.status, "failed")
+        self.assertIn("erreur volontaire", failed.error)
+
+    def test_delai_et_annulation(self):
+        """
+        Un job trop long est arrêté ; un job annulé ne s'exécute pas.
+        """
+        manager = JobManager(workers=1)
+        slow = manager.submit(_sleep_then, 30, None, timeout=0.2)
+        queued = manager.submit(_sleep_then, 0, "jamais")
+        manager.cancel(queued.id)
+        self.assertEqual(manager.wait(slow.id, 10).status, "timeout")
+        self.assertEqual(queued.status, "cancelled")
+
+        running = manager.submit(_sleep_then, 30, None)
+        self.assertEqual(_wait_running(running), "running")
+        manager.cancel(running.id)
+        self.assertEqual(manager.wait(running.id, 10).status, "cancelled")
+
+    def test_annulation_concurrente(self):
+        """
+        Un job annulé pendant que le worker le retire de la file n'est jamais
+        démarré ; les processus sont créés par fork quand il existe.
+        """
+        manager = JobManager(workers=4)
+        jobs = [manager.submit(_sleep_then, 0, i) for i in range(30)]
+        cancelled = [job for job in jobs if manager.cancel(job.id).status == "cancelled"]
+        for job in jobs:
+            manager.wait(job.id, 10)
+        for job in cancelled:
+            self.assertEqual((job.status, job.started), ("cancelled", None))
+        for job in jobs:
+            self.assertIn(job.status, ("done", "cancelled"))
+        if "fork" in multiprocessing.get_all_start_methods():
+            self.assertEqual(manager._context.get_start_method(), "fork")
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "fork requis")
+    def test_verrou_au_fork(self):
+        """
+        Un cache dont le verrou est tenu au moment du fork reste utilisable
+        dans le processus du job.
+        """
+        cache = LRUCache()
+        cache.put("clé", "valeur")
+        manager = JobManager(workers=1)
+        with cache._lock:
+            job = manager.wait(manager.submit(_locked_get, cache, "clé", timeout=10).id, 30)
+        self.assertEqual((job.status, job.result), ("done", "valeur"))
+
+    def test_file_pleine(self):
+        """
+        Au-delà de max_queue jobs en attente, la soumission est refusée.
+        """
+        manager = JobManager(workers=1, max_queue=1)
+        first = manager.submit(_sleep_then, 30, None)
+        self.assertEqual(_wait_running(first), "running")
+        second = manager.submit(_sleep_then, 30, None)
+        with self.assertRaises(QueueFull):
+            manager.submit(_sleep_then, 30, None)
+        for job in (second, first):
+            manager.cancel(job.id)
+
+# =============================================================================
+# ------------------------------------------------------------ Images de graphe
+try:
+    import graphviz
+    HAS_GRAPHVIZ = True
+except ImportError:
+    HAS_GRAPHVIZ = False
+
+
+class TestGraphImages(unittest.TestCase):
+    QUERY = [(False, "Lives", 1, ("p", "t")), (False, "Mayor", 1, ("t", "p"))]
+
+    def test_signature(self):
+        """
+        Même graphe → même signature ; l'enregistrement ne dessine rien.
+        """
+        graph = build_attack_graph(self.QUERY)
+        description = graph_description(graph)
+        self.assertEqual(description[0], ("Lives(p, t)", "Mayor(t, p)"))
+        images = GraphImages()
+        signature = images.register(graph)
+        self.assertEqual(signature, graph_signature(description))
+        self.assertEqual(images.register(build_attack_graph(self.QUERY)), signature)
+        self.assertEqual(images.stats()["images"]["size"], 0)
+        self.assertIsNone(images.image("inconnu"))
+        with self.assertRaises(ValueError):
+            images.image(signature, "gif")
+
+    def test_enregistrement_recent(self):
+        """
+        Réenregistrer un graphe connu le rend le plus récent : il survit à
+        l'éviction suivante.
+        """
+        images = GraphImages(max_graphs=2)
+        first = images.register(build_attack_graph(self.QUERY))
+        second = images.register(build_attack_graph([(False, "R", 1, ("x", "y"))]))
+        images.register(build_attack_graph(self.QUERY))
+        images.register(build_attack_graph([(False, "S", 1, ("x", "y"))]))
+        self.assertIn(first, images._graphs)
+        self.assertNotIn(second, images._graphs)
+
+    @unittest.skipUnless(HAS_GRAPHVIZ, "graphviz non installé")
+    def test_rendu_en_cache(self):
+        """
+        L'image n'est rendue qu'une fois par format.
+        """
+        images = GraphImages()
+        signature = images.register(build_attack_graph(self.QUERY))
+        first = images.image(signature, "svg")
+        self.assertIs(images.image(signature, "svg"), first)
+        self.assertEqual(images.stats()["images"]["hits"], 1)
+
+# =============================================================================
+# --------------------------------------------------------- Journal de requêtes
+class TestRequestLog(unittest.TestCase):
+    def test_json_lines_et_rotation(self):
+        """
+        Un enregistrement JSON par ligne, fichiers tournés par taille.
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "queries.jsonl")
+        log = RequestLog(path, max_bytes=300, backup_count=2)
+        for i in range(10):
+            log.record(ip="127.0.0.1", query_hash=query_hash(f"q{i}"),
+                       timings={"parse": 0.001}, outcome={"certain": i % 2 == 0})
+        log.close()
+        files = sorted(os.listdir(directory))
+        self.assertEqual(files, ["queries.jsonl", "queries.jsonl.1", "queries.jsonl.2"])
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertTrue(records)
+        self.assertEqual(set(records[-1]), {"ip", "query_hash", "timings", "outcome", "time"})
+        self.assertEqual(records[-1]["query_hash"], query_hash("q9"))
+        for name in files:
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+# =============================================================================
+# ------------------------------------------------------------ Cache d'analyse
+class TestAnalysisCache(unittest.TestCase):
+    QUERY = [(False, "ParentC", 2, ("x", "y")), (False, "TeacherC", 1, ("x",)),
+             (True, "StudentC", 1, ("y",))]
+    RENAMED = [(False, "TeacherC", 1, ("a",)), (True, "StudentC", 1, ("b",)),
+               (False, "ParentC", 2, ("a", "b"))]
+
+    def test_renommage(self):
+        """
+        Une requête égale à renommage et ordre près réutilise l'analyse,
+        traduite dans ses propres noms.
+        """
+        analyze_query(self.QUERY, [])
+        before = analysis_cache_stats()["hits"]
+        analysis, hit = analyze_query(self.RENAMED, [])
+        self.assertTrue(hit)
+        self.assertEqual(analysis_cache_stats()["hits"], before + 1)
+        self.assertEqual(set(analysis["graph"]), set(self.RENAMED))
+        text = render(analysis["formula"])
+        self.assertIn("ParentC(a, b)", text)
+        self.assertNotIn("x", text)
+
+    def test_ordre_de_la_requete(self):
+        """
+        Graphe et réécriture traduits sont ceux de la requête elle-même,
+        dans son ordre d'atomes.
+        """
+        analyze_query(self.QUERY, [])
+        for query in (self.RENAMED, [(False, "ParentC", 2, ("u", "v")),
+                                     (False, "TeacherC", 1, ("u",)),
+                                     (True, "StudentC", 1, ("v",))]):
+            analysis, hit = analyze_query(query, [])
+            self.assertTrue(hit)
+            graph = build_attack_graph(query)
+            self.assertEqual(analysis["graph"], graph)
+            self.assertEqual([list(v) for v in analysis["graph"].values()],
+                             [list(v) for v in graph.values()])
+            self.assertIs(analysis["formula"], rewrite_formula(query))
+
+    def test_rename(self):
+        """
+        Le renommage des formules est simultané.
+        """
+        formula = And(Atom(False, "R", ("x", "y")), Not(Eq("y", "A")))
+        self.assertIs(rename(formula, {"x": "y", "y": "x"}),
+                      And(Atom(False, "R", ("y", "x")), Not(Eq("x", "A"))))
+
+# =============================================================================
+# ----------------------------------------------------------------------- Trace
+class TestTracing(unittest.TestCase):
+    def test_niveaux(self):
+        """
+        Chaque niveau garde ses évènements et ceux des niveaux inférieurs ;
+        le message n'est formaté qu'à la lecture.
+        """
+        formatted = []
+
+        class Probe:
+            def __str__(self):
+                formatted.append(1)
+                return "probe"
+
+        tracer = Tracer("steps")
+        tracer(SUMMARY, "résumé")
+        tracer(STEPS, "étape {}", Probe())
+        tracer(DEBUG, "détail {}", Probe())
+        self.assertFalse(tracer.debug)
+        self.assertEqual(formatted, [])
+        self.assertEqual(tracer.lines(), ["résumé", "étape probe"])
+        self.assertEqual(tracer.to_dicts()[1]["level"], "steps")
+        with self.assertRaises(ValueError):
+            Tracer("verbose")
+
+    def test_limite(self):
+        """
+        Au-delà de max_events, les évènements sont seulement comptés.
+        """
+        tracer = Tracer("debug", max_events=3)
+        is_certain_core(TestEvaluator.QUERY, TestEvaluator.DATABASES[4], trace=tracer)
+        self.assertEqual(len(tracer.events), 3)
+        self.assertGreater(tracer.dropped, 0)
+        self.assertIn("omis", tracer.lines()[-1])
+
+    def test_certainty(self):
+        """
+        Pas de trace par défaut ; le niveau ne change pas le résultat.
+        """
+        text = TestJobs.TEXT
+        off = certainty(text)
+        steps = certainty(text, trace_level="steps")
+        self.assertEqual(off[7], [])
+        self.assertEqual(off[8]["trace"]["events"], 0)
+        self.assertEqual(off[4], steps[4])
+        self.assertTrue(steps[7])
+
+# =============================================================================
+# ------------------------------------------------------------------ Benchmarks
+class TestWorkload(unittest.TestCase):
+    def test_proprietes(self):
+        """
+        Les requêtes générées ont la garde et la cyclicité demandées.
+        """
+        for guard, expected in (("guarded", "NGFO"), ("weak", "WG")):
+            for cyclic in (False, True):
+                query = generate_query(10, key_length=(1, 2), negated=0.3,
+                                       guard=guard, cyclic=cyclic, seed=4)
+                self.assertEqual(len(query), 10)
+                self.assertEqual(is_guarded(query)[1], expected)
+                self.assertEqual(detect_cycle(build_attack_graph(query)), cyclic)
+        with self.assertRaises(ValueError):
+            generate_query(2, guard="weak")
+
+    def test_base_et_texte(self):
+        """
+        Conflits dans la base, et texte .cqa relu à l'identique.
+        """
+        query = generate_query(5, key_length=(0, 2), seed=1)
+        database = generate_database(query, facts=30, block_size=3, conflicts=0.5,
+                                     domain=10, seed=1)
+        blocks = {}
+        for pred, pk, args in database:
+            blocks[pred, args[:pk]] = blocks.get((pred, args[:pk]), 0) + 1
+        self.assertTrue(any(size > 1 for size in blocks.values()))
+        data = parse(to_text(query, database))
+        self.assertEqual(data["query"], query)
+        self.assertEqual(sorted(data["database"]), sorted(database))
+
+    def test_compare(self):
+        """
+        Un temps qui dépasse la tolérance, ou une certitude différente, est
+        une régression ; un petit écart absolu n'en est pas une.
+        """
+        def results(seconds, certain=True):
+            return {"workloads": {"w": {"certain": certain, "stages": {
+                "parse": {"seconds": seconds, "peak_bytes": 1000}}}}}
+
+        baseline = results(0.1)
+        self.assertEqual(compare(results(0.12), baseline), [])
+        self.assertEqual(compare(results(0.3), baseline),
+                         [("w", "parse", "seconds", 0.1, 0.3)])
+        self.assertEqual(compare(results(0.0001), results(0.00001)), [])
+        self.assertEqual(compare(results(0.1, False), baseline)[0][2], "certain")
+
+# =============================================================================
+# -------------------------------------------------------------------- Mesures
+class TestMetrics(unittest.TestCase):
+    TEXT = """
+@database
+R(A; B)
+R(A; C)
+S(B; A)
+S(C; A)
+@query
+R(x; y)
+S(y; x)
+"""
+
+    def test_etapes_et_compteurs(self):
+        """
+        Temps réel et CPU par étape, compteurs de la recherche IsCertain.
+        """
+        stats = certainty(self.TEXT)[8]
+        self.assertEqual(stats["engine"], "iscertain")
+        metrics = stats["metrics"]
+        for stage in ("parse", "analysis", "certainty"):
+            self.assertGreaterEqual(metrics["stages"][stage]["wall"], 0)
+            self.assertIn("cpu", metrics["stages"][stage])
+        counters = metrics["counters"]
+        self.assertGreaterEqual(counters["calls"], 1)
+        self.assertGreaterEqual(counters["max_depth"], 1)
+        # Test 0-bis lu sur les blocs de clé, recherche bloquée (cycle) :
+        # aucun fait parcouru
+        self.assertEqual(counters["facts_scanned"], 0)
+        self.assertEqual(stats["timings"]["parse"], metrics["stages"]["parse"]["wall"])
+        json.dumps(metrics)
+
+    def test_profondeur(self):
+        """
+        La profondeur maximale suit les appels récursifs.
+        """
+        stats = {}
+        is_certain_core(TestEvaluator.QUERY, TestEvaluator.DATABASES[4], stats=stats)
+        self.assertGreater(stats["calls"], 1)
+        self.assertGreater(stats["max_depth"], 1)
+        self.assertLessEqual(stats["max_depth"], stats["calls"])
+
+# =============================================================================
+# ------------------------------------------------------------------ Itératif
+class TestIteratif(unittest.TestCase):
+    """
+    Versions à pile explicite d'is_certain_core et de rewrite, comparées aux
+    versions récursives de référence.
+    """
+    PARAMS = [
+        dict(atoms=5, key_length=(1, 2), negated=0.2),
+        dict(atoms=5, key_length=(0, 1), negated=0.4),
+        dict(atoms=6, key_length=(1, 2), negated=0.3, guard="weak"),
+        dict(atoms=5, key_length=(0, 2), negated=0.2, cyclic=True),
+    ]
+
+    @staticmethod
+    def chain(n):
+        # Chaîne de n atomes R_i(x_i; x_i+1), certaine : une profondeur de
+        # recherche par atome
+        names = ["x" + "".join(chr(97 + int(d)) for d in str(i)) for i in range(n + 1)]
+        query = [(False, f"R{i}", 1, (names[i], names[i + 1])) for i in range(n)]
+        database = [(f"R{i}", 1, (a, b)) for i in range(n) for a in "AB" for b in "AB"]
+        return query, database
+
+    def test_iscertain(self):
+        """
+        Même résultat, mêmes compteurs et même trace que la version récursive.
+        """
+        for params in self.PARAMS:
+            for seed in range(5):
+                query = generate_query(seed=seed, **params)
+                database = generate_database(query, facts=12, block_size=3, conflicts=0.5,
+                                             domain=3, seed=seed)
+                results = []
+                for recursive in (False, True):
+                    stats, tracer = {}, Tracer(DEBUG)
+                    certain = is_certain_core(query, database, trace=tracer, stats=stats,
+                                              recursive=recursive)
+                    results.append((certain, stats, tracer.lines()))
+                self.assertEqual(results[0], results[1], (params, seed))
+
+    def test_rewrite(self):
+        """
+        Même formule (noeud identique du DAG) et même trace.
+        """
+        for params in self.PARAMS[:3]:
+            for seed in range(5):
+                query = generate_query(seed=seed, **params)
+                results = []
+                for recursive in (False, True):
+                    tracer = Tracer(DEBUG)
+                    formula = rewrite_formula(query, tracer, recursive=recursive)
+                    results.append((formula, tracer.lines()))
+                self.assertIs(results[0][0], results[1][0])
+                self.assertEqual(results[0][1], results[1][1])
+
+    def test_profondeur(self):
+        """
+        Au-delà de la limite de récursion, seules les versions récursives
+        échouent.
+        """
+        query, database = self.chain(60)
+        depth, frame = 0, sys._getframe()
+        while frame is not None:
+            depth, frame = depth + 1, frame.f_back
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(depth + 50)
+        try:
+            formula = rewrite_formula(query)
+            self.assertIn("R59(", render(formula))
+            certain = is_certain_core(query, database)
+            with self.assertRaises(RecursionError):
+                rewrite_formula(query, recursive=True)
+            with self.assertRaises(RecursionError):
+                is_certain_core(query, database, recursive=True)
+        finally:
+            sys.setrecursionlimit(limit)
+        self.assertEqual(certain, is_certain_core(query, database, recursive=True))
+        self.assertIs(formula, rewrite_formula(query, recursive=True))
+
+# =============================================================================
+# ------------------------------------------------------- Plan d'élimination
+class TestElimination(unittest.TestCase):
+    QUERY = [(False, "R", 1, ("x", "y")), (False, "S", 0, ("y", "z")),
+             (True, "N", 1, ("x", "z"))]
+
+    def test_etapes(self):
+        """
+        Étapes de la recherche (variables liées), suivies aussi par la
+        réécriture.
+        """
+        plan = compile_plan(self.QUERY)
+        self.assertEqual([(s.kind, s.index, s.bound) for s in plan.steps],
+                         [(NOKEY, 1, (1, 2)), (ALL_KEY, None, ())])
+        self.assertIn("liées : y, z", plan.explain(self.QUERY))
+        self.assertEqual(rewrite_closed(self.QUERY),
+                         "∃z1, z2 ( S(z1, z2) ) ⊓ ∀z1, z2 ( S(z1, z2) → ∃y, z ( z1 = y ⊓ z2 = z ⊓ "
+                         "∃x ( R(x, y) ⊓ ∀z3 ( R(x, z3) → z3 = y ) ⊓ ¬N(x, z) ) ) )")
+
+    def test_reutilisation(self):
+        """
+        Un plan par forme : renommer les variables n'en change pas, une
+        constante à la place d'une variable donne une autre forme.
+        """
+        renamed = [(False, "A", 1, ("u", "C")), (False, "B", 0, ("C", "w")),
+                   (True, "D", 1, ("u", "w"))]
+        other = [(False, "A", 1, ("u", "v")), (False, "B", 0, ("v", "w")),
+                 (True, "D", 1, ("u", "w"))]
+        self.assertIs(compile_plan(other), compile_plan(self.QUERY))
+        self.assertIsNot(compile_plan(renamed), compile_plan(self.QUERY))
+
+    def test_serialisation(self):
+        """
+        Le plan relu depuis JSON donne les mêmes résultats.
+        """
+        query = TestEvaluator.QUERY
+        data = json.loads(json.dumps(compile_plan(query).to_dict()))
+        plan = EliminationPlan.from_dict(data)
+        self.assertEqual(plan.to_dict(), compile_plan(query).to_dict())
+        self.assertIsNot(plan, compile_plan(query))
+        for database in TestEvaluator.DATABASES:
+            self.assertEqual(is_certain_core(query, database, plan=plan),
+                             compile_query(query).evaluate(database))
+        with self.assertRaises(ValueError):
+            is_certain_core(self.QUERY, [], plan=plan)
+
+# =============================================================================
+# ------------------------------------------------------------------------ Lots
+class TestBatch(unittest.TestCase):
+    QUERY = [(False, "Lives", 1, ("p", "t")), (False, "Mayor", 1, ("t", "m"))]
+    QUERIES = [
+        QUERY,
+        "@query\nLives(p; t)\nLikes(p, m;)\n",
+        "@query\nLives(p; t)\nLives(t; m)\n",
+        "@query\nLives(p;\n",
+    ]
+
+    def test_requetes(self):
+        """
+        N requêtes sur une base : mêmes certitudes qu'une à une, dans l'ordre,
+        une erreur ne concernant que son élément.
+        """
+        database = TestEvaluator.DATABASES[3]
+        for workers in (None, 2):
+            results = list(check_queries(self.QUERIES, database, workers=workers, window=2))
+            self.assertEqual([r["index"] for r in results], [0, 1, 2, 3])
+            self.assertEqual(results[0]["certain"], is_certain_core(self.QUERY, database))
+            self.assertEqual(results[1]["certain"], is_certain_core(
+                [(False, "Lives", 1, ("p", "t")), (False, "Likes", 2, ("p", "m"))], database))
+            self.assertIsNone(results[2]["certain"])
+            self.assertEqual(results[2]["guarded"][1], "not sjf")
+            self.assertIn("ValueError", results[3]["error"])
+
+    def test_bases(self):
+        """
+        Une requête sur N bases : la requête n'est analysée qu'une fois.
+        """
+        texts = ["@database\n" + "".join(
+                     f"{p}({', '.join(args[:k])}; {', '.join(args[k:])})\n"
+                     for p, k, args in database)
+                 for database in TestEvaluator.DATABASES]
+        expected = [is_certain_core(self.QUERY, database)
+                    for database in TestEvaluator.DATABASES]
+        for workers in (None, 2):
+            results = list(check_databases(self.QUERY, texts, workers=workers))
+            self.assertEqual([r["certain"] for r in results], expected)
+            self.assertTrue(all(r["analysis_cache"] == "hit" for r in results))
+
+# =============================================================================
+# ---------------------------------------------------------- Réponses certaines
+class TestAnswers(unittest.TestCase):
+    QUERY = [(False, "Lives", 1, ("p", "t")), (False, "Mayor", 1, ("t", "m")),
+             (True, "Likes", 2, ("t", "m"))]
+    CYCLIC = [(False, "Lives", 1, ("p", "t")), (False, "Mayor", 1, ("t", "p")),
+              (False, "Likes", 2, ("t", "m"))]
+    CYCLIC_DATABASE = [("Lives", 1, ("a1", "b1")), ("Lives", 1, ("a1", "b2")),
+                       ("Mayor", 1, ("b1", "a1")), ("Mayor", 1, ("b2", "a1")),
+                       ("Likes", 2, ("b1", "c1")), ("Likes", 2, ("b2", "c1")),
+                       ("Likes", 2, ("b1", "c2"))]
+
+    def test_reponses(self):
+        """
+        Base conforme aux clés : les réponses certaines sont les réponses de
+        la requête. Les candidats ne viennent que des atomes positifs.
+        """
+        database = TestEvaluator.DATABASES[0] + [("Likes", 2, ("Paris", "Hidalgo")),
+                                                 ("Mayor", 1, ("Rome", "Gualtieri"))]
+        stats = {}
+        answers = certain_answers(self.QUERY, database, ["p", "m"], stats=stats)
+        self.assertEqual(next(answers), ("John", "Khan"))
+        self.assertEqual(list(answers), [])
+        self.assertEqual((stats["engine"], stats["candidates"], stats["answers"]), ("fo", 1, 1))
+        self.assertEqual(list(candidates(self.QUERY, FactStore.wrap(database), ["m"])),
+                         [("Khan",)])
+
+    def test_accord_booleen(self):
+        """
+        Chaque candidat est une réponse ssi la requête booléenne, les
+        variables libres remplacées par ses valeurs, est certaine.
+        """
+        for query, engine, frees in ((self.QUERY, "fo", (["t"], ["p", "t"])),
+                                     (self.CYCLIC, "iscertain", (["m"],))):
+            for database in TestEvaluator.DATABASES + [self.CYCLIC_DATABASE]:
+                store = FactStore.wrap(database)
+                for free in frees:
+                    stats = {}
+                    got = list(certain_answers(query, store, free, stats=stats))
+                    expected = []
+                    for values in candidates(query, store, free):
+                        env = dict(zip(free, values))
+                        ground = [(n, r, k, tuple(env.get(a, a) for a in args))
+                                  for n, r, k, args in query]
+                        if is_certain_core(ground, store):
+                            expected.append(values)
+                    self.assertEqual(got, expected)
+                    self.assertEqual(stats["engine"], engine)
+
+    def test_accord_certainty(self):
+        """
+        Réponses certaines = candidats pour lesquels certainty, sur la même
+        base, juge certaine la requête booléenne correspondante.
+        """
+        cases = [([(False, "R", 1, ("x", "y")), (False, "S", 1, ("y", "z"))], ["x"],
+                  [("R", 1, ("A", "C")), ("R", 1, ("A", "A")), ("R", 1, ("B", "C")),
+                   ("R", 1, ("C", "A")), ("S", 1, ("A", "B")), ("S", 1, ("B", "C"))])]
+        cases += [(self.QUERY, ["p", "m"], database) for database in TestEvaluator.DATABASES]
+        for seed in range(20):
+            query = generate_query(atoms=2, key_length=(0, 2), seed=seed)
+            free = [t for neg, _, pk_len, args in query for t in args[pk_len:]][-1:]
+            cases.append((query, free, generate_database(
+                query, facts=30, block_size=2, conflicts=0.1, domain=4, seed=seed)))
+        for query, free, database in cases:
+            store = FactStore.wrap(database)
+            expected = []
+            for values in candidates(query, store, free):
+                env = dict(zip(free, values))
+                ground = [(n, r, k, tuple(env.get(a, a) for a in args))
+                          for n, r, k, args in query]
+                if certainty(to_text(ground, []), database=database)[4]:
+                    expected.append(values)
+            with self.subTest(query=query, free=free):
+                self.assertEqual(list(certain_answers(query, database, free)), expected)
+
+    def test_variables_invalides(self):
+        with self.assertRaises(ValueError):
+            certain_answers(self.QUERY, [], ["z"])
+        with self.assertRaises(ValueError):
+            certain_answers(self.QUERY, [], ["p", "p"])
+
+# =============================================================================
+# ------------------------------------------------------------ Semi-jointures
+class TestSemiJoin(unittest.TestCase):
+    QUERY = [(False, "Lives", 1, ("p", "t")), (False, "Mayor", 1, ("t", "m")),
+             (True, "Likes", 2, ("t", "m"))]
+    DATABASE = [("Lives", 1, ("John", "London")), ("Lives", 1, ("John", "Paris")),
+                ("Lives", 1, ("Mary", "Oslo")), ("Lives", 1, ("Mary", "Rome")),
+                ("Mayor", 1, ("London", "Khan")), ("Mayor", 1, ("Berlin", "Wegner")),
+                ("Mayor", 1, ("Berlin", "Giffey")),
+                ("Likes", 2, ("London", "Khan")), ("Likes", 2, ("Paris", "Khan")),
+                ("Other", 1, ("A", "B"))]
+
+    def test_arbre(self):
+        """
+        Réduction GYO : chaîne acyclique, triangle cyclique.
+        """
+        self.assertEqual(len(join_tree(self.QUERY[:2])), 2)
+        triangle = [(False, "R", 1, ("x", "y")), (False, "S", 1, ("y", "z")),
+                    (False, "T", 1, ("z", "x"))]
+        self.assertIsNone(join_tree(triangle))
+
+    def test_blocs_entiers(self):
+        """
+        Seuls les blocs utiles restent, en entier : le bloc John garde Paris,
+        Mary et Berlin disparaissent, comme le prédicat hors requête.
+        """
+        reduced, applied = reduce_database(self.QUERY, self.DATABASE)
+        self.assertTrue(applied)
+        self.assertEqual(reduced.facts("Lives"), [("John", "London"), ("John", "Paris")])
+        self.assertEqual(reduced.facts("Mayor"), [("London", "Khan")])
+        self.assertEqual(reduced.facts("Likes"), [("London", "Khan")])
+        self.assertNotIn("Other", reduced)
+        self.assertEqual(is_certain_core(self.QUERY, reduced),
+                         is_certain_core(self.QUERY, self.DATABASE))
+
+    def test_taille_rapportee(self):
+        text = ("@database\n" + "".join(
+                    f"{p}({', '.join(args[:k])}; {', '.join(args[k:])})\n"
+                    for p, k, args in self.DATABASE)
+                + "@query\nLives(p; t)\nMayor(t; m)\n")
+        stats = certainty(text)[8]
+        self.assertEqual(stats["database"], {"facts": 10, "reduced": 3, "semijoin": True})
+        stats = certainty(text, reduce=False)[8]
+        self.assertEqual(stats["database"], {"facts": 10, "reduced": 10, "semijoin": False})
+
+    def test_differentiel(self):
+        """
+        Même certitude avec et sans réduction. Sur R(C; y) S(y; z), la
+        réduction rend R conforme à sa clé (test 0-bis), la base complète
+        passe par le bloc de R(C) : les deux répondent True.
+        """
+        cases = [("@query\nR(C; y)\nS(y; z)\n",
+                  [("R", 1, ("A", "C")), ("R", 1, ("A", "A")), ("R", 1, ("B", "C")),
+                   ("R", 1, ("C", "A")), ("S", 1, ("A", "B")), ("S", 1, ("B", "C"))])]
+        for seed in range(40):
+            query = generate_query(atoms=3, key_length=(0, 2), negated=0.3, seed=seed)
+            cases.append((to_text(query, []), generate_database(
+                query, facts=30, block_size=3, conflicts=0.3, domain=6, seed=seed)))
+        for text, database in cases:
+            with self.subTest(text=text):
+                self.assertEqual(certainty(text, database=database)[4],
+                                 certainty(text, database=database, reduce=False)[4])
+
+# =============================================================================
+# ------------------------------------------------------------- Planificateur
+class TestPlanner(unittest.TestCase):
+    QUERY = [(False, "A", 1, ("x",)), (False, "B", 1, ("y",)),
+             (False, "C", 2, ("x", "y")), (True, "N", 1, ("x",))]
+
+    def setUp(self):
+        self.store = FactStore.from_database(
+            [("A", 1, (f"a{i}",)) for i in range(50)]
+            + [("B", 1, (f"b{i}",)) for i in range(50)]
+            + [("C", 2, (f"a{i}", f"b{i}")) for i in range(0, 50, 10)]
+            + [("N", 1, ("a0",)), ("N", 1, ("a10",))])
+
+    def test_catalogue(self):
+        """
+        Cardinalité, valeurs distinctes, histogramme des blocs ; recalculés
+        quand la taille de la relation change de plus de STATS_DRIFT.
+        """
+        stats = self.store.statistics("C")
+        self.assertEqual((stats.cardinality, stats.distinct), (5, (5, 5)))
+        self.assertEqual(stats.histogram(1), {1: 5})
+        self.assertEqual(describe(self.store, {"N": 1})["N"],
+                         {"cardinality": 2, "distinct": [2], "blocks": {1: 2}})
+        self.store.extend("C", [("a0", "b1")])
+        self.assertEqual(self.store.statistics("C").histogram(1), {1: 4, 2: 1})
+
+    def test_ordre(self):
+        """
+        La relation la plus petite d'abord, les autres par index, l'atome
+        négatif dès que x est lié.
+        """
+        plan = explain_satisfies(self.QUERY, self.store)
+        self.assertEqual([step.atom[1] for step in plan.steps], ["C", "N", "A", "B"])
+        self.assertEqual(plan.steps[2].positions, (0,))
+        self.assertIn("C(x, y) ; parcours", plan.explain())
+        json.dumps(plan.to_dict())
+        self.assertEqual(plan_join(self.QUERY, self.store, {"x"}).steps[0].atom[1], "N")
+
+    def test_resultat(self):
+        """
+        L'ordre choisi ne change pas le résultat.
+        """
+        self.assertTrue(db_satisfies(self.QUERY, self.store))
+        self.store.extend("N", [(f"a{i}",) for i in range(20, 50, 10)])
+        self.assertFalse(db_satisfies(self.QUERY, self.store))
+        self.assertTrue(db_satisfies(self.QUERY[:3], self.store))
+
+    def test_anti_jointure(self):
+        """
+        Atome négatif vérifié sur les faits de l'atome positif qui le
+        précède, avec constante et variable déjà liée ; variable libre
+        répétée vérifiée par unification.
+        """
+        store = FactStore.from_database(
+            [("P", 1, (f"p{i}",)) for i in range(20)]
+            + [("L", 1, ("K", f"p{i}", "T")) for i in range(20)]
+            + [("L", 1, ("K", "p3", "U")), ("M", 1, ("p5", "V", "W"))])
+        query = [(False, "P", 1, ("p",)), (True, "L", 1, ("K", "p", "T"))]
+        self.assertIn("¬L(K, p, T) ; anti-jointure", explain_satisfies(query, store).explain())
+        self.assertFalse(db_satisfies(query, store))
+        self.assertTrue(db_satisfies(query[:1] + [(True, "L", 1, ("K", "p", "U"))], store))
+        self.assertTrue(db_satisfies(query[:1] + [(True, "M", 1, ("p", "z", "z"))], store))
+        store.extend("M", [(f"p{i}", "V", "V") for i in range(20)])
+        self.assertFalse(db_satisfies(query[:1] + [(True, "M", 1, ("p", "z", "z"))], store))
+
+# =============================================================================
+# -------------------------------------------------------------------- Session
+class TestSession(unittest.TestCase):
+    TOWN = [(False, "Lives", 1, ("p", "t")), (False, "Mayor", 1, ("t", "m"))]
+    CARL = [(False, "Lives", 1, ("Carl", "t"))]
+    MAYOR = "@query\nMayor(t; m)\n"
+    CYCLIC = [(False, "Lives", 1, ("p", "t")), (False, "Mayor", 1, ("t", "p")),
+              (False, "Likes", 2, ("t", "m")), (True, "N", 0, ("p",))]
+
+    def setUp(self):
+        self.database = [("Lives", 1, ("Ann", "Rome")), ("Lives", 1, ("Carl", "Oslo")),
+                         ("Mayor", 1, ("Rome", "Bea"))]
+        self.session = Session(self.database)
+        for name, query in (("town", self.TOWN), ("mayor", self.MAYOR)):
+            self.session.register(query, name)
+
+    def check(self, session, results, reduce=True):
+        # Mêmes valeurs que certainty sur la base courante de la session
+        facts = [(p, 1, args) for p, facts in session.store.to_dict().items()
+                 for args in facts]
+        texts = {"town": "@query\nLives(p; t)\nMayor(t; m)\n",
+                 "carl": "@query\nLives(Carl; t)\n", "mayor": self.MAYOR}
+        for name, certain in results.items():
+            self.assertEqual(certainty(texts[name], database=facts, reduce=reduce)[4], certain)
+
+    def test_mise_a_jour(self):
+        """
+        Valeurs recalculées après ajouts et suppressions, égales à celles
+        de certainty sur la base courante ; la base d'origine n'est pas
+        modifiée.
+        """
+        self.assertEqual(self.session.results(), {"town": True, "mayor": True})
+        report = self.session.insert([("Lives", 1, ("Ann", "Paris"))])
+        self.assertEqual(report["results"], {"town": False, "mayor": True})
+        self.assertEqual(report["changed"], ["town"])
+        self.assertEqual(report["inserted"], 1)
+        self.check(self.session, report["results"])
+        report = self.session.apply(insert="@database\nMayor(Oslo; Dan)\n",
+                                    delete=[("Lives", 1, ("Ann", "Paris")),
+                                            ("Lives", 1, ("Ann", "Nice"))])
+        self.assertEqual(report["results"], {"town": True, "mayor": True})
+        self.assertEqual((report["inserted"], report["deleted"]), (1, 1))
+        self.check(self.session, report["results"])
+        self.assertEqual(len(self.database), 3)
+
+    def test_dependances(self):
+        """
+        Seules les requêtes dont un prédicat est modifié sont reprises (un
+        bloc de clé compatible avec reduce=True) ; un fait déjà présent ou
+        absent est ignoré.
+        """
+        report = self.session.insert([("Lives", 1, ("Ann", "Paris"))])
+        queries = report["queries"]
+        self.assertTrue(queries["town"]["touched"] and queries["town"]["recomputed"])
+        self.assertFalse(queries["mayor"]["touched"])
+        report = self.session.apply(insert=[("Lives", 1, ("Ann", "Paris"))],
+                                    delete=[("Mayor", 1, ("Oslo", "Eve"))])
+        self.assertEqual((report["inserted"], report["deleted"]), (0, 0))
+        self.assertFalse(any(q["touched"] for q in report["queries"].values()))
+        with self.assertRaises(ValueError):
+            self.session.register(self.TOWN, "town")
+
+        session = Session(self.database)
+        session.register(self.CARL, "carl")
+        report = session.insert([("Lives", 1, ("Ann", "Paris"))])
+        self.assertFalse(report["queries"]["carl"]["touched"])
+        report = session.insert([("Lives", 1, ("Carl", "Nice"))])
+        self.assertTrue(report["queries"]["carl"]["recomputed"])
+        self.check(session, report["results"])
+
+    def test_memo(self):
+        """
+        IsCertain : les sous-résultats dont les relations réduites n'ont pas
+        changé sont repris au lot suivant.
+        """
+        session = Session([("Lives", 1, ("P1", "T1")), ("Lives", 1, ("P1", "T2")),
+                           ("Mayor", 1, ("T1", "P1")), ("Likes", 2, ("T1", "M1")),
+                           ("N", 0, ("P1",)), ("N", 0, ("P2",))])
+        name, certain = session.register(self.CYCLIC)
+        report = session.delete([("N", 0, ("P2",))])
+        self.assertEqual(report["queries"][name]["engine"], "iscertain")
+        self.assertEqual(report["queries"][name]["memo_reused"], 1)
+        self.assertEqual(report["results"][name], is_certain_core(
+            self.CYCLIC, session.store))
+
+    def test_par_bloc(self):
+        """
+        Requête acyclique : un lot ne réévalue que les blocs dont il change
+        une lecture ; tant qu'un bloc évalué reste certain, les autres
+        blocs attendent.
+        """
+        database = ([("Lives", 1, (f"P{i}", f"T{i}")) for i in range(20)]
+                    + [("Mayor", 1, ("T7", "Bea"))])
+        session = Session(database)
+        session.register(self.TOWN, "town")
+        report = session.insert([("Lives", 1, ("Q", "T9")), ("Lives", 1, ("R", "T3"))])
+        self.assertEqual(report["queries"]["town"]["blocks"], 0)
+        self.assertEqual(report["results"], {"town": True})
+        report = session.delete([("Mayor", 1, ("T7", "Bea"))])
+        self.assertEqual(report["results"], {"town": False})
+        self.check(session, report["results"])
+        report = session.insert([("Mayor", 1, ("T7", "Bea"))])
+        self.assertEqual(report["queries"]["town"]["blocks"], 1)
+        self.assertEqual(report["results"], {"town": True})
+        self.check(session, report["results"])
+
+    def test_suppression(self):
+        """
+        FactStore.remove retire toutes les occurrences ; les index et les
+        blocs de clé déjà construits sont mis à jour en place. Un fait
+        répété n'est pas un conflit de clé.
+        """
+        store = FactStore.from_database(self.database + [("Lives", 1, ("Ann", "Rome"))])
+        index = store.index("Lives", [0])
+        self.assertEqual(store.blocks("Lives", 1).conflicts, 0)
+        store.extend("Lives", [("Ann", "Nice")])
+        self.assertEqual(store.blocks("Lives", 1).conflicts, 1)
+        store.remove("Lives", [("Ann", "Rome"), ("Ann", "Nice")])
+        self.assertEqual(store.facts("Lives"), [("Carl", "Oslo")])
+        self.assertEqual(store.blocks("Lives", 1).conflicts, 0)
+        self.assertEqual(store.lookup("Lives", [0], ["Ann"]), [])
+        self.assertIs(store.index("Lives", [0]), index)
+
 # =============================================================================
 # ------------------------------------------------------------------- certainty
 """
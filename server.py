@@ -4,16 +4,34 @@ Fichier de serveur Flask pour servir l'application via web.
 -------------------------------------------------------------------------------
 """
 
-from flask import Flask, request, send_file
+from flask import Flask, request, send_file, Response, stream_with_context
 import waitress
 import os
 import json
-from datetime import datetime
+import time
 
-from cqa.sources.certainty import certainty
+from cqa.sources.certainty import certainty, analysis_cache_stats
+from cqa.sources.batch import check_queries, check_databases
+from cqa.sources.answers import certain_answers
+from cqa.sources.parseur import parse
+from cqa.sources.csv_loader import load_csv_database
+from cqa.sources.jobs import JobManager, QueueFull, FINISHED
+from cqa.sources.request_log import RequestLog, query_hash
+from cqa.sources.graph_images import GraphImages, FORMATS
+from cqa.sources.attack_graph import graph_description, graph_signature
+from cqa.sources.tracing import LEVELS
 
 app = Flask(__name__)
 
+# Bases préchargées depuis des CSV, au démarrage :
+# CQA_DATABASES="nom=chemin/manifest.json,autre=chemin/repertoire"
+# Une requête les désigne par leur nom (champ 'database').
+DATABASES = {}
+for entry in filter(None, os.environ.get('CQA_DATABASES', '').split(',')):
+    name, _, path = entry.partition('=')
+    print(f"Loading database {name.strip()} from {path.strip()}")
+    DATABASES[name.strip()] = load_csv_database(path.strip())
+
 # =============================================================================
 # ----------------------------------------------------------------------- index
 @app.route('/', methods=['GET'])
@@ -32,59 +50,364 @@ def send_src_file(path):
     return send_file(os.path.join('src', path))
 
 # ------------------------------------------------------------------------- cqa
-@app.route('/cqa', methods=['POST'])
-def cqa():
+# Niveau de trace par défaut des réponses (off, summary, steps, debug) ; une
+# requête peut le changer par son champ 'trace'.
+TRACE_LEVEL = os.environ.get('CQA_TRACE_LEVEL', 'steps')
+TRACE_MAX_EVENTS = int(os.environ.get('CQA_TRACE_MAX_EVENTS', 10_000))
+
+
+def _check_secret(body=True):
     """
-    Fonction pour traiter les requêtes de cqa.
+    Vérifie la clé secrète et, si `body`, la présence d'un corps JSON.
+    :return: None, ou la réponse d'erreur
     """
     if 'Secret' not in request.headers:
         return 'No secret key provided', 400
     if request.headers['Secret'] != '@zeer-sdf-zertik-234kj':
         return 'Invalid secret key', 400
-    if request.json is None:
+    if body and request.json is None:
         return 'No data received', 400
+    return None
+
+
+def _read_request():
+    """
+    Vérifie la requête HTTP (clé secrète, texte, base préchargée, niveau de
+    trace).
+    :return: (texte, nom de la base, niveau de trace, None)
+        ou (None, None, None, réponse d'erreur)
+    """
+    error = _check_secret()
+    if error is not None:
+        return None, None, None, error
     if 'query' not in request.json:
-        return 'No query received', 400
+        return None, None, None, ('No query received', 400)
 
     text = request.json['query']
     if not isinstance(text, str):
-        return 'Invalid query format', 400
+        return None, None, None, ('Invalid query format', 400)
     if len(text) == 0:
-        return 'Empty query', 400
-    
-    # Sauvegarde du texte dans un fichier
-    with open('queries.txt', 'a') as f:
-        line = "-" * 79 + "\n"
-        ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-        f.write(line)
-        f.write(f"IP: {ip}\n")
-        f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(text + "\n")
-        f.write(line)
-        f.write("\n")
-    
-    data, guarded, graph, cycle, certain, rewrite, latex, trace = certainty(text, graph_png=True)
-
-    res = {
+        return None, None, None, ('Empty query', 400)
+
+    database_name = request.json.get('database')
+    if database_name is not None and database_name not in DATABASES:
+        return None, None, None, ('Unknown database', 400)
+    trace_level = request.json.get('trace', TRACE_LEVEL)
+    if trace_level not in LEVELS:
+        return None, None, None, ('Invalid trace level', 400)
+    return text, database_name, trace_level, None
+
+
+# Journal des requêtes (JSON lines, écrit en arrière-plan, rotation par taille)
+request_log = RequestLog(
+    os.environ.get('CQA_LOG_PATH', 'queries.jsonl'),
+    max_bytes=int(os.environ.get('CQA_LOG_MAX_BYTES', 10_000_000)),
+    )
+
+
+def _log_query(text, database_name, outcome, timings=None, **fields):
+    request_log.record(
+        ip=request.headers.get('X-Forwarded-For', request.remote_addr),
+        endpoint=request.path,
+        query_hash=query_hash(text),
+        query=text,
+        database=database_name,
+        timings=timings or {},
+        outcome=outcome,
+        **fields)
+
+
+# Moteur qui a décidé la certitude (stats['engine']).
+ENGINES = {
+    'fo': 'FO rewriting compiled into a plan',
+    'iscertain': 'IsCertain search',
+    }
+
+
+def run_certainty(text, database_name=None, trace_level=TRACE_LEVEL):
+    """
+    Calcule la certitude et renvoie la réponse (dict sérialisable en JSON).
+    La trace est limitée à CQA_TRACE_MAX_EVENTS évènements. 'metrics' donne
+    les temps réel et CPU de chaque étape et les compteurs de la recherche.
+    Exécutée directement par /cqa, ou dans le processus d'un job.
+    L'image du graphe n'est pas rendue ici : la réponse ne contient que son
+    URL (graph_image), servie par /cqa/graph/. 'engine' décrit le moteur
+    qui a répondu (ENGINES) : 'rewrite' n'est pas ce qui est évalué.
+    :return: (réponse, description du graphe à enregistrer ou None)
+    """
+    database = DATABASES.get(database_name)
+    data, guarded, graph, cycle, certain, rewrite, latex, trace, stats = certainty(
+        text, graph_png=False, database=database, trace_level=trace_level,
+        max_trace_events=TRACE_MAX_EVENTS)
+    if database is not None:
+        # La base préchargée n'est pas renvoyée, seulement son nom
+        data = dict(data, database=database_name)
+
+    description = graph_description(graph['base']) if graph else None
+    return {
         'data': data,
         'guarded': guarded,
         'graph_txt': graph.get('txt') if graph else None,
-        'graph_png': graph.get('png') if graph else None,
+        'graph_png': None,
+        'graph_image': f"/cqa/graph/{graph_signature(description)}.png" if description else None,
         'cycle': cycle,
         'certain': certain,
+        'engine': ENGINES.get(stats.get('engine')),
         'rewrite': rewrite,
         'latex': latex,
-        'trace': trace
-    }
+        'trace': trace,
+        'metrics': stats.get('metrics'),
+        'stats': stats
+    }, description
+
+
+def _register_graph(result):
+    # Enregistre le graphe d'un job terminé (dans ce processus-ci)
+    res, description = result
+    if description is not None:
+        graph_images.register(description)
+    return res
+
+
+@app.route('/cqa', methods=['POST'])
+def cqa():
+    """
+    Fonction pour traiter les requêtes de cqa.
+    """
+    text, database_name, trace_level, error = _read_request()
+    if error is not None:
+        return error
+
+    start = time.perf_counter()
+    try:
+        res = _register_graph(run_certainty(text, database_name, trace_level))
+    except Exception as e:
+        _log_query(text, database_name, {'error': f"{type(e).__name__}: {e}"},
+                   {'total': time.perf_counter() - start})
+        raise
+    timings = dict(res['stats'].get('timings', {}), total=time.perf_counter() - start)
+    _log_query(text, database_name, {
+        'guarded': res['guarded'],
+        'cycle': res['cycle'],
+        'certain': res['certain'],
+        'engine': res['stats'].get('engine'),
+        'analysis_cache': res['stats'].get('analysis_cache'),
+        }, timings)
 
     return json.dumps(res), 200, {'Content-Type': 'application/json'}
 
 
-print("Starting server...")
-waitress.serve(
-    app, 
-    host='0.0.0.0', 
-    port=8080,
-    threads=8,
-    backlog=100,
-    )
\ No newline at end of file
+# ------------------------------------------------------------------- cqa/batch
+# Lots de requêtes : nombre maximal d'éléments, et processus de calcul
+BATCH_MAX_ITEMS = int(os.environ.get('CQA_BATCH_MAX_ITEMS', 10_000))
+BATCH_WORKERS = int(os.environ.get('CQA_BATCH_WORKERS', 1))
+
+
+@app.route('/cqa/batch', methods=['POST'])
+def cqa_batch():
+    """
+    Certitude d'un lot, 'items' étant une liste de textes :
+      - avec 'database' (nom d'une base préchargée) : les items sont des
+        requêtes (@query), toutes évaluées sur cette base ;
+      - avec 'query' (texte @query) : les items sont des bases (@database),
+        la requête est évaluée sur chacune.
+    Réponse en JSON lines, une ligne par item dans l'ordre des items, envoyée
+    au fil du calcul : {index, certain, guarded, cycle, engine,
+    analysis_cache, error, time}. Une erreur sur un item (texte mal formé)
+    n'interrompt pas le lot.
+    """
+    error = _check_secret()
+    if error is not None:
+        return error
+    items = request.json.get('items')
+    if not isinstance(items, list) or not all(isinstance(i, str) for i in items):
+        return 'Invalid items format', 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return 'Too many items', 400
+
+    database_name = request.json.get('database')
+    query = request.json.get('query')
+    if (database_name is None) == (query is None):
+        return "Exactly one of 'database' and 'query' expected", 400
+    if database_name is not None:
+        if database_name not in DATABASES:
+            return 'Unknown database', 400
+        results = check_queries(items, DATABASES[database_name], workers=BATCH_WORKERS)
+    else:
+        if not isinstance(query, str) or len(query) == 0:
+            return 'Invalid query format', 400
+        try:
+            results = check_databases(query, items, workers=BATCH_WORKERS)
+        except ValueError as e:
+            return f'Invalid query: {e}', 400
+
+    def stream():
+        for res in results:
+            text = items[res['index']] if query is None else query
+            _log_query(text, database_name, {
+                'guarded': res.get('guarded'),
+                'cycle': res.get('cycle'),
+                'certain': res['certain'],
+                'engine': res.get('engine'),
+                'error': res['error'],
+                }, {'total': res['time']}, batch_item=res['index'])
+            yield json.dumps(res) + '\n'
+
+    return Response(stream_with_context(stream()), 200, content_type='application/x-ndjson')
+
+
+# ----------------------------------------------------------------- cqa/answers
+@app.route('/cqa/answers', methods=['POST'])
+def cqa_answers():
+    """
+    Réponses certaines d'une requête pour les variables libres 'free' (liste
+    de noms). Réponse en JSON lines, envoyée au fil du calcul : une ligne
+    {"answer": [valeurs…]} par réponse confirmée, puis une ligne
+    {"stats": {…}} (moteur, candidats vérifiés, réponses).
+    """
+    text, database_name, _, error = _read_request()
+    if error is not None:
+        return error
+    free = request.json.get('free')
+    if not isinstance(free, list) or not all(isinstance(v, str) for v in free):
+        return 'Invalid free variables', 400
+    database = DATABASES.get(database_name)
+    stats = {}
+    try:
+        data = parse(text, require_database=database is None)
+        if database is None:
+            database = data['database']
+        answers = certain_answers(data['query'], database, free, stats=stats)
+    except ValueError as e:
+        return f'Invalid query: {e}', 400
+
+    def stream():
+        start = time.perf_counter()
+        for values in answers:
+            yield json.dumps({'answer': list(values)}) + '\n'
+        _log_query(text, database_name, {
+            'engine': stats.get('engine'),
+            'candidates': stats.get('candidates'),
+            'answers': stats.get('answers'),
+            }, {'total': time.perf_counter() - start}, free=free)
+        yield json.dumps({'stats': stats}) + '\n'
+
+    return Response(stream_with_context(stream()), 200, content_type='application/x-ndjson')
+
+
+# -------------------------------------------------------------------- cqa/jobs
+# Calculs longs en arrière-plan : un nombre borné de jobs en parallèle, une
+# file d'attente bornée et un délai maximal par job.
+JOB_MAX_TIMEOUT = float(os.environ.get('CQA_JOB_TIMEOUT', 300))
+jobs = JobManager(
+    workers=int(os.environ.get('CQA_JOB_WORKERS', 2)),
+    max_queue=int(os.environ.get('CQA_JOB_QUEUE', 32)),
+    timeout=JOB_MAX_TIMEOUT,
+    )
+
+
+def _job_response(job, code=200):
+    return json.dumps(job.to_dict()), code, {'Content-Type': 'application/json'}
+
+
+@app.route('/cqa/jobs', methods=['POST'])
+def cqa_job_submit():
+    """
+    Soumet un calcul en arrière-plan. Champs optionnels : 'timeout' (en
+    secondes, borné par CQA_JOB_TIMEOUT) et 'wait' (attente maximale de la
+    réponse, pour que les requêtes rapides aient leur résultat directement).
+    Renvoie 200 si le job est déjà terminé, 202 sinon.
+    """
+    text, database_name, trace_level, error = _read_request()
+    if error is not None:
+        return error
+    try:
+        timeout = min(float(request.json.get('timeout', JOB_MAX_TIMEOUT)), JOB_MAX_TIMEOUT)
+        wait = min(float(request.json.get('wait', 0)), 10.0)
+    except (TypeError, ValueError):
+        return 'Invalid timeout', 400
+
+    try:
+        job = jobs.submit(run_certainty, text, database_name, trace_level, timeout=timeout,
+                          on_done=_register_graph)
+    except QueueFull:
+        _log_query(text, database_name, {'status': 'rejected'})
+        return 'Too many pending jobs', 503
+    _log_query(text, database_name, {'status': 'queued'}, job=job.id)
+    if wait > 0:
+        jobs.wait(job.id, wait)
+    return _job_response(job, 200 if job.status in FINISHED else 202)
+
+
+@app.route('/cqa/jobs/<job_id>', methods=['GET'])
+def cqa_job_status(job_id):
+    """
+    État d'un job, avec son résultat s'il est terminé.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return 'Unknown job', 404
+    return _job_response(job)
+
+
+@app.route('/cqa/jobs/<job_id>', methods=['DELETE'])
+def cqa_job_cancel(job_id):
+    """
+    Annule un job en attente ou en cours.
+    """
+    job = jobs.cancel(job_id)
+    if job is None:
+        return 'Unknown job', 404
+    return _job_response(job)
+
+
+# ------------------------------------------------------------------- cqa/graph
+# Images des graphes d'attaque, rendues à la demande et gardées en cache
+graph_images = GraphImages(maxsize=int(os.environ.get('CQA_GRAPH_CACHE', 256)))
+
+
+@app.route('/cqa/graph/<signature>.<fmt>', methods=['GET'])
+def cqa_graph(signature, fmt):
+    """
+    Image (png ou svg) d'un graphe d'attaque, identifiée par sa signature.
+    L'image ne dépend que de la signature : ETag et cache long côté client.
+    """
+    if fmt not in FORMATS:
+        return 'Unsupported format', 400
+    etag = f'"{signature}.{fmt}"'
+    if request.headers.get('If-None-Match') == etag:
+        return '', 304, {'ETag': etag}
+    try:
+        img = graph_images.image(signature, fmt)
+    except ImportError:
+        return 'graphviz not installed', 503
+    if img is None:
+        return 'Unknown graph', 404
+    return img, 200, {
+        'Content-Type': FORMATS[fmt],
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=86400, immutable',
+        }
+
+
+# ------------------------------------------------------------------- cqa/cache
+@app.route('/cqa/cache', methods=['GET'])
+def cqa_cache():
+    """
+    Compteurs du cache d'analyse des requêtes.
+    """
+    error = _check_secret(body=False)
+    if error is not None:
+        return error
+    return json.dumps(analysis_cache_stats()), 200, {'Content-Type': 'application/json'}
+
+
+if __name__ == "__main__":
+    print("Starting server...")
+    waitress.serve(
+        app,
+        host='0.0.0.0',
+        port=8080,
+        threads=8,
+        backlog=100,
+        )
\ No newline at end of file
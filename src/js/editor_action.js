@@ -117,7 +117,15 @@ EditorExecuteBtn.addEventListener("click", function () {
             graphePngDiv.appendChild(titleGraphePng);
             const contentGraphePng = document.createElement("img");
             contentGraphePng.classList.add("res_content");
-            if (data.graph_png) {
+            if (data.graph_image) {
+                // image rendue et mise en cache par le serveur, chargée à part
+                contentGraphePng.src = data.graph_image;
+                contentGraphePng.alt = "Graphe png";
+                contentGraphePng.onerror = function () {
+                    this.onerror = null;
+                    this.src = "data:image/svg+xml;base64," + btoa(emptySvg);
+                };
+            } else if (data.graph_png) {
                 contentGraphePng.src = "data:image/png;base64," + data.graph_png;
                 contentGraphePng.alt = "Graphe png";
             } else {